@@ -0,0 +1,146 @@
+import asyncio
+
+from gridfsfetch import (FILES_PROJECTION, CHUNKS_PROJECTION, CHUNKS_SORT, preallocate_blobs, write_chunk,
+                         blob_results, batched, decode_arrays, merge_cached)
+from imagepyramid import pyramid_ids
+
+
+async def read_blobs_async(db, file_ids, metadata=None, bucket="fs", cache=None):
+    """
+    asyncio version of gridfsfetch.read_blobs for a database of pymongo's AsyncMongoClient
+    (or Motor): one fs.files query and one fs.chunks cursor for all file_ids. The local cache, if
+    any, is read and written on a worker thread.
+
+    Returns:
+        dict: file_id -> bytearray with the file content, or NoFile / CorruptGridFile.
+    """
+    file_ids = list(dict.fromkeys(file_ids))
+    if cache is not None:
+        metadata = {} if metadata is None else metadata
+        cached = await asyncio.to_thread(cache.get_many, file_ids, metadata)
+        missed = [file_id for file_id in file_ids if file_id not in cached]
+        if not missed:  # Fully cached batch: no query at all
+            return {file_id: cached[file_id] for file_id in file_ids}
+        blobs = await read_blobs_async(db, missed, metadata, bucket)
+        return await asyncio.to_thread(merge_cached, file_ids, cached, blobs, cache, metadata)
+
+    files = {file["_id"]: file async for file in db[f"{bucket}.files"].find({"_id": {"$in": file_ids}},
+                                                                            FILES_PROJECTION)}
+    blobs, received = preallocate_blobs(files)
+
+    if blobs:
+        chunks = db[f"{bucket}.chunks"].find({"files_id": {"$in": list(blobs)}}, CHUNKS_PROJECTION)
+        async for chunk in chunks.sort(CHUNKS_SORT):
+            write_chunk(chunk, files, blobs, received)
+
+    return blob_results(file_ids, files, blobs, received, metadata, bucket)
+
+
+async def stream_samples(db, collection, criteria, concurrency=256, documents_in_flight=64, batch_size=8,
+                         process=None, min_image_shape=None, cache=None, **find_kwargs):
+    """
+    Streams training samples straight from the collection.find cursor, one per RGB/NIR pair.
+
+    Every matching document is loaded as soon as the cursor returns it: its LiDAR cloud, its
+    weather blob and its images in bulk reads of batch_size pairs, all awaited concurrently. A
+    semaphore caps the reads in flight across documents, so one process keeps hundreds of reads
+    pending on a high-latency database without threads. Weather blobs are read once per stream and
+    shared by every document that references them.
+
+    Args:
+        db: Database of an AsyncMongoClient holding the GridFS bucket.
+        collection: Collection of the same client to query.
+        criteria (dict): Query filter, e.g. the criteria of the training scripts.
+        concurrency (int): Maximum number of bulk GridFS reads in flight.
+        documents_in_flight (int): Maximum number of documents being loaded at once.
+        batch_size (int): RGB/NIR pairs per bulk image read.
+        process (callable): Optional function of a sample returning the sample to yield, run with
+            asyncio.to_thread, e.g. image resizing. If it raises, the exception is yielded instead.
+        min_image_shape (tuple): (rows, cols) the images are resized to; the smallest stored
+            pyramid level covering it is read instead of the full-resolution images.
+        cache (LocalBlobCache): Node-local blob cache consulted before MongoDB.
+        **find_kwargs: Forwarded to collection.find (projection, sort, limit, ...).
+
+    Yields:
+        dict: 'document', 'rgb_id', 'nir_id' and the decoded 'rgb', 'nir', 'weather' and 'lidar'
+        inputs plus the 'lidar_metadata' of the cloud. Any input that could not be read is the
+        exception raised while reading it. Samples come out in completion order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    weather_reads = {}  # weather_id -> task, shared across documents
+
+    async def read_arrays(file_ids, metadata=None):
+        metadata = {} if metadata is None else metadata  # The codec of every file is in its metadata
+        async with semaphore:
+            blobs = await read_blobs_async(db, file_ids, metadata, cache=cache)
+        return decode_arrays(blobs, metadata)
+
+    async def read_one(file_id, metadata=None):
+        array = (await read_arrays([file_id], metadata))[file_id]
+        if isinstance(array, Exception):
+            raise array
+        return array
+
+    async def read_weather(weather_id):
+        if weather_id not in weather_reads:
+            weather_reads[weather_id] = asyncio.ensure_future(read_one(weather_id))
+        return await asyncio.shield(weather_reads[weather_id])  # Cancelling one reader keeps it for the others
+
+    async def load_document(document):
+        if min_image_shape is None:
+            pairs = list(zip(document.get('rgbimage_ids', []), document.get('nirimage_ids', [])))
+        else:
+            pairs = list(zip(pyramid_ids(document, 'rgbimage', min_image_shape),
+                             pyramid_ids(document, 'nirimage', min_image_shape)))
+        lidar_metadata = {}
+        lidar, weather, *image_batches = await asyncio.gather(
+            read_one(document.get('lidar_id'), lidar_metadata),
+            read_weather(document.get('weather_id')),
+            *[read_arrays([image_id for pair in batch for image_id in pair]) for batch in batched(pairs, batch_size)],
+            return_exceptions=True,
+        )
+
+        images = {}
+        for batch, arrays in zip(batched(pairs, batch_size), image_batches):
+            for image_id in [image_id for pair in batch for image_id in pair]:
+                # A failed bulk read fails every image of the batch
+                images[image_id] = arrays if isinstance(arrays, Exception) else arrays[image_id]
+
+        samples = [{
+            'document': document,
+            'rgb_id': rgb_id,
+            'nir_id': nir_id,
+            'rgb': images[rgb_id],
+            'nir': images[nir_id],
+            'weather': weather,
+            'lidar': lidar,
+            'lidar_metadata': lidar_metadata.get(document.get('lidar_id')),
+        } for rgb_id, nir_id in pairs]
+
+        if process is not None:
+            samples = await asyncio.gather(*[asyncio.to_thread(process, sample) for sample in samples],
+                                           return_exceptions=True)
+        return samples
+
+    pending = set()
+    try:
+        async for document in collection.find(criteria, **find_kwargs):
+            pending.add(asyncio.ensure_future(load_document(document)))
+            if len(pending) < documents_in_flight:
+                continue
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for sample in task.result():
+                    yield sample
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for sample in task.result():
+                    yield sample
+
+    finally:
+        # The consumer stopped early or failed: drop the loads still running
+        for task in [*pending, *weather_reads.values()]:
+            task.cancel()
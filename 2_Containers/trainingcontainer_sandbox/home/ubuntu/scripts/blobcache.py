@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+
+from gridfsfetch import read_arrays
+
+
+class BlobCache:
+    """
+    In-memory LRU cache of decoded GridFS blobs keyed by ObjectId.
+
+    Weather arrays are shared by every image pair of a document and by every plot of the same
+    date and location, so without a cache the same blob is fetched and np.load-ed many times per
+    run. Entries are budgeted by their decoded size and the least recently used ones are dropped
+    once the cache grows beyond max_bytes. Cached arrays are returned read-only, since every
+    caller shares the same object. The cache can be shared by fetch threads; two threads missing
+    the same id at once may both read it from GridFS.
+    """
+
+    def __init__(self, db, max_bytes=2 * 1024 ** 3, local_cache=None):
+        """
+        Args:
+            db (Database): Database whose GridFS bucket the blobs are read from on a miss.
+            max_bytes (int): Memory budget of the decoded arrays.
+            local_cache (LocalBlobCache): Node-local cache of the encoded blobs, read before GridFS.
+        """
+        self.db = db
+        self.local_cache = local_cache
+        self.max_bytes = max_bytes
+        self.hits, self.misses = 0, 0
+        self._blobs = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, file_id):
+        """
+        Returns the decoded array stored under file_id, reading it from GridFS on a miss.
+
+        Args:
+            file_id (ObjectId): GridFS id of an encoded array.
+
+        Returns:
+            numpy array: Read-only decoded array. GridFS and decoding errors propagate to the caller.
+        """
+        blob = self.get_many([file_id])[file_id]
+        if isinstance(blob, Exception):
+            raise blob
+        return blob
+
+    def get_many(self, file_ids):
+        """
+        Returns the decoded arrays of many ids, reading all misses with a single read_arrays call.
+
+        Args:
+            file_ids (list): GridFS ids of encoded arrays.
+
+        Returns:
+            dict: file_id -> read-only decoded array, or the exception raised while reading it.
+        """
+        blobs, missing = {}, []
+        with self._lock:
+            for file_id in dict.fromkeys(file_ids):
+                blob = self._blobs.get(file_id)
+                if blob is None:
+                    missing.append(file_id)
+                    continue
+                self._blobs.move_to_end(file_id)  # Mark as most recently used
+                blobs[file_id] = blob
+            self.hits += len(blobs)
+            self.misses += len(missing)
+
+        # Read outside the lock so misses of different threads overlap
+        if missing:
+            for file_id, blob in read_arrays(self.db, missing, cache=self.local_cache).items():
+                if not isinstance(blob, Exception):
+                    blob.flags.writeable = False
+                    self.put(file_id, blob)
+                blobs[file_id] = blob
+
+        return blobs
+
+    def put(self, file_id, blob):
+        """
+        Stores a decoded array and drops the least recently used entries if over budget.
+        Arrays larger than the whole budget are not cached.
+        """
+        if blob.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if file_id in self._blobs:
+                self._total_bytes -= self._blobs.pop(file_id).nbytes
+            self._blobs[file_id] = blob
+            self._total_bytes += blob.nbytes
+
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._blobs.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+
+    def print_stats(self):
+        """Prints hit/miss counters and the current cache size."""
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0.0
+        print(f"Blob cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+              f"{self._total_bytes / 1024 ** 2:.1f} MiB in {len(self._blobs)} blobs")
@@ -0,0 +1,172 @@
+from io import BytesIO
+
+import numpy as np
+
+# Compression libraries are optional: a codec whose library is missing raises on use, so files
+# written with the other codecs stay readable
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+ZSTD_LEVEL = 3  # zstd levels above ~6 cost much more encode time for a few percent of size
+PNG_LEVEL = 3  # zlib level 0-9 of PNG, decode speed barely depends on it
+
+
+def npy_bytes(array):
+    """np.save-s an array into bytes, the format of the 'raw' codec."""
+    buffer = BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def npy_array(blob):
+    """Inverse of npy_bytes."""
+    return np.load(BytesIO(blob))
+
+
+def require(module, codec, package):
+    """Raises ImportError if the library of a codec is missing."""
+    if module is None:
+        raise ImportError(f"The {codec} blob codec needs the {package} package")
+
+
+def encode_zstd(array):
+    require(zstandard, "zstd", "zstandard")
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(npy_bytes(array))
+
+
+def decode_zstd(blob):
+    require(zstandard, "zstd", "zstandard")
+    return npy_array(zstandard.ZstdDecompressor().decompress(blob))
+
+
+def encode_lz4(array):
+    require(lz4, "lz4", "lz4")
+    return lz4.frame.compress(npy_bytes(array))
+
+
+def decode_lz4(blob):
+    require(lz4, "lz4", "lz4")
+    return npy_array(lz4.frame.decompress(blob))
+
+
+def png_supported(array):
+    """PNG holds uint8 images with 1, 3 or 4 channels."""
+    return array.dtype == np.uint8 and (array.ndim == 2 or (array.ndim == 3 and array.shape[2] in (1, 3, 4)))
+
+
+def encode_png(array):
+    """
+    PNG with OpenCV when available (it releases the GIL), else Pillow. Channels are stored in RGB
+    order either way, so the files open with the right colours in any viewer.
+    """
+    if not png_supported(array):
+        raise ValueError(f"The png blob codec needs a uint8 image, got {array.dtype} {array.shape}")
+    if cv2 is not None:
+        image = array
+        if array.ndim == 3 and array.shape[2] in (3, 4):
+            image = cv2.cvtColor(array, cv2.COLOR_RGB2BGR if array.shape[2] == 3 else cv2.COLOR_RGBA2BGRA)
+        ok, encoded = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, PNG_LEVEL])
+        if not ok:
+            raise ValueError(f"OpenCV failed to encode a {array.shape} image as PNG")
+        return encoded.tobytes()
+
+    require(Image, "png", "opencv-python or Pillow")
+    buffer = BytesIO()
+    Image.fromarray(array.squeeze(axis=2) if array.ndim == 3 and array.shape[2] == 1 else array).save(
+        buffer, format="PNG", compress_level=PNG_LEVEL)
+    return buffer.getvalue()
+
+
+def decode_png(blob):
+    if cv2 is not None:
+        image = cv2.imdecode(np.frombuffer(blob, np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError("OpenCV failed to decode a PNG blob")
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB if image.shape[2] == 3 else cv2.COLOR_BGRA2RGBA)
+        return image
+
+    require(Image, "png", "opencv-python or Pillow")
+    with Image.open(BytesIO(blob)) as image:
+        return np.array(image)
+
+
+# Codec name -> (encode array -> bytes, decode bytes -> array)
+CODECS = {
+    "raw": (npy_bytes, npy_array),
+    "zstd": (encode_zstd, decode_zstd),
+    "lz4": (encode_lz4, decode_lz4),
+    "png": (encode_png, decode_png),
+}
+
+
+def available_codecs():
+    """Codecs whose libraries are installed."""
+    missing = {"zstd": zstandard is None, "lz4": lz4 is None, "png": cv2 is None and Image is None}
+    return [codec for codec in CODECS if not missing.get(codec)]
+
+
+def image_codec(array, codec):
+    """codec for images it can hold, 'raw' for the others (e.g. float or uint16 images with png)."""
+    return codec if codec != "png" or png_supported(array) else "raw"
+
+
+def encode_array(array, codec="raw"):
+    """
+    Encodes an array for GridFS.
+
+    Args:
+        array (numpy array): Array to store.
+        codec (str): 'raw' (np.save bytes), 'zstd' or 'lz4' (compressed np.save bytes), or 'png'
+            (uint8 images only).
+
+    Returns:
+        tuple: (bytes, metadata) where metadata is the dict to merge into the GridFS file metadata
+        so decode_blob can find the codec, e.g. {"codec": "zstd"}. PNG does not keep a trailing
+        channel axis of 1, so its metadata also records the shape.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown blob codec {codec!r}, expected one of {list(CODECS)}")
+    metadata = {"codec": codec}
+    if codec == "png":
+        metadata["shape"] = list(array.shape)
+    return CODECS[codec][0](array), metadata
+
+
+def decode_blob(blob, metadata=None):
+    """
+    Decodes a GridFS blob written by encode_array.
+
+    Args:
+        blob (bytes): File content.
+        metadata (dict): GridFS metadata of the file. Files without a codec entry were written with
+            np.save before codecs existed and are decoded as 'raw'.
+
+    Returns:
+        numpy array: The stored array.
+    """
+    metadata = metadata or {}
+    codec = metadata.get("codec", "raw")
+    if codec not in CODECS:
+        raise ValueError(f"Unknown blob codec {codec!r}")
+    array = CODECS[codec][1](blob)
+    if codec == "png":
+        array = array.reshape(metadata["shape"])
+    return array
@@ -0,0 +1,168 @@
+import math
+
+import numpy as np
+
+# Bin width of the streaming histogram of every scalar input that gets one: labels in days and
+# t/ha (yield is divided by 1000 when loaded), dates in days
+HISTOGRAM_WIDTHS = {
+    'yield': 0.1, 'flowering': 1.0, 'maturity': 1.0,
+    'seedingdate': 1.0, 'imagedate': 1.0,
+}
+
+
+def new_input_stats(bin_width=None):
+    return {
+        'samples': 0, 'count': 0, 'nan': 0, 'posinf': 0, 'neginf': 0,
+        'min': None, 'max': None, 'mean': 0.0, 'm2': 0.0,
+        'bin_width': bin_width, 'histogram': {} if bin_width else None,
+    }
+
+
+def merge_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    """
+    Count, mean and sum of squared deviations of two sets of values combined (Chan et al.), the
+    parallel form of Welford's update: one sample's array, or another shard's statistics, is
+    merged in one step without revisiting any value.
+    """
+    count = count_a + count_b
+    if not count:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    m2 = m2_a + m2_b + delta * delta * count_a * count_b / count
+    return count, mean, m2
+
+
+class DatasetStats:
+    """
+    Validation and summary statistics of the training inputs, accumulated sample by sample while
+    they are loaded.
+
+    For every input it counts the NaN and +/-Inf values and keeps the min, max, mean and variance
+    of the finite values (Welford, merged per sample array), and a histogram of fixed bin width for
+    the scalar inputs of HISTOGRAM_WIDTHS. Each sample is looked at once, while it is still in the
+    CPU cache, instead of the extra full passes of np.isnan / np.isinf and np.histogram over the
+    finished arrays. SampleArrays and FeatureStoreWriter update their stats on every append, and
+    the feature store keeps them in its manifest, so later runs read them instead of validating.
+    Stats of several stores (e.g. the parts of a sharded extraction) combine with merge.
+    """
+
+    def __init__(self, histogram_widths=HISTOGRAM_WIDTHS):
+        """
+        Args:
+            histogram_widths (dict): Input name -> histogram bin width, for scalar inputs.
+        """
+        self.histogram_widths = histogram_widths
+        self.inputs = {}  # name -> dict of new_input_stats
+
+    def update(self, sample):
+        """Adds one sample, given as a dict of input name -> array or scalar, like SampleArrays.append."""
+        for name, value in sample.items():
+            self._update_input(name, np.asarray(value))
+
+    def _update_input(self, name, value):
+        stats = self.inputs.get(name)
+        if stats is None:
+            stats = self.inputs[name] = new_input_stats(self.histogram_widths.get(name) if value.ndim == 0 else None)
+        stats['samples'] += 1
+
+        if value.dtype.kind == 'f':
+            finite = np.isfinite(value)
+            if not finite.all():
+                stats['nan'] += int(np.isnan(value).sum())
+                stats['posinf'] += int(np.isposinf(value).sum())
+                stats['neginf'] += int(np.isneginf(value).sum())
+                value = value[finite]
+        if not value.size:
+            return
+
+        low, high = float(value.min()), float(value.max())
+        # Sum in 64 bits; squared deviations as a BLAS dot product, in float32 unless the input is
+        # float64 (relative error ~1e-6, far below what normalization or validation needs)
+        mean = float(value.sum(dtype=np.float64 if value.dtype.kind == 'f' else np.int64)) / value.size
+        deviations = np.subtract(value.reshape(-1), mean, dtype=np.float64 if value.dtype == np.float64 else np.float32)
+        m2 = float(np.dot(deviations, deviations))
+        stats['min'] = low if stats['min'] is None else min(stats['min'], low)
+        stats['max'] = high if stats['max'] is None else max(stats['max'], high)
+        stats['count'], stats['mean'], stats['m2'] = merge_moments(
+            stats['count'], stats['mean'], stats['m2'], int(value.size), mean, m2)
+
+        if stats['histogram'] is not None:
+            key = str(math.floor(float(value) / stats['bin_width']))
+            stats['histogram'][key] = stats['histogram'].get(key, 0) + 1
+
+    def merge(self, other):
+        """Adds the statistics of another DatasetStats, e.g. of another shard, to these."""
+        for name, theirs in other.inputs.items():
+            ours = self.inputs.get(name)
+            if ours is None:
+                self.inputs[name] = {**theirs, 'histogram': dict(theirs['histogram'])
+                                     if theirs['histogram'] is not None else None}
+                continue
+            for key in ('samples', 'nan', 'posinf', 'neginf'):
+                ours[key] += theirs[key]
+            for key, pick in (('min', min), ('max', max)):
+                values = [value for value in (ours[key], theirs[key]) if value is not None]
+                ours[key] = pick(values) if values else None
+            ours['count'], ours['mean'], ours['m2'] = merge_moments(
+                ours['count'], ours['mean'], ours['m2'], theirs['count'], theirs['mean'], theirs['m2'])
+            if ours['histogram'] is not None and theirs['histogram'] is not None:
+                for key, count in theirs['histogram'].items():
+                    ours['histogram'][key] = ours['histogram'].get(key, 0) + count
+        return self
+
+    def nonfinite(self, name):
+        """Number of NaN and Inf values of an input."""
+        stats = self.inputs[name]
+        return stats['nan'] + stats['posinf'] + stats['neginf']
+
+    def std(self, name):
+        """Standard deviation of the finite values of an input."""
+        stats = self.inputs[name]
+        return math.sqrt(stats['m2'] / stats['count']) if stats['count'] else float('nan')
+
+    def histogram(self, name, num_bins=10):
+        """
+        Histogram of a scalar input in num_bins equal bins between its min and max, like
+        np.histogram(data, bins=num_bins), from the fixed-width streaming bins.
+
+        Every streaming bin is counted in the bin holding its center, so edges are exact to one
+        bin width of HISTOGRAM_WIDTHS.
+
+        Returns:
+            tuple: (counts, edges) arrays of num_bins and num_bins + 1 values.
+        """
+        stats = self.inputs[name]
+        edges = np.linspace(stats['min'], stats['max'], num_bins + 1)
+        counts = np.zeros(num_bins, dtype=np.int64)
+        for key, count in stats['histogram'].items():
+            center = (int(key) + 0.5) * stats['bin_width']
+            counts[np.clip(np.searchsorted(edges, center, side='right') - 1, 0, num_bins - 1)] += count
+        return counts, edges
+
+    def print_report(self):
+        """Prints per input: samples, NaN / Inf counts, min, max, mean and std of the finite values."""
+        print("| Input | Samples | NaN | +Inf | -Inf | Min | Max | Mean | Std |")
+        print("|-------|---------|-----|------|------|-----|-----|------|-----|")
+        for name, stats in self.inputs.items():
+            print(f"| {name} | {stats['samples']} | {stats['nan']} | {stats['posinf']} | {stats['neginf']} | "
+                  f"{stats['min']} | {stats['max']} | {stats['mean']:.4g} | {self.std(name):.4g} |")
+
+    def print_distribution(self, name, label, num_bins=10):
+        """Same table as the scripts' print_distribution, from the streaming histogram of name."""
+        counts, bins = self.histogram(name, num_bins)
+        print(f"\n{label} Distribution:")
+        print("| Bin | Range | Count |")
+        print("|----|-------|-------|")
+        for i in range(num_bins):
+            print(f"| {i + 1}  | {bins[i]:.1f} - {bins[i + 1]:.1f} | {counts[i]}  |")
+
+    def to_dict(self):
+        """JSON-serializable form, kept in the feature store manifest."""
+        return {'histogram_widths': self.histogram_widths, 'inputs': self.inputs}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data['histogram_widths'])
+        stats.inputs = data['inputs']
+        return stats
@@ -0,0 +1,101 @@
+import queue
+import threading
+
+# Document fields the loaders read; everything else (plot metadata, notes, ...) stays on the server
+LOADER_FIELDS = ["id", "date", "seedingdate", "lidar_id", "weather_id",
+                 "rgbimage_ids", "nirimage_ids", "rgbimage_pyramid", "nirimage_pyramid"]
+
+_DONE = object()  # End of the cursor
+
+
+def loader_projection(labels):
+    """find() projection of LOADER_FIELDS plus the label fields, _id is always returned."""
+    return {field: 1 for field in [*LOADER_FIELDS, *labels]}
+
+
+def selection_counts(collection, criteria, limit=None):
+    """
+    Number of documents and of RGB/NIR pairs matching criteria.
+
+    Sums the precomputed n_rgb field (see eligibility.py) with one aggregation, which an
+    eligibility query runs on the index alone, so the loaders can size their arrays without
+    listing the documents first.
+
+    Args:
+        collection (Collection): Collection to query.
+        criteria (dict): Query filter.
+        limit (int): Only count the first limit documents, as find(...).limit(limit) returns.
+
+    Returns:
+        tuple: (documents, pairs).
+    """
+    counts = list(collection.aggregate([
+        {"$match": criteria},
+        *([{"$limit": limit}] if limit else []),
+        {"$group": {"_id": None, "documents": {"$sum": 1}, "pairs": {"$sum": "$n_rgb"}}},
+    ]))
+    return (counts[0]["documents"], counts[0]["pairs"]) if counts else (0, 0)
+
+
+def document_batches(collection, criteria, projection=None, batch_size=256, prefetch_batches=2, **find_kwargs):
+    """
+    Streams the documents matching criteria as lists of batch_size documents.
+
+    The cursor is read on a background thread with the same batch_size, so the server sends one
+    batch per round trip and the next prefetch_batches batches arrive while the caller is already
+    fetching the blobs of the current one: the first samples are loaded after one round trip,
+    however many documents match, and only the batches in flight are held in memory.
+
+    Args:
+        collection (Collection): Collection to query.
+        criteria (dict): Query filter.
+        projection (dict): Fields to return, e.g. loader_projection(("yield",)); all if None.
+        batch_size (int): Documents per cursor batch and per yielded list.
+        prefetch_batches (int): Batches read ahead of the caller.
+        **find_kwargs: Forwarded to collection.find (sort, limit, ...).
+
+    Yields:
+        list: Documents, in cursor order. An error of the cursor is raised in the caller.
+    """
+    batches = queue.Queue(maxsize=prefetch_batches)
+    stop = threading.Event()
+
+    def put(item):
+        # Gives up once the caller stopped iterating, instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            with collection.find(criteria, projection, batch_size=batch_size, **find_kwargs) as cursor:
+                batch = []
+                for document in cursor:
+                    batch.append(document)
+                    if len(batch) == batch_size:
+                        if not put(batch):
+                            return
+                        batch = []
+                if batch and not put(batch):
+                    return
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=read, name="document-cursor", daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is _DONE:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+        thread.join()
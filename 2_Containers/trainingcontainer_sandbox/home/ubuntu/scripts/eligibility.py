@@ -0,0 +1,139 @@
+import math
+
+# Precomputed eligibility fields of every document, so selecting training documents needs neither
+# $exists / $size on arrays nor $expr, none of which can use an index:
+#   n_rgb, n_nir           number of RGB / NIR image ids (0 when the field is missing)
+#   images_paired          n_rgb == n_nir
+#   has_lidar, has_weather, has_seedingdate
+#   has_yield, has_flowering, has_maturity    label present and not NaN
+# They are set at ingest by InsertData2MongoDB.py and on existing documents by
+# 3_MongoDB/AddEligibilityFields.py.
+INPUT_FIELDS = {"has_lidar": "lidar_id", "has_weather": "weather_id", "has_seedingdate": "seedingdate"}
+LABELS = ("yield", "flowering", "maturity")
+ELIGIBILITY_FIELDS = ("n_rgb", "n_nir", "images_paired", *INPUT_FIELDS, *[f"has_{label}" for label in LABELS])
+
+# Equality fields first, then the n_rgb range, then _id so selecting ids is covered by the index
+ELIGIBILITY_INDEX = [
+    ("year", 1), ("location", 1),
+    *[(flag, 1) for flag in INPUT_FIELDS], ("images_paired", 1),
+    *[(f"has_{label}", 1) for label in LABELS],
+    ("n_rgb", 1), ("_id", 1),
+]
+ELIGIBILITY_INDEX_NAME = "eligibility"
+
+
+def field_present(field):
+    """Aggregation expression: true if the document has field, like {"$exists": True}."""
+    return {"$ne": [{"$type": f"${field}"}, "missing"]}
+
+
+def array_size(field):
+    """Aggregation expression: length of an array field, 0 if it is missing."""
+    return {"$cond": [{"$isArray": f"${field}"}, {"$size": f"${field}"}, 0]}
+
+
+# Update pipeline computing the fields server-side, without sending documents to the client
+ELIGIBILITY_PIPELINE = [
+    {"$set": {
+        "n_rgb": array_size("rgbimage_ids"),
+        "n_nir": array_size("nirimage_ids"),
+        **{flag: field_present(field) for flag, field in INPUT_FIELDS.items()},
+        # Same test as the former {"$exists": True, "$ne": NaN}: MongoDB compares NaN equal to NaN
+        **{f"has_{label}": {"$and": [field_present(label), {"$ne": [f"${label}", float("NaN")]}]}
+           for label in LABELS},
+    }},
+    {"$set": {"images_paired": {"$eq": ["$n_rgb", "$n_nir"]}}},
+]
+
+
+def eligibility_fields(document):
+    """
+    Eligibility fields of a document about to be inserted, same values as ELIGIBILITY_PIPELINE.
+
+    Args:
+        document (dict): Document with its GridFS ids and labels.
+
+    Returns:
+        dict: Field name -> value, to merge into the document.
+    """
+    fields = {
+        "n_rgb": len(document["rgbimage_ids"]) if isinstance(document.get("rgbimage_ids"), list) else 0,
+        "n_nir": len(document["nirimage_ids"]) if isinstance(document.get("nirimage_ids"), list) else 0,
+        **{flag: field in document for flag, field in INPUT_FIELDS.items()},
+    }
+    for label in LABELS:
+        value = document.get(label)
+        fields[f"has_{label}"] = label in document and not (isinstance(value, float) and math.isnan(value))
+    fields["images_paired"] = fields["n_rgb"] == fields["n_nir"]
+    return fields
+
+
+def eligibility_query(year=None, location=None, labels=(), max_images=None):
+    """
+    Query selecting the documents with paired RGB/NIR images, LiDAR, weather, a seeding date and
+    the given labels, on the precomputed eligibility fields only.
+
+    Every condition is on ELIGIBILITY_INDEX, so matching and counting documents scan index keys
+    and fetch no document; find(query, {"_id": 1}) is fully covered by the index.
+
+    Args:
+        year (int): Year of the documents, all years if None.
+        location (str): Location of the documents, all locations if None.
+        labels (tuple): Labels that must be present and not NaN, e.g. ("yield",) or
+            ("flowering", "maturity").
+        max_images (int): Only documents with fewer RGB images than this, no limit if None.
+
+    Returns:
+        dict: Filter for collection.find / count_documents.
+    """
+    query = {}
+    if year is not None:
+        query["year"] = year
+    if location is not None:
+        query["location"] = location
+    query.update({flag: True for flag in INPUT_FIELDS})
+    query["images_paired"] = True
+    query.update({f"has_{label}": True for label in labels})
+    query["n_rgb"] = {"$gte": 1, **({"$lt": max_images} if max_images is not None else {})}
+    return query
+
+
+def update_eligibility(collection, query=None):
+    """
+    Computes the eligibility fields of the documents matching query (all by default) server-side
+    and creates ELIGIBILITY_INDEX. Safe to rerun.
+
+    Returns:
+        int: Number of documents whose fields changed.
+    """
+    result = collection.update_many(query or {}, ELIGIBILITY_PIPELINE)
+    collection.create_index(ELIGIBILITY_INDEX, name=ELIGIBILITY_INDEX_NAME)
+    return result.modified_count
+
+
+def plan_stages(plan):
+    """Stage names of an explain() plan, from the root to the leaves, e.g. ['PROJECTION_COVERED', 'IXSCAN']."""
+    plan = plan.get("queryPlan", plan)  # Slot-based engine plans wrap the classic plan
+    stages = [plan["stage"]]
+    for child in [plan.get("inputStage"), *plan.get("inputStages", [])]:
+        if child:
+            stages += plan_stages(child)
+    return stages
+
+
+def explain_summary(explain):
+    """
+    Key figures of cursor.explain() output.
+
+    Returns:
+        dict: 'stages' of the winning plan, 'keys_examined', 'docs_examined', 'returned' and
+        'time_ms' from the execution stats.
+    """
+    stats = explain["executionStats"]
+    return {
+        "stages": plan_stages(explain["queryPlanner"]["winningPlan"]),
+        "keys_examined": stats["totalKeysExamined"],
+        "docs_examined": stats["totalDocsExamined"],
+        "returned": stats["nReturned"],
+        "time_ms": stats["executionTimeMillis"],
+    }
@@ -13,7 +13,20 @@ import random
 import threading
 
 import numpy as np
-from sklearn.decomposition import PCA
+from lidarprojection import projection_pool, project_lidar_batch, check_downsampled_channels
+# Projection workers are forked now, before TensorFlow, CUDA, pymongo or any thread pool start
+# (see projection_pool), and reused for every LiDAR block of the run
+LIDAR_WORKERS = os.cpu_count()
+lidar_pool = projection_pool(LIDAR_WORKERS)
+from projectioncache import ProjectionCache
+from blobcache import BlobCache
+from localblobcache import LocalBlobCache
+from gridfsfetch import fetch_pool, fetch_ordered, read_arrays, batched, iter_batched, capture
+from imagepyramid import pyramid_ids
+from eligibility import eligibility_query
+from documentselection import loader_projection, selection_counts, document_batches
+from samplearrays import SampleArrays, IMAGE_DTYPES, COMPACT_DTYPES, peak_rss_bytes, print_memory_report
+from channelstats import NORMALIZED_INPUTS, channel_stats
 from sklearn.model_selection import train_test_split
 from tensorflow.keras import layers, regularizers, models, Model, Input
 import cv2
@@ -182,105 +195,106 @@ print("Ping to MongoDB server successful.")
 # %% Extract data from documents
 img_rows, img_cols = int(2048 / 4), int(2448 / 4)
 
-# Projection function
-def projection3x(lidar_raw):
-    # Check if the lidar data has enough points (at least 2 samples and features)
-    if lidar_raw.shape[0] < 2 or lidar_raw.shape[1] < 2:
-        raise ValueError(
-            f"Insufficient lidar data: {lidar_raw.shape[0]} samples and {lidar_raw.shape[1]} features. PCA cannot be applied.")
-
-    # Separate the data into x, y, z
-    x, y, z = lidar_raw[:, 0], lidar_raw[:, 1], lidar_raw[:, 2]
-
-    # Scale coordinates to centimeters
-    x = x * 100
-    y = y * 100
-    z = z * 100
-
-    # Set minimum of each axis to 0 cm
-    x -= np.min(x)
-    y -= np.min(y)
-    z -= np.min(z)
-
-    # PCA for dominant direction in X-Y plane (optional for rotation)
-    points = np.vstack((x, y)).T
-    pca = PCA(n_components=2)
-    pca.fit(points)
-    angle = np.arctan2(pca.components_[0, 1], pca.components_[0, 0])
-
-    # Rotate points to align with grid axes
-    rotation_matrix = np.array([
-        [np.cos(-angle), -np.sin(-angle)],
-        [np.sin(-angle), np.cos(-angle)]
-    ])
-    rotated_points = points @ rotation_matrix.T
-    rotated_x, rotated_y = rotated_points[:, 0], rotated_points[:, 1]
-
-    # Flip the x and y coordinates for X-Z and Y-Z projections if needed
-    rotated_x = np.max(rotated_x) - rotated_x  # Flip x-axis for X-Z plane
-    rotated_y = np.max(rotated_y) - rotated_y  # Flip y-axis for Y-Z plane
-
-    # Define resolution for each plane
-    xy_resolution = 1  # Adjusted to 1 cm for X-Y plane
-    xz_resolution = 1  # Adjusted to 1 cm for X-Z plane
-    yz_resolution = 1  # Adjusted to 1 cm for Y-Z plane
-
-    # Define boundaries for each plane
-    x_min, x_max = np.min(rotated_x), np.max(rotated_x)
-    y_min, y_max = np.min(rotated_y), np.max(rotated_y)
-    z_min, z_max = np.min(z), np.max(z)
-
-    # Calculate grid sizes
-    grid_x_size_xy = int((x_max - x_min) / xy_resolution) + 1
-    grid_y_size_xy = int((y_max - y_min) / xy_resolution) + 1
-    grid_x_size_xz = int((x_max - x_min) / xz_resolution) + 1
-    grid_z_size_xz = int((z_max - z_min) / xz_resolution) + 1
-    grid_y_size_yz = int((y_max - y_min) / yz_resolution) + 1
-    grid_z_size_yz = int((z_max - z_min) / yz_resolution) + 1
-
-    # Initialize grids with NaNs
-    grid_xy = np.full((grid_y_size_xy, grid_x_size_xy), np.nan, dtype=np.float32)
-    grid_xz = np.full((grid_z_size_xz, grid_x_size_xz), np.nan, dtype=np.float32)
-    grid_yz = np.full((grid_z_size_yz, grid_y_size_yz), np.nan, dtype=np.float32)
-
-    # Project Z onto X-Y plane using maximum aggregation
-    for i in range(len(rotated_x)):
-        grid_x = int((rotated_x[i] - x_min) / xy_resolution)
-        grid_y = int((rotated_y[i] - y_min) / xy_resolution)
-        if np.isnan(grid_xy[grid_y, grid_x]):
-            grid_xy[grid_y, grid_x] = z[i]
-        else:
-            grid_xy[grid_y, grid_x] = max(grid_xy[grid_y, grid_x], z[i])
-
-    # Project Z onto X-Z plane using maximum aggregation
-    for i in range(len(rotated_x)):
-        grid_x = int((rotated_x[i] - x_min) / xz_resolution)
-        grid_z = int((z[i] - z_min) / xz_resolution)
-        if np.isnan(grid_xz[grid_z, grid_x]):
-            grid_xz[grid_z, grid_x] = z[i]  # Use z[i] for the X-Z projection
-        else:
-            grid_xz[grid_z, grid_x] = max(grid_xz[grid_z, grid_x], z[i])
-
-    # Project Z onto Y-Z plane using maximum aggregation
-    for i in range(len(rotated_y)):
-        grid_y = int((rotated_y[i] - y_min) / yz_resolution)
-        grid_z = int((z[i] - z_min) / yz_resolution)
-        if np.isnan(grid_yz[grid_z, grid_y]):
-            grid_yz[grid_z, grid_y] = z[i]  # Use z[i] for the Y-Z projection
-        else:
-            grid_yz[grid_z, grid_y] = max(grid_yz[grid_z, grid_y], z[i])
-
-    # Replace NaNs with zero
-    grid_xy = np.nan_to_num(grid_xy, nan=0.0)
-    grid_xz = np.nan_to_num(grid_xz, nan=0.0)
-    grid_yz = np.nan_to_num(grid_yz, nan=0.0)
+# Parallel LiDAR projection: documents are projected in blocks across all vCPUs (LIDAR_WORKERS,
+# forked at the top of the script)
+LIDAR_BLOCK_SIZE = 64  # Documents per parallel projection batch, also the cursor batch size
+
+# Only the fields the loaders read are sent by the server
+DOCUMENT_PROJECTION = loader_projection(("flowering", "maturity"))
+
+# Concurrent GridFS reads: RGB, NIR and weather of upcoming samples are fetched on a thread pool
+FETCH_WORKERS = 32
+FETCH_IN_FLIGHT = 128  # Samples read ahead of the loop, bounds the memory held by pending reads
+FETCH_BATCH_SIZE = 8  # RGB/NIR pairs (or LiDAR clouds) per bulk read of fs.files and fs.chunks
+
+# Samples are written into arrays preallocated from the number of matched pairs, images as uint8;
+# False collects lists and converts them with np.array (briefly two copies of every input)
+PREALLOCATE_SAMPLES = True
+# Compact storage also keeps LiDAR and weather as float16 and dates/labels as float32, all scaling
+# is done by the model; False keeps them in the dtype they are loaded with
+COMPACT_STORAGE = True
+SAMPLE_DTYPES = COMPACT_DTYPES if COMPACT_STORAGE else IMAGE_DTYPES
+
+# Projections never change for a given lidar_id, so they are cached on disk across runs
+PROJECTION_CACHE_PATH = "/mnt/phenocart-work/prr000/ProjectionCache"
+PROJECTION_CACHE_BYTES = 10 * 1024 ** 3  # 10 GiB, roughly 28k projections
+BLOB_CACHE_BYTES = 2 * 1024 ** 3  # In-memory budget for decoded weather blobs shared across documents
+# Encoded GridFS blobs are also kept in a node-local directory (tmpfs or NVMe), so later jobs on the
+# node, e.g. the runs of a batch-size sweep, read them locally instead of from the dbPath on /fs.
+# None disables it.
+LOCAL_BLOB_CACHE_PATH = "/localscratch/prr000/BlobCache"  # Node-local /tmp, bound by SubmitJob.sh
+LOCAL_BLOB_CACHE_BYTES = 100 * 1024 ** 3  # 100 GiB, evicted least recently used first
+# LiDAR, weather and the dates are normalized per channel by Normalization layers holding the mean
+# and variance of the training split (chunked pass on STATS_WORKERS threads, see channelstats.py).
+# Images keep their fixed 1/255 rescaling.
+STATS_WORKERS = 8
+# LiDAR input channels as '<plane>:<stat>', e.g. add "xy:mean", "xy:density" or "xz:count"
+# (every channel is standardized with its own training-split mean and variance)
+LIDAR_CHANNELS = ["xy:max", "xz:max", "yz:max"]
+PROJECTION_KWARGS = {"resolution": 1, "output_size": (300, 100), "mode": "resize",  # "direct" skips full-res grids
+                     "channels": LIDAR_CHANNELS}
+
+# Shared by every GridFS read of the job, consulted before MongoDB
+local_blob_cache = LocalBlobCache(LOCAL_BLOB_CACHE_PATH, LOCAL_BLOB_CACHE_BYTES) if LOCAL_BLOB_CACHE_PATH else None
+
+
+def project_documents_lidar(documents, executor, fetch_executor, cache):
+    """
+    Fetches the LiDAR point cloud of each document and projects them in parallel.
 
-    # Optionally resize grids for display purposes
-    resized_grid_xy = cv2.resize(grid_xy, (300, 100), interpolation=cv2.INTER_NEAREST)
-    resized_grid_xz = cv2.resize(grid_xz, (300, 100), interpolation=cv2.INTER_NEAREST)
-    resized_grid_yz = cv2.resize(grid_yz, (300, 100), interpolation=cv2.INTER_NEAREST)
+    Args:
+        documents (list): MongoDB documents with a 'lidar_id'.
+        executor: Process pool created with projection_pool.
+        fetch_executor: Thread pool created with fetch_pool, for the concurrent GridFS reads.
+        cache (ProjectionCache): Projections already computed by earlier runs.
 
-    return np.dstack((resized_grid_xy, resized_grid_xz, resized_grid_yz))
+    Returns:
+        dict: lidar_id -> (100, 300, len(LIDAR_CHANNELS)) projection, or the exception raised while projecting it.
+    """
+    projections, pending_documents = {}, {}
+    for document in documents:
+        if document.get('lidar_id') in projections or document.get('lidar_id') in pending_documents:
+            continue
+
+        # Skip the GridFS read and the projection entirely on a cache hit
+        cached_projection = cache.get(document.get('lidar_id'))
+        if cached_projection is not None:
+            projections[document['lidar_id']] = cached_projection
+            continue
+
+        pending_documents[document.get('lidar_id')] = document
+
+    def read_lidar_batch(batch):
+        metadata = {}
+        clouds = capture(read_arrays, db, [document.get('lidar_id') for document in batch], metadata,
+                         cache=local_blob_cache)
+        if isinstance(clouds, Exception):  # A failed bulk read fails every cloud of the batch
+            return [(clouds, {})] * len(batch)
+        return [(clouds[document.get('lidar_id')], metadata.get(document.get('lidar_id')) or {}) for document in batch]
+
+    lidar_ids, lidar_clouds, lidar_angles = [], [], []
+    batches = fetch_ordered(read_lidar_batch, batched(pending_documents.values(), FETCH_BATCH_SIZE), fetch_executor)
+    for document, (lidar, lidar_metadata) in zip(pending_documents.values(), (read for batch in batches for read in batch)):
+        if lidar_metadata.get('voxel_size') is not None and not isinstance(lidar, Exception):
+            # Clouds voxel-downsampled at ingest only serve max channels at a multiple of the voxel
+            # size (an error is reported instead), and are projected with the angle of the full cloud
+            lidar = capture(check_downsampled_channels, lidar_metadata['voxel_size'],
+                            PROJECTION_KWARGS['channels'], PROJECTION_KWARGS['resolution']) or lidar
+        if isinstance(lidar, Exception):
+            print(f"Error reading lidar data for document {document.get('id', 'Unknown')}: {lidar}")
+            continue
+        lidar_ids.append(document['lidar_id'])
+        lidar_clouds.append(lidar)
+        lidar_angles.append(lidar_metadata.get('angle'))
+
+    new_projections = project_lidar_batch(lidar_clouds, executor=executor, return_exceptions=True,
+                                          angles=lidar_angles, **PROJECTION_KWARGS)
+    for lidar_id, projection in zip(lidar_ids, new_projections):
+        if not isinstance(projection, Exception):
+            cache.put(lidar_id, projection)
+        projections[lidar_id] = projection
+
+    return projections
 
 
 def image_processing(image_raw, target_size=(img_rows, img_cols), is_nir=False):
@@ -296,20 +310,53 @@ def image_processing(image_raw, target_size=(img_rows, img_cols), is_nir=False):
         Processed image resized to (img_rows, img_cols, channels),
         where channels = 3 for RGB, 1 for grayscale NIR.
     """
+    # Area averaging, like the stored pyramid levels: the 1/4 level and the full image give the same pixels
     # Convert to grayscale if NIR image
     if is_nir:
-        image_resized = cv2.resize(image_raw, (target_size[1], target_size[0]), interpolation=cv2.INTER_LINEAR)
+        image_resized = cv2.resize(image_raw, (target_size[1], target_size[0]), interpolation=cv2.INTER_AREA)
         if len(image_resized.shape) == 2:  # Ensure it remains grayscale (1 channel)
             image_resized = np.expand_dims(image_resized, axis=-1)  # Shape (H, W, 1)
     else:
         # Convert RGB image to 3 channels if necessary
-        image_resized = cv2.resize(image_raw, (target_size[1], target_size[0]), interpolation=cv2.INTER_LINEAR)
+        image_resized = cv2.resize(image_raw, (target_size[1], target_size[0]), interpolation=cv2.INTER_AREA)
         if len(image_resized.shape) == 2:  # Convert grayscale to RGB if needed
             image_resized = cv2.cvtColor(image_resized, cv2.COLOR_GRAY2RGB)
 
     return image_resized
 
 
+def fetch_batch_inputs(pairs, cache):
+    """
+    Reads and processes the GridFS inputs of a batch of RGB/NIR pairs, run on the fetch pool.
+
+    All images of the batch come from one read_arrays call and the weather blobs from one
+    BlobCache.get_many call, instead of one fs.get round trip per blob.
+
+    Args:
+        pairs (list): (document, rgb_id, nir_id) of every pair.
+        cache (BlobCache): Weather blobs shared across pairs and documents.
+
+    Returns:
+        list: Per pair, a dict of 'rgb', 'nir' and 'weather' inputs, each the array or the
+        exception raised while reading it.
+    """
+    images = capture(read_arrays, db, [image_id for _, rgb_id, nir_id in pairs for image_id in (rgb_id, nir_id)],
+                     cache=local_blob_cache)
+    weather = capture(cache.get_many, [document.get('weather_id') for document, _, _ in pairs])
+
+    def lookup(arrays, file_id):
+        array = arrays if isinstance(arrays, Exception) else arrays[file_id]  # A failed bulk read fails all
+        if isinstance(array, Exception):
+            raise array
+        return array
+
+    return [{
+        'rgb': capture(lambda: image_processing(lookup(images, rgb_id), is_nir=False)),
+        'nir': capture(lambda: image_processing(lookup(images, nir_id), is_nir=True)),
+        'weather': capture(lookup, weather, document.get('weather_id')),
+    } for document, rgb_id, nir_id in pairs]
+
+
 def get_julian_day(date_str):
     """
     Convert a date in YYMMDD format to Julian Day (DDD).
@@ -447,139 +494,153 @@ try:
     # Clear GPU memory after processing the chunk
     clear_gpu_memory()
 
-    criteria = {
-        "$and": [
-            {"year": 2024},
-            {"rgbimage_ids": {"$exists": True, "$not": {"$size": 0}}},  # Ensure rgbimage_ids exists & is not empty
-            {"nirimage_ids": {"$exists": True, "$not": {"$size": 0}}},  # Ensure nirimage_ids exists & is not empty
-            {"seedingdate": {"$exists": True}},
-            {"weather_id": {"$exists": True}},
-            {"lidar_id": {"$exists": True}},
-            {"flowering": {"$exists": True, "$ne": float("NaN")}},
-            {"maturity": {"$exists": True, "$ne": float("NaN")}},
-            {
-                "$expr": {
-                    "$eq": [{"$size": "$rgbimage_ids"}, {"$size": "$nirimage_ids"}]
-                }
-            },  # Ensures rgbimage_ids and nirimage_ids have the same length
-            {
-                "$expr": {
-                    "$lt": [{"$size": "$rgbimage_ids"}, 10]
-                }
-            }  # Ensures rgbimage_ids has fewer than 10 elements
-        ]
-    }
-
-    documents = list(collection.find(criteria))
-
-    # Shuffle the documents
-    random.shuffle(documents)
+    # Paired RGB/NIR images (fewer than 10), LiDAR, weather, seeding date and flowering/maturity, selected on the
+    # indexed eligibility fields of 3_MongoDB/AddEligibilityFields.py instead of $exists / $size / $expr
+    criteria = eligibility_query(year=2024, labels=("flowering", "maturity"), max_images=10)
 
-    # Count matching documents
-    document_count = collection.count_documents(criteria)
+    # Counted on the index; the documents themselves are streamed from the cursor while loading
+    # (no shuffle needed, the splits permute the sample indices)
+    document_count, pair_count = selection_counts(collection, criteria)
     print(f"Number of matching documents: {document_count}")
 
     # %%Get data from MongoDB
-    # Initialize empty lists for training data
+    # Training data is written into SampleArrays, sized once the matched pairs are known
+
+    fetch_executor = fetch_pool(FETCH_WORKERS)
+    projection_cache = ProjectionCache(PROJECTION_CACHE_PATH, PROJECTION_CACHE_BYTES, **PROJECTION_KWARGS)
+    blob_cache = BlobCache(db, BLOB_CACHE_BYTES, local_blob_cache)
+
+    # One task per RGB/NIR pair of every document batch of the cursor, whose GridFS reads run
+    # ahead of this loop on the fetch pool in bulk reads of FETCH_BATCH_SIZE pairs, while the
+    # next document batches are still arriving
+    document_blocks = document_batches(collection, criteria, DOCUMENT_PROJECTION, LIDAR_BLOCK_SIZE)
+    sample_tasks = (
+        (block, document, rgb_id, nir_id)
+        for block in document_blocks
+        for document in block
+        for rgb_id, nir_id in zip(pyramid_ids(document, 'rgbimage', (img_rows, img_cols)),
+                                  pyramid_ids(document, 'nirimage', (img_rows, img_cols)))
+    )
+    samples = SampleArrays(pair_count, SAMPLE_DTYPES, preallocate=PREALLOCATE_SAMPLES)
+    print(f"{pair_count} RGB/NIR pairs to load, peak RSS before loading: {peak_rss_bytes() / 1024 ** 3:.2f} GiB")
+
+    # Every fetched batch keeps its tasks, the task generator can only be consumed once
+    batch_inputs = fetch_ordered(
+        lambda batch: list(zip(batch, fetch_batch_inputs([task[1:] for task in batch], blob_cache))),
+        iter_batched(sample_tasks, FETCH_BATCH_SIZE), fetch_executor, FETCH_IN_FLIGHT // FETCH_BATCH_SIZE)
+    task_inputs = (task_input for batch in batch_inputs for task_input in batch)
+    lidar_block, fetch_errors, dropped_samples = None, 0, 0
+    load_start = time.perf_counter()
+
+    for (block, document, rgb_id, nir_id), inputs in tqdm(task_inputs, total=pair_count, desc="Processing samples"):
+        # Project the LiDAR of every cursor batch of documents in parallel
+        if block is not lidar_block:
+            lidar_block = block
+            lidar_projections = project_documents_lidar(block, lidar_pool, fetch_executor, projection_cache)
+
+        fetch_errors += sum(isinstance(value, Exception) for value in inputs.values())
+
+        rgb_data, nir_data, weather_data, lidar_data = None, None, None, None
+        imagedate_data, seedingdate_data = None, None
+        flowering_data, maturity_data = None, None
+        append_data = True  # Flag to track if there was an error for the document
+
+        try:
+            # RGB image, read and processed on the fetch pool
+            try:
+                rgb_data = inputs['rgb']
+                if isinstance(rgb_data, Exception):
+                    raise rgb_data
+
+            except Exception as e:
+                print(f"Error reading RGB image with rgb_id {rgb_id}: {e}")
+                append_data = False  # Mark as False if reading fails
+
+            # NIR image, read and processed on the fetch pool
+            try:
+                nir_data = inputs['nir']
+                if isinstance(nir_data, Exception):
+                    raise nir_data
 
-    x_rgbimage, x_nirimage, x_weather, x_lidar = [], [], [], []
-    x_imagedate, x_seedingdate = [], []
-    y_flowering, y_maturity = [], []
+            except Exception as e:
+                print(f"Error reading NIR image with nir_id {nir_id}: {e}")
+                append_data = False  # Mark as False if reading fails
 
-    for document in tqdm(documents, desc="Processing documents"):
-        rgbimage_ids = document.get('rgbimage_ids', [])
-        nirimage_ids = document.get('nirimage_ids', [])
+            # Weather data
+            try:
+                weather_data = inputs['weather']  # Fetched once per run through the blob cache
+                if isinstance(weather_data, Exception):
+                    raise weather_data
+            except Exception as e:
+                print(f"Error reading weather data for document {document.get('id', 'Unknown')}: {e}")
+                append_data = False  # Mark as False if reading weather data fails
 
-        for rgb_id, nir_id in zip(rgbimage_ids, nirimage_ids):
-            rgb_data, nir_data, weather_data, lidar_data = None, None, None, None
-            imagedate_data, seedingdate_data = None, None
-            flowering_data, maturity_data = None, None
-            append_data = True  # Flag to track if there was an error for the document
+            # Lidar data
+            try:
+                lidar_data = lidar_projections[document['lidar_id']]
+                if isinstance(lidar_data, Exception):
+                    raise lidar_data
+            except Exception as e:
+                print(f"Error reading lidar data for document {document.get('id', 'Unknown')}: {e}")
+                append_data = False  # Mark as False if reading lidar data fails
 
+            # Image date, seeding date, flowering and maturity labels
             try:
-                # Fetch the RGB image
-                try:
-                    gridout_rgb = fs.get(rgb_id)
-                    rgb_image_raw = np.load(BytesIO(gridout_rgb.read()))
-                    resized_rgb_image = image_processing(rgb_image_raw, is_nir=False)  # Process the RGB image
-                    rgb_data = resized_rgb_image  # Store the processed RGB image
-
-                except Exception as e:
-                    print(f"Error reading RGB image with rgb_id {rgb_id}: {e}")
-                    append_data = False  # Mark as False if reading fails
-
-                # Fetch the NIR image
-                try:
-                    gridout_nir = fs.get(nir_id)
-                    nir_image_raw = np.load(BytesIO(gridout_nir.read()))
-                    resized_nir_image = image_processing(nir_image_raw, is_nir=True)  # Process the NIR image
-                    nir_data = resized_nir_image  # Store the processed NIR image
-
-                except Exception as e:
-                    print(f"Error reading NIR image with nir_id {nir_id}: {e}")
-                    append_data = False  # Mark as False if reading fails
-
-                # Weather data
-                try:
-                    gridout_weather = fs.get(document['weather_id'])
-                    weather_data = np.load(BytesIO(gridout_weather.read()))
-                except Exception as e:
-                    print(f"Error reading weather data for document {document.get('id', 'Unknown')}: {e}")
-                    append_data = False  # Mark as False if reading weather data fails
-
-                # Lidar data
-                try:
-                    gridout_lidar = fs.get(document['lidar_id'])
-                    lidar_data_raw = np.load(BytesIO(gridout_lidar.read()))
-                    lidar_data = projection3x(lidar_data_raw)
-                except Exception as e:
-                    print(f"Error reading lidar data for document {document.get('id', 'Unknown')}: {e}")
-                    append_data = False  # Mark as False if reading lidar data fails
-
-                # Image date, seeding date, flowering and maturity labels
-                try:
-                    seedingdate_data = get_julian_day(document['seedingdate'])
-                    imagedate_data = get_julian_day(document['date'])
-
-                    # Convert flowering and maturity to Julian days
-                    flowering_data, maturity_data = document['flowering'] / 100, document['maturity'] / 100
-
-                except Exception as e:
-                    print(f"Error reading date and label data for document {document.get('id', 'Unknown')}: {e}")
-                    append_data = False  # Mark as False if reading date or labels fails
-
-                # If all required data is available, append the data to the lists
-                if append_data:
-                    x_rgbimage.append(rgb_data)
-                    x_nirimage.append(nir_data)
-                    x_weather.append(weather_data)
-                    x_lidar.append(lidar_data)
-                    x_imagedate.append(imagedate_data)
-                    x_seedingdate.append(seedingdate_data)
-                    y_flowering.append(flowering_data)
-                    y_maturity.append(maturity_data)
+                seedingdate_data = get_julian_day(document['seedingdate'])
+                imagedate_data = get_julian_day(document['date'])
+
+                # Convert flowering and maturity to Julian days
+                flowering_data, maturity_data = document['flowering'] / 100, document['maturity'] / 100
 
             except Exception as e:
-                print(f"Error: {e}")
-                append_data = False
-                continue  # Skip the entire document if there's an error
+                print(f"Error reading date and label data for document {document.get('id', 'Unknown')}: {e}")
+                append_data = False  # Mark as False if reading date or labels fails
+
+            # If all required data is available, write the sample into the training arrays
+            if append_data:
+                samples.append({
+                    'rgb': rgb_data, 'nir': nir_data, 'weather': weather_data, 'lidar': lidar_data,
+                    'imagedate': imagedate_data, 'seedingdate': seedingdate_data,
+                    'flowering': flowering_data, 'maturity': maturity_data,
+                })
+
+        except Exception as e:
+            print(f"Error: {e}")
+            append_data = False  # Skip the sample if there's an error
+
+        if not append_data:
+            dropped_samples += 1  # Each failed read was reported above
+
+    lidar_pool.shutdown()
+    fetch_executor.shutdown()
+    load_time = time.perf_counter() - load_start
+    print(f"Loaded {len(samples)} samples from {document_count} documents in {load_time:.1f} s "
+          f"({document_count / load_time:.1f} documents/sec), {dropped_samples} samples dropped, "
+          f"{fetch_errors} failed fetches")
+    projection_cache.print_stats()
+    blob_cache.print_stats()
 
     # %%DL
+    # Release the slots of dropped samples before taking the input views below
+    samples.trim()
+
     # Convert inputs to NumPy arrays
-    x_rgbimage = np.array(x_rgbimage)
-    x_nirimage = np.array(x_nirimage)
-    x_seedingdate = np.array(x_seedingdate).reshape(-1, 1)
-    x_imagedate = np.array(x_imagedate).reshape(-1, 1)
-    x_weather = np.array(x_weather).transpose(0, 2, 3, 1) # Rearrange dimensions to (batch_size, height, width, channels)
-    x_lidar = np.array(x_lidar)
+    x_rgbimage = samples['rgb']
+    x_nirimage = samples['nir']
+    x_seedingdate = samples['seedingdate'].reshape(-1, 1)
+    x_imagedate = samples['imagedate'].reshape(-1, 1)
+    x_weather = samples['weather'].transpose(0, 2, 3, 1) # Rearrange dimensions to (batch_size, height, width, channels)
+    x_lidar = samples['lidar']
 
     # Convert outputs to NumPy arrays
-    y_flowering = np.array(y_flowering).reshape(-1, 1)
-    y_maturity = np.array(y_maturity).reshape(-1, 1)
+    y_flowering = samples['flowering'].reshape(-1, 1)
+    y_maturity = samples['maturity'].reshape(-1, 1)
+    print(f"Peak RSS after loading: {peak_rss_bytes() / 1024 ** 3:.2f} GiB")
+    print_memory_report(samples)
 
-    # distribution:
-    # print_distribution(y_flowering, "Flowering Days")
-    # print_distribution(y_maturity, "Maturity Days")
+    # distribution, from the label histograms accumulated while loading:
+    # samples.stats.print_distribution('flowering', "Flowering Days")
+    # samples.stats.print_distribution('maturity', "Maturity Days")
 
     # Save histograms as SVG files
     # plot_histogram_and_save(y_flowering, "Flowering Days", filename=f"{OUTPUT_PATH}flowering_histogram.svg")
@@ -594,15 +655,10 @@ try:
     print(f"y_train_flowering: {type(y_flowering)}, shape: {y_flowering.shape}")
     print(f"y_train_maturity: {type(y_maturity)}, shape: {y_maturity.shape}")
 
+    # NaN/Inf counts and value ranges were accumulated while loading, no extra pass over the arrays
     print("Checking for NaNs or infinities in the data...")
-    print("RGB Images:", np.isnan(x_rgbimage).any() or np.isinf(x_rgbimage).any())
-    print("NIR Images:", np.isnan(x_nirimage).any() or np.isinf(x_nirimage).any())
-    print("Seeding Date:", np.isnan(x_seedingdate).any() or np.isinf(x_seedingdate).any())
-    print("Image Date:", np.isnan(x_imagedate).any() or np.isinf(x_imagedate).any())
-    print("LiDAR Data:", np.isnan(x_lidar).any() or np.isinf(x_lidar).any())
-    print("Weather Data:", np.isnan(x_weather).any() or np.isinf(x_weather).any())
-    print("Flowering:", np.isnan(y_flowering).any() or np.isinf(y_flowering).any())
-    print("Maturity:", np.isnan(y_maturity).any() or np.isinf(y_maturity).any())
+    samples.stats.print_report()
+    del samples  # The x_*/y_* arrays above are all that is kept of the loaded samples
 
 # %% STOP MongoDB
 finally:
@@ -682,15 +738,21 @@ def build_image_branch(
         name_prefix="image_branch",
         kernel_regularizer=None,
         scale_factor=1.0 / 255.0,  # <--- specify default
+        normalization=None,
 ):
     """
     Builds a CNN branch for image-like input.
-    The first layer rescales so you don't have to do x/255 externally.
+    The first layer rescales so you don't have to do x/255 externally, or, given the
+    ChannelStats of the training split as normalization, standardizes every channel.
     """
     inputs = Input(shape=input_shape, name=name_prefix + "_input")
 
-    # Rescale so you do NOT have to do image/255 outside the model
-    x = layers.Rescaling(scale_factor)(inputs)
+    if normalization is not None:
+        # (x - mean) / std per channel, with the statistics stored in the model
+        x = layers.Normalization(axis=-1, mean=normalization.mean, variance=normalization.variance)(inputs)
+    else:
+        # Rescale so you do NOT have to do image/255 outside the model
+        x = layers.Rescaling(scale_factor)(inputs)
 
     # Initial Conv -> BN -> ReLU
     x = conv_bn_relu(x, initial_filters, kernel_size=3,
@@ -715,15 +777,19 @@ def build_dense_branch(
         name_prefix="dense_branch",
         kernel_regularizer=None,
         scalar_scale=None,  # <--- new option for dividing scalars
+        normalization=None,
 ):
     """
     Builds an MLP branch for scalar input.
-    If scalar_scale is not None, apply x/scalar_scale inside the model.
+    If normalization (ChannelStats) is given, standardize with it inside the model,
+    else if scalar_scale is not None, apply x/scalar_scale inside the model.
     """
     inputs = Input(shape=(input_dim,), name=f"{name_prefix}_input")
 
+    if normalization is not None:
+        x = layers.Normalization(axis=-1, mean=normalization.mean, variance=normalization.variance)(inputs)
     # If you want x / 365 for days, do it here:
-    if scalar_scale is not None:
+    elif scalar_scale is not None:
         x = layers.Lambda(lambda z: z / scalar_scale)(inputs)
     else:
         x = inputs
@@ -742,17 +808,21 @@ def build_weather_branch(
         num_blocks=2,
         name_prefix="weather_branch",
         kernel_regularizer=None,
-        scale_factor=None
+        scale_factor=None,
+        normalization=None,
 ):
     """
     Builds a CNN branch for weather data.
-    If scale_factor is provided, you can do a Rescaling inside.
+    If normalization (ChannelStats of the 146 channels) is given, standardize every channel
+    inside the model; else if scale_factor is provided, you can do a Rescaling inside.
     """
     inputs = Input(shape=input_shape, name=name_prefix + "_input")
     x = inputs
 
+    if normalization is not None:
+        x = layers.Normalization(axis=-1, mean=normalization.mean, variance=normalization.variance)(x)
     # If you want to do some scale like x/100 or x/1000 for weather, do it:
-    if scale_factor is not None:
+    elif scale_factor is not None:
         x = layers.Rescaling(scale_factor)(x)
 
     x = conv_bn_relu(x, initial_filters, kernel_size=3,
@@ -770,6 +840,28 @@ def build_weather_branch(
     return Model(inputs, x, name=name_prefix)
 
 
+# -----------------------------
+# SPLIT AND NORMALIZATION STATISTICS
+# -----------------------------
+# Use an independent random seed for shuffling
+shuffle_seed = np.random.randint(0, 10000)  # Generate a unique seed for shuffling
+np.random.seed(shuffle_seed)  # Set the seed for reproducibility in this loop
+
+# Shuffle and split only the sample indices: the inputs stay in the arrays they were loaded into
+# and every chunk gathers its own samples, instead of a shuffled copy of every full array
+shuffle_indices = np.random.permutation(len(x_rgbimage))
+
+# Split a test dataset (20% of total data)
+train_indices, test_indices = train_test_split(shuffle_indices, test_size=0.2, random_state=None)
+
+# Per-channel statistics of everything but the test split (validation chunks are drawn from it),
+# read from the loaded arrays; x_weather is channels-last, (n, 8, 8, 146)
+stats_start = time.perf_counter()
+normalization = channel_stats(
+    {'lidar': x_lidar, 'weather': x_weather, 'seedingdate': x_seedingdate, 'imagedate': x_imagedate},
+    train_indices, {**NORMALIZED_INPUTS, 'weather': -1}, workers=STATS_WORKERS)
+print(f"Normalization statistics of {len(train_indices)} samples in {time.perf_counter() - stats_start:.1f} s")
+
 # -----------------------------
 # 3. BUILD / COMPILE MODEL
 # -----------------------------
@@ -797,45 +889,48 @@ with strategy.scope():
         scale_factor=1.0 / 255.0
     )
     lidar_branch = build_image_branch(
-        input_shape=(100, 300, 3),
+        input_shape=(100, 300, len(LIDAR_CHANNELS)),
         initial_filters=32,
         num_blocks=4,
         name_prefix="lidar",
         kernel_regularizer=reg,
-        scale_factor=1.0 / 150.0  # e.g., if LiDAR range ~150
+        scale_factor=1.0 / 150.0,  # e.g., if LiDAR range ~150
+        normalization=normalization.get('lidar')
     )
 
     # Scalar branches
-    # If your scalar is "days" up to 365, let the model do /365:
     seeding_branch = build_dense_branch(
         input_dim=1,
         units_list=[64, 128, 256],
         name_prefix="seeding",
         kernel_regularizer=reg,
-        scalar_scale=365.0
+        scalar_scale=365.0,
+        normalization=normalization.get('seedingdate')
     )
     image_date_branch = build_dense_branch(
         input_dim=1,
         units_list=[64, 128, 256],
         name_prefix="image_date_branch",
         kernel_regularizer=reg,
-        scalar_scale=365.0
+        scalar_scale=365.0,
+        normalization=normalization.get('imagedate')
     )
 
-    # Weather branch, if you'd like to scale internally, do so:
+    # Weather branch
     weather_branch = build_weather_branch(
         input_shape=(8, 8, 146),
         initial_filters=64,
         num_blocks=4,
         name_prefix="weather",
         kernel_regularizer=reg,
-        scale_factor=1.0/100.0
+        scale_factor=1.0/100.0,
+        normalization=normalization.get('weather')
     )
 
     # Inputs
     rgb_input = tf.keras.Input(shape=(512, 612, 3), name="rgb_image")
     nir_input = tf.keras.Input(shape=(512, 612, 1), name="nir_image")
-    lidar_input = tf.keras.Input(shape=(100, 300, 3), name="lidar_data")
+    lidar_input = tf.keras.Input(shape=(100, 300, len(LIDAR_CHANNELS)), name="lidar_data")
     seeding_input = tf.keras.Input(shape=(1,), name="seeding_date")
     image_date_input = tf.keras.Input(shape=(1,), name="image_date")
     weather_input = tf.keras.Input(shape=(8, 8, 146), name="weather_data")
@@ -931,35 +1026,11 @@ best_rmse_maturity = np.inf
 # Results storage
 results = []
 
-# Use an independent random seed for shuffling
-shuffle_seed = np.random.randint(0, 10000)  # Generate a unique seed for shuffling
-np.random.seed(shuffle_seed)  # Set the seed for reproducibility in this loop
-
-# Shuffle data before splitting
-shuffle_indices = np.random.permutation(len(x_rgbimage))
-x_rgbimage = x_rgbimage[shuffle_indices]
-x_nirimage = x_nirimage[shuffle_indices]
-x_seedingdate = x_seedingdate[shuffle_indices]
-x_imagedate = x_imagedate[shuffle_indices]
-x_lidar = x_lidar[shuffle_indices]
-x_weather = x_weather[shuffle_indices]
-y_flowering = y_flowering[shuffle_indices]
-y_maturity = y_maturity[shuffle_indices]
-
-# Split a test dataset (20% of total data)
-(
-    x_train_rgbimage, x_test_rgbimage,
-    x_train_nirimage, x_test_nirimage,
-    x_train_seedingdate, x_test_seedingdate,
-    x_train_imagedate, x_test_imagedate,
-    x_train_lidar, x_test_lidar,
-    x_train_weather, x_test_weather,
-    y_train_flowering, y_test_flowering,
-    y_train_maturity, y_test_maturity,
-) = train_test_split(
-    x_rgbimage, x_nirimage, x_seedingdate, x_imagedate, x_lidar, x_weather,
-    y_flowering, y_maturity, test_size=0.2, random_state=None
-)
+# Test inputs of the split taken before the model was built
+x_test_rgbimage, x_test_nirimage = x_rgbimage[test_indices], x_nirimage[test_indices]
+x_test_seedingdate, x_test_imagedate = x_seedingdate[test_indices], x_imagedate[test_indices]
+x_test_lidar, x_test_weather = x_lidar[test_indices], x_weather[test_indices]
+y_test_flowering, y_test_maturity = y_flowering[test_indices], y_maturity[test_indices]
 
 # Run the training process 50 times
 for repetition in range(1, 2):
@@ -969,7 +1040,7 @@ for repetition in range(1, 2):
     desired_chunk_size = 1000
 
     # Calculate the number of chunks needed dynamically
-    total_train_samples = len(x_train_rgbimage)
+    total_train_samples = len(train_indices)
     num_chunks = max(1, total_train_samples // desired_chunk_size)  # Ensure at least one chunk
 
     # Generate split indices dynamically
@@ -986,15 +1057,16 @@ for repetition in range(1, 2):
     for i, (start, end) in enumerate(zip([0] + split_indices[:-1], split_indices)):
         print(f"Processing training chunk {i + 1}...")
 
-        # Extract the current chunk
-        x_chunk_rgbimage = x_train_rgbimage[start:end]
-        x_chunk_nirimage = x_train_nirimage[start:end]
-        x_chunk_seedingdate = x_train_seedingdate[start:end]
-        x_chunk_imagedate = x_train_imagedate[start:end]
-        x_chunk_lidar = x_train_lidar[start:end]
-        x_chunk_weather = x_train_weather[start:end]
-        y_chunk_flowering = y_train_flowering[start:end]
-        y_chunk_maturity = y_train_maturity[start:end]
+        # Gather the current chunk (sorted indices: forward reads through the arrays)
+        chunk_indices = np.sort(train_indices[start:end])
+        x_chunk_rgbimage = x_rgbimage[chunk_indices]
+        x_chunk_nirimage = x_nirimage[chunk_indices]
+        x_chunk_seedingdate = x_seedingdate[chunk_indices]
+        x_chunk_imagedate = x_imagedate[chunk_indices]
+        x_chunk_lidar = x_lidar[chunk_indices]
+        x_chunk_weather = x_weather[chunk_indices]
+        y_chunk_flowering = y_flowering[chunk_indices]
+        y_chunk_maturity = y_maturity[chunk_indices]
 
         # Split chunk into training and validation
         (
@@ -1137,6 +1209,9 @@ try:
 except subprocess.CalledProcessError as e:
     print(f"Failed to send email: {e}")
 '''
+if local_blob_cache:
+    local_blob_cache.print_stats()
+
 # Stop monitoring
 stop_monitoring(process)
 
@@ -0,0 +1,382 @@
+import os
+import glob
+import json
+import fcntl
+import shutil
+import socket
+
+import numpy as np
+
+from samplearrays import store_value
+from datasetstats import DatasetStats
+
+MANIFEST = "manifest.json"
+
+
+def _lock(lock_path, blocking=True):
+    """
+    Opens lock_path and takes an exclusive POSIX lock on it, released by the OS if the process
+    dies. Returns the open file, or None if blocking is False and another process holds the lock.
+    """
+    lock_file = open(lock_path, "a")
+    try:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def create_staging(path):
+    """
+    Creates the staging directory of this process for the store at path,
+    <path>.partial.<host>.<pid>, locked through <staging>.lock until release_staging.
+
+    Staging directories left by jobs that died while building (their lock is free) are removed
+    first; those of jobs still building, e.g. the other runs of a sweep started on the same
+    missing store, are left alone.
+
+    Returns:
+        tuple: (staging directory, open lock file).
+    """
+    staging_path = f"{path}.partial.{socket.gethostname()}.{os.getpid()}"
+    lock_file = _lock(f"{staging_path}.lock")  # Before the directory exists, so no one sees it unlocked
+    for leftover in glob.glob(f"{glob.escape(path)}.partial*"):
+        if leftover.endswith(".lock") or leftover == staging_path:
+            continue
+        leftover_lock = _lock(f"{leftover}.lock", blocking=False)
+        if leftover_lock is not None:
+            shutil.rmtree(leftover, ignore_errors=True)
+            release_staging(leftover, leftover_lock)
+    shutil.rmtree(staging_path, ignore_errors=True)  # Same host and pid as a dead job
+    os.makedirs(staging_path)
+    return staging_path, lock_file
+
+
+def release_staging(staging_path, lock_file):
+    """Removes the lock file of a published or removed staging directory and releases the lock."""
+    try:
+        os.remove(f"{staging_path}.lock")
+    except FileNotFoundError:
+        pass
+    lock_file.close()
+
+
+def publish_staging(staging_path, lock_file, path, append):
+    """
+    Publishes a staging directory as the store at path: moves its shards into the existing store
+    (append), or renames it to path. Publishes of concurrent jobs are serialized by <path>.lock. If
+    another job published a new store at path first, this one is dropped and that store is kept.
+    """
+    store_lock = _lock(f"{path}.lock")
+    try:
+        if append:
+            publish_shards(staging_path, path)
+        elif os.path.exists(path):
+            print(f"Feature store {path} was completed by another job, using it")
+            shutil.rmtree(staging_path)
+        else:
+            os.rename(staging_path, path)
+    finally:
+        store_lock.close()
+        release_staging(staging_path, lock_file)
+
+
+class FeatureStoreWriter:
+    """
+    Writes preprocessed samples into a sharded, memory-mapped on-disk feature store.
+
+    Every input of a shard of shard_size samples is one .npy file, <path>/shard-00000/<name>.npy,
+    created with np.lib.format.open_memmap, so samples go straight to disk and the store can be
+    larger than RAM. The store is written under <path>.partial.<host>.<pid> and renamed to path by
+    close, once manifest.json is in place: a job that died while building never leaves a store
+    that looks complete. The staging directory belongs to the process (see create_staging), so jobs
+    building the same store at the same time never touch each other's files; the first one to
+    close publishes it. It has the append interface of SampleArrays, so the loader loop can fill either.
+
+    With append=True, samples are added to an existing store instead. Its last shard, if partial,
+    is copied into the staging directory first and close moves the new shard files into the store one
+    os.replace at a time before replacing the manifest: until then readers see the old store, whose
+    rows are unchanged in the rewritten last shard. Shards of a store merged from extraction parts
+    (see merge_feature_stores) may hold fewer than shard_size samples; the manifest lists the
+    samples of every shard. The DatasetStats of the samples are updated on every append and kept
+    in the manifest.
+    """
+
+    def __init__(self, path, shard_size=1024, dtypes=None, append=False):
+        """
+        Args:
+            path (str): Directory of the store, which must not exist yet unless append is True.
+            shard_size (int): Samples per shard file, the existing shard size when appending.
+            dtypes (dict): Optional input name -> dtype the samples are cast to, e.g. {'rgb': np.uint8}.
+            append (bool): Add the samples to the completed store at path.
+        """
+        if append and not FeatureStore.exists(path):
+            raise FileNotFoundError(f"No feature store to append to at {path}")
+        if not append and os.path.exists(path):
+            raise FileExistsError(f"Feature store {path} already exists")
+
+        self.path = path
+        self.append_mode = append
+        self.shard_size = shard_size
+        self.dtypes = dtypes or {}
+        self.count = 0
+        self.inputs = {}  # name -> {'shape', 'dtype'} of one sample, from the first sample
+        self._shard = {}  # name -> open_memmap of the shard being written
+        self._kept_shards = []  # Samples of the shards of the existing store left as they are
+        self.stats = DatasetStats()
+
+        self._partial_path, self._staging_lock = create_staging(path)
+
+        if append:
+            store = FeatureStore(path)
+            self.shard_size, self.inputs = store.shard_size, store.inputs
+            self.stats = store.stats  # Already count the rewritten samples; None for stores without stats
+            # Continue after the last full shard, rewriting the samples of a partial one
+            self._kept_shards = list(store.shard_counts)
+            if self._kept_shards and self._kept_shards[-1] < self.shard_size:
+                self._kept_shards.pop()
+            self.count = sum(self._kept_shards)
+            for start in range(self.count, store.count, 64):  # A few rows at a time, not the whole shard
+                rows = store.take(np.arange(start, min(start + 64, store.count)))
+                for row in range(len(next(iter(rows.values())))):
+                    self._write({name: array[row] for name, array in rows.items()})
+
+    def __len__(self):
+        return self.count
+
+    def _shard_dir(self, shard_index):
+        return os.path.join(self._partial_path, f"shard-{shard_index:05d}")
+
+    def _position(self):
+        """(shard index, row in the shard) of the next sample."""
+        new_count = self.count - sum(self._kept_shards)
+        return len(self._kept_shards) + new_count // self.shard_size, new_count % self.shard_size
+
+    def _open_shard(self):
+        shard_dir = self._shard_dir(self._position()[0])
+        os.makedirs(shard_dir, exist_ok=True)
+        self._shard = {
+            name: np.lib.format.open_memmap(os.path.join(shard_dir, f"{name}.npy"), mode="w+",
+                                            dtype=spec['dtype'], shape=(self.shard_size,) + tuple(spec['shape']))
+            for name, spec in self.inputs.items()
+        }
+
+    def append(self, sample):
+        """
+        Adds one sample, given as a dict of input name -> array or scalar. Every sample must have
+        the inputs, shapes and dtypes of the first one.
+        """
+        self._write(sample)
+        if self.stats is not None:
+            self.stats.update(sample)
+
+    def _write(self, sample):
+        if not self.inputs:
+            for name, value in sample.items():
+                value = np.asarray(value)
+                self.inputs[name] = {'shape': list(value.shape),
+                                     'dtype': np.dtype(self.dtypes.get(name, value.dtype)).str}
+
+        row = self._position()[1]
+        if row == 0:
+            self._flush()
+            self._open_shard()
+
+        for name, value in sample.items():
+            store_value(self._shard[name], row, name, value)
+        self.count += 1
+
+    def _flush(self):
+        for array in self._shard.values():
+            array.flush()
+        self._shard = {}
+
+    def close(self, metadata=None):
+        """
+        Completes the store and opens it for reading.
+
+        Args:
+            metadata (dict): JSON-serializable description of the dataset (query, preprocessing
+                parameters, ...), kept in the manifest.
+
+        Returns:
+            FeatureStore: The finished store.
+        """
+        last_shard, last_count = self._position()
+        if last_count:
+            # Trim the last shard to the samples actually written
+            shard_dir = self._shard_dir(last_shard)
+            for name, array in self._shard.items():
+                file_path = os.path.join(shard_dir, f"{name}.npy")
+                np.save(f"{file_path}.tmp.npy", array[:last_count])
+                os.replace(f"{file_path}.tmp.npy", file_path)
+        self._flush()
+
+        shard_counts = self._kept_shards + [self.shard_size] * (last_shard - len(self._kept_shards))
+        shard_counts += [last_count] if last_count else []
+        write_manifest(self._partial_path, self.count, self.shard_size, shard_counts, self.inputs, metadata,
+                       self.stats)
+
+        publish_staging(self._partial_path, self._staging_lock, self.path, self.append_mode)
+        return FeatureStore(self.path)
+
+
+def write_manifest(path, samples, shard_size, shard_counts, inputs, metadata=None, stats=None):
+    """Writes the manifest.json of a store whose shard directories are in path."""
+    manifest = {
+        'samples': samples,
+        'shard_size': shard_size,
+        'shards': shard_counts,
+        'inputs': inputs,
+        'metadata': metadata or {},
+        'stats': stats.to_dict() if stats is not None else None,
+    }
+    with open(os.path.join(path, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+
+def publish_shards(staging_path, path):
+    """
+    Moves the shard files and manifest written under staging_path into the existing store at path
+    and removes staging_path. Shard files go first and the manifest last, since it is what makes
+    the new samples visible.
+    """
+    for shard_name in sorted(os.listdir(staging_path)):
+        if shard_name == MANIFEST:
+            continue
+        os.makedirs(os.path.join(path, shard_name), exist_ok=True)
+        for file_name in os.listdir(os.path.join(staging_path, shard_name)):
+            os.replace(os.path.join(staging_path, shard_name, file_name),
+                       os.path.join(path, shard_name, file_name))
+    os.replace(os.path.join(staging_path, MANIFEST), os.path.join(path, MANIFEST))
+    shutil.rmtree(staging_path)
+
+
+def merge_feature_stores(part_paths, path, metadata=None):
+    """
+    Merges completed stores, e.g. the parts written by the tasks of a sharded extraction, into the
+    store at path, in the order of part_paths.
+
+    The shard files of the parts are renamed into place, not copied, so the merge costs a few
+    file-system operations per shard whatever the size of the data; part_paths must be on the file
+    system of path and are removed. Shards of the parts keep their sample counts. If a store
+    already exists at path the parts are appended to it, like FeatureStoreWriter(append=True),
+    otherwise the merged store is built in a staging directory (see create_staging) and renamed to path. The DatasetStats
+    of the stores are merged, or dropped if one of them has none.
+
+    Args:
+        part_paths (list): Directories of completed stores with the same inputs.
+        path (str): Directory of the merged store.
+        metadata (dict): Manifest metadata of the merged store.
+
+    Returns:
+        FeatureStore: The merged store.
+    """
+    parts = [FeatureStore(part_path) for part_path in part_paths]
+    append = FeatureStore.exists(path)
+    store = FeatureStore(path) if append else None
+    shard_size = store.shard_size if append else max([part.shard_size for part in parts], default=1024)
+    inputs = store.inputs if append else next((part.inputs for part in parts if part.inputs), {})
+    for part in parts:
+        if part.count and inputs and part.inputs != inputs:
+            raise ValueError(f"Feature store {part.path} has other inputs than {path}")
+
+    staging_path, staging_lock = create_staging(path)
+    shard_counts = list(store.shard_counts) if append else []
+    for part in parts:
+        for shard_index, shard_count in enumerate(part.shard_counts):
+            os.rename(os.path.join(part.path, f"shard-{shard_index:05d}"),
+                      os.path.join(staging_path, f"shard-{len(shard_counts):05d}"))
+            shard_counts.append(shard_count)
+    stats = None
+    if all(part.stats is not None for part in parts) and (not append or store.stats is not None):
+        stats = store.stats if append else DatasetStats()
+        for part in parts:
+            stats.merge(part.stats)
+    write_manifest(staging_path, sum(shard_counts), shard_size, shard_counts, inputs, metadata, stats)
+
+    publish_staging(staging_path, staging_lock, path, append)
+    for part in parts:
+        shutil.rmtree(part.path)
+    return FeatureStore(path)
+
+
+class FeatureStore:
+    """
+    Read side of a feature store written by FeatureStoreWriter.
+
+    Every shard file is opened with np.load(mmap_mode='r'), so opening the store costs a few
+    milliseconds whatever its size and only the samples taken are read from disk (and kept in the
+    page cache by the OS). Batches are gathered with take.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Directory of a store completed by FeatureStoreWriter.close.
+        """
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+
+        self.count = manifest['samples']
+        self.shard_size = manifest['shard_size']
+        self.shard_counts = manifest['shards']
+        self._shard_starts = np.cumsum([0] + self.shard_counts)
+        self.inputs = manifest['inputs']
+        self.metadata = manifest['metadata']
+        # Computed while the samples were written; None for stores written before stats were kept
+        self.stats = DatasetStats.from_dict(manifest['stats']) if manifest.get('stats') else None
+        self._shards = [
+            {name: np.load(os.path.join(path, f"shard-{shard_index:05d}", f"{name}.npy"), mmap_mode="r")
+             for name in self.inputs}
+            for shard_index in range(len(manifest['shards']))
+        ]
+
+    @staticmethod
+    def exists(path):
+        """True if path holds a completed store."""
+        return os.path.exists(os.path.join(path, MANIFEST))
+
+    def __len__(self):
+        return self.count
+
+    def take(self, indices, names=None):
+        """
+        Gathers the samples at indices into new in-memory arrays.
+
+        Rows are read shard by shard in increasing order, so a sorted or contiguous set of indices
+        becomes sequential reads.
+
+        Args:
+            indices (array-like): Sample indices, in the order of the returned batch.
+            names (list): Inputs to gather, all of them by default.
+
+        Returns:
+            dict: Input name -> array of shape (len(indices), ...).
+        """
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        if len(indices) and (indices.min() < 0 or indices.max() >= self.count):
+            raise IndexError(f"Sample index out of range for a feature store of {self.count} samples")
+
+        names = names or list(self.inputs)
+        batch = {name: np.empty((len(indices),) + tuple(self.inputs[name]['shape']), self.inputs[name]['dtype'])
+                 for name in names}
+
+        order = np.argsort(indices, kind="stable")
+        shard_indices = np.searchsorted(self._shard_starts, indices[order], side="right") - 1
+        for shard_index in np.unique(shard_indices):
+            positions = order[shard_indices == shard_index]
+            rows = indices[positions] - self._shard_starts[shard_index]
+            for name in names:
+                batch[name][positions] = self._shards[shard_index][name][rows]
+        return batch
+
+    def bytes_per_sample(self, dtypes=None):
+        """Same as SampleArrays.bytes_per_sample, for print_memory_report."""
+        return {
+            name: int(np.prod(spec['shape'])) * np.dtype(spec['dtype'] if dtypes is None
+                                                         else dtypes.get(name, np.float64)).itemsize
+            for name, spec in self.inputs.items()
+        }
@@ -0,0 +1,197 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from gridfs.errors import CorruptGridFile, NoFile
+
+from blobcodec import decode_blob
+
+
+def fetch_pool(workers=16):
+    """
+    Creates the thread pool used by fetch_ordered.
+
+    GridFS reads spend their time waiting on the server and np.load / zstd / cv2 release the GIL, so
+    threads are enough to keep many reads in flight; MongoClient and GridFS are thread-safe.
+
+    Args:
+        workers (int): Number of concurrent fetches.
+
+    Returns:
+        ThreadPoolExecutor: Shut it down once loading is done.
+    """
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gridfs-fetch")
+
+
+def read_array(fs, file_id):
+    """Reads a GridFS file written with np.save or blobcodec.encode_array and decodes it."""
+    grid_out = fs.get(file_id)
+    return decode_blob(grid_out.read(), grid_out.metadata)
+
+
+# Queries shared by read_blobs and its asyncio counterpart in asyncloader
+FILES_PROJECTION = {"length": 1, "chunkSize": 1, "metadata": 1}
+CHUNKS_PROJECTION = {"_id": 0, "files_id": 1, "n": 1, "data": 1}
+CHUNKS_SORT = [("files_id", 1), ("n", 1)]  # Order of the unique chunk index
+
+
+def preallocate_blobs(files):
+    """Empty buffers of the final size of every file, with a received byte counter each."""
+    return {file_id: bytearray(file["length"]) for file_id, file in files.items()}, dict.fromkeys(files, 0)
+
+
+def write_chunk(chunk, files, blobs, received):
+    """Copies one fs.chunks document to its offset in the buffer of its file."""
+    file_id, data = chunk["files_id"], chunk["data"]
+    offset = chunk["n"] * files[file_id]["chunkSize"]
+    blobs[file_id][offset:offset + len(data)] = data
+    received[file_id] += len(data)
+
+
+def blob_results(file_ids, files, blobs, received, metadata, bucket):
+    """Maps every requested id to its buffer, or to NoFile / CorruptGridFile."""
+    results = {}
+    for file_id in file_ids:
+        if file_id not in files:
+            results[file_id] = NoFile(f"no file in gridfs collection {bucket} with _id {file_id!r}")
+        elif received[file_id] != files[file_id]["length"]:
+            results[file_id] = CorruptGridFile(
+                f"file {file_id!r}: received {received[file_id]} of {files[file_id]['length']} bytes")
+        else:
+            results[file_id] = blobs[file_id]
+            if metadata is not None:
+                metadata[file_id] = files[file_id].get("metadata")
+    return results
+
+
+def decode_arrays(blobs, metadata=None):
+    """
+    Decodes every buffer of a read_blobs result with the codec in its GridFS metadata (file_id ->
+    metadata, as filled by read_blobs), keeping exceptions in place.
+    """
+    metadata = metadata or {}
+    return {
+        file_id: blob if isinstance(blob, Exception) else capture(decode_blob, blob, metadata.get(file_id))
+        for file_id, blob in blobs.items()
+    }
+
+
+def merge_cached(file_ids, cached, blobs, cache, metadata):
+    """
+    Stores the blobs read from MongoDB in the local cache and returns them with the cached ones,
+    in file_ids order.
+    """
+    cache.put_many(blobs, metadata)
+    return {file_id: cached[file_id] if file_id in cached else blobs[file_id] for file_id in file_ids}
+
+
+def read_blobs(db, file_ids, metadata=None, bucket="fs", cache=None):
+    """
+    Reads many GridFS files with one fs.files query and one fs.chunks cursor.
+
+    GridFS.get costs a files lookup plus a chunk cursor per file, so thousands of small blobs mean
+    thousands of round trips. Here the chunks of every file are streamed with files_id $in, in
+    (files_id, n) order of the unique chunk index, into buffers preallocated from the file lengths.
+
+    Args:
+        db (Database): Database holding the GridFS bucket.
+        file_ids (list): GridFS ids to read, duplicates are read once.
+        metadata (dict): Optional dict filled with file_id -> GridFS metadata (None if unset).
+        bucket (str): GridFS bucket name.
+        cache (LocalBlobCache): Node-local cache consulted first; only its misses are read from
+            MongoDB, and stored in it.
+
+    Returns:
+        dict: file_id -> bytearray with the file content, or the NoFile / CorruptGridFile
+        exception for ids that are missing or have missing chunks.
+    """
+    file_ids = list(dict.fromkeys(file_ids))
+    if cache is not None:
+        metadata = {} if metadata is None else metadata  # Cached with every blob
+        cached = cache.get_many(file_ids, metadata)
+        missed = [file_id for file_id in file_ids if file_id not in cached]
+        if not missed:  # Fully cached batch: no query at all
+            return {file_id: cached[file_id] for file_id in file_ids}
+        blobs = read_blobs(db, missed, metadata, bucket)
+        return merge_cached(file_ids, cached, blobs, cache, metadata)
+
+    files = {file["_id"]: file for file in db[f"{bucket}.files"].find({"_id": {"$in": file_ids}}, FILES_PROJECTION)}
+    blobs, received = preallocate_blobs(files)
+
+    if blobs:
+        chunks = db[f"{bucket}.chunks"].find({"files_id": {"$in": list(blobs)}}, CHUNKS_PROJECTION)
+        for chunk in chunks.sort(CHUNKS_SORT):
+            write_chunk(chunk, files, blobs, received)
+
+    return blob_results(file_ids, files, blobs, received, metadata, bucket)
+
+
+def read_arrays(db, file_ids, metadata=None, bucket="fs", cache=None):
+    """
+    Bulk version of read_array on top of read_blobs.
+
+    Returns:
+        dict: file_id -> decoded array, or the exception raised while reading or decoding it.
+    """
+    metadata = {} if metadata is None else metadata  # The codec of every file is in its metadata
+    return decode_arrays(read_blobs(db, file_ids, metadata, bucket, cache), metadata)
+
+
+def batched(items, batch_size):
+    """Splits items into consecutive lists of at most batch_size, for bulk reads on the fetch pool."""
+    items = list(items)
+    return [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+
+
+def iter_batched(items, batch_size):
+    """Lazy version of batched, for items streamed from a cursor."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def capture(func, *args, **kwargs):
+    """Calls func and returns its result, or the exception it raised, so callers can report per fetch."""
+    try:
+        return func(*args, **kwargs)
+    except Exception as e:
+        return e
+
+
+def fetch_ordered(fetch, items, executor, max_in_flight=64):
+    """
+    Runs fetch(item) for every item on a thread pool and yields the results in input order.
+
+    At most max_in_flight calls are pending at any time, so reads are pipelined ahead of the
+    consumer without buffering the whole dataset in memory.
+
+    Args:
+        fetch (callable): Function of one item, e.g. a GridFS read.
+        items (iterable): Items to fetch, consumed lazily.
+        executor (ThreadPoolExecutor): Pool from fetch_pool.
+        max_in_flight (int): Maximum number of submitted but not yet yielded calls.
+
+    Yields:
+        fetch(item), or the exception it raised for that item.
+    """
+    items = iter(items)
+    pending = deque()
+
+    for item in items:
+        pending.append(executor.submit(fetch, item))
+        if len(pending) >= max_in_flight:
+            break
+
+    while pending:
+        future = pending.popleft()
+        for item in items:  # Refill the window before blocking on the oldest call
+            pending.append(executor.submit(fetch, item))
+            break
+
+        try:
+            yield future.result()
+        except Exception as e:
+            yield e
@@ -0,0 +1,108 @@
+import json
+import shutil
+import hashlib
+
+from bson import ObjectId
+
+from featurestore import FeatureStore
+
+
+def dataset_fingerprint(**params):
+    """
+    Hash of everything that decides the content of a feature store: the query and the
+    preprocessing parameters (image size, LiDAR projection, dtypes, ...). Values are hashed as
+    sorted JSON, non-JSON values (dtypes, ObjectIds) by their str.
+
+    Returns:
+        str: Hex SHA-256.
+    """
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def document_checksum(ids):
+    """
+    Order-independent checksum of a set of document _ids: their number and the sum of their 64-bit
+    hashes modulo 2**64. Checksums of disjoint sets add up, see merge_checksums.
+
+    Args:
+        ids (iterable): Document _ids (ObjectIds or their hex strings).
+
+    Returns:
+        dict: 'count' and 'sum', as recorded in the feature store metadata under 'documents'.
+    """
+    count, total = 0, 0
+    for document_id in ids:
+        digest = hashlib.blake2b(ObjectId(document_id).binary, digest_size=8).digest()
+        count, total = count + 1, (total + int.from_bytes(digest, "little")) % 2 ** 64
+    return {'count': count, 'sum': total}
+
+
+def merge_checksums(checksums):
+    """document_checksum of the union of disjoint sets of documents, None if one of them is None."""
+    if any(checksum is None for checksum in checksums):
+        return None
+    return {'count': sum(checksum['count'] for checksum in checksums),
+            'sum': sum(checksum['sum'] for checksum in checksums) % 2 ** 64}
+
+
+def store_watermark(path, fingerprint, collection=None, criteria=None, remove_stale=True):
+    """
+    Watermark of the feature store at path, if it was built with the same fingerprint and still
+    holds every matching document at or below its watermark.
+
+    The store records the largest document _id it has loaded and the document_checksum of the
+    documents it has loaded. A store built from another query or other preprocessing parameters
+    (or before fingerprints were recorded) is stale: it is deleted so the caller rebuilds it from
+    scratch. So is a store whose checksum no longer matches the documents criteria selects at or
+    below the watermark (one find covered by the eligibility index): a document that became
+    eligible after the store was built (e.g. a label or LiDAR added later, eligibility fields
+    recomputed), one that stopped being eligible, or one inserted with an _id below the watermark
+    (client clock behind, _ids set by the client) would otherwise never be loaded by the $gt query
+    of after_watermark, or stay in the store.
+
+    Args:
+        path (str): Feature store directory.
+        fingerprint (str): dataset_fingerprint of the current query and preprocessing.
+        collection (Collection): Collection the store was built from, None skips the checksum.
+        criteria (dict): Query filter the store was built from.
+        remove_stale (bool): False leaves a stale store in place, for the extraction tasks that run
+            concurrently (see shardedextraction.py); the merge job removes it.
+
+    Returns:
+        ObjectId: Largest _id already in the store, or None when the store has to be built.
+    """
+    if not FeatureStore.exists(path):
+        return None
+
+    metadata = FeatureStore(path).metadata
+    stale = None
+    if metadata.get('fingerprint') != fingerprint:
+        stale = "was built with another query or preprocessing"
+    elif collection is not None:
+        eligible = collection.find(at_or_before_watermark(criteria, metadata.get('watermark')), {"_id": 1})
+        if document_checksum(document["_id"] for document in eligible) != metadata.get('documents'):
+            stale = "misses matching documents at or below its watermark, or holds documents that no longer match"
+    if stale:
+        print(f"Feature store {path} {stale}, rebuilding it")
+        if remove_stale:
+            shutil.rmtree(path)
+        return None
+    # A store built from no document has no watermark: every document is newer
+    return ObjectId(metadata['watermark']) if metadata.get('watermark') else ObjectId("0" * 24)
+
+
+def after_watermark(criteria, watermark):
+    """
+    criteria restricted to documents inserted after the watermark.
+
+    ObjectIds start with their creation time in seconds, so documents inserted by later ingests
+    usually have larger _ids; store_watermark rebuilds the store when one does not.
+    """
+    if watermark is None:
+        return criteria
+    return {"$and": [criteria, {"_id": {"$gt": watermark}}]}
+
+
+def at_or_before_watermark(criteria, watermark):
+    """criteria restricted to the documents a store with this watermark should hold (none if None)."""
+    return {"$and": [criteria, {"_id": {"$lte": ObjectId(watermark) if watermark else ObjectId("0" * 24)}}]}
@@ -0,0 +1,573 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+import cv2
+
+# Cloud alignment, part of the projection cache key and of the feature store fingerprint.
+# "pca-float64": x, y and z are converted to float64 before the alignment and the rasterization,
+# whatever dtype the cloud is stored in, so the closed-form angle matches a PCA of the same points.
+# (Before, float32 clouds were fitted by sklearn, rotated and binned in float32.)
+ALIGNMENT = "pca-float64"
+
+
+def _principal_angle_from_moments(sxx, syy, sxy):
+    """
+    Angle of the first principal component from the central second moments of x and y.
+
+    Closed-form eigenvector of the 2x2 covariance matrix, with the sign convention of
+    sklearn.decomposition.PCA (svd_flip with u_based_decision=False): the component is flipped
+    so that its largest absolute entry is positive, the x entry winning ties.
+    """
+    theta = 0.5 * np.arctan2(2 * sxy, sxx - syy)  # Major axis in [-pi/2, pi/2], so cos(theta) >= 0
+    flip = (np.abs(np.sin(theta)) > np.abs(np.cos(theta))) & (np.sin(theta) < 0)
+    return np.where(flip, theta + np.pi, theta)
+
+
+def principal_angle(x, y):
+    """
+    Dominant direction of a point cloud in the X-Y plane, as np.arctan2 of the first PCA component.
+
+    The moments are accumulated in float64, and aligned_coordinates passes float64 coordinates
+    whatever the dtype of the cloud (see ALIGNMENT): the angle matches
+    PCA(n_components=2).fit(np.vstack((x, y)).T) of those float64 points to ~1e-13 rad.
+
+    Args:
+        x (numpy array): X coordinates.
+        y (numpy array): Y coordinates.
+
+    Returns:
+        float: Angle in radians, as the first component of a float64 PCA fit.
+    """
+    dx = np.asarray(x, dtype=np.float64)
+    dy = np.asarray(y, dtype=np.float64)
+    dx = dx - dx.mean()
+    dy = dy - dy.mean()
+    return float(_principal_angle_from_moments(np.dot(dx, dx), np.dot(dy, dy), np.dot(dx, dy)))
+
+
+def principal_angles(lidar_clouds):
+    """
+    Dominant X-Y direction of many point clouds at once.
+
+    All clouds are concatenated and the per-cloud moments are accumulated with np.add.reduceat,
+    so the cost is a few vectorized passes over all points instead of one estimator call per cloud.
+
+    Args:
+        lidar_clouds (list): Point clouds of shape (N, >=2) with x, y in the first two columns.
+
+    Returns:
+        numpy array: One angle in radians per cloud, as principal_angle.
+    """
+    lengths = np.array([len(cloud) for cloud in lidar_clouds])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    x = np.concatenate([cloud[:, 0] for cloud in lidar_clouds]).astype(np.float64)
+    y = np.concatenate([cloud[:, 1] for cloud in lidar_clouds]).astype(np.float64)
+
+    # Center every cloud on its own mean before accumulating the second moments
+    x -= np.repeat(np.add.reduceat(x, starts) / lengths, lengths)
+    y -= np.repeat(np.add.reduceat(y, starts) / lengths, lengths)
+
+    sxy = np.add.reduceat(x * y, starts)
+    x *= x
+    y *= y
+    return _principal_angle_from_moments(np.add.reduceat(x, starts), np.add.reduceat(y, starts), sxy)
+
+
+def scatter_max(rows, cols, values, shape):
+    """
+    Max-aggregates values into a 2D grid in a single vectorized pass.
+
+    Args:
+        rows (numpy array): Row index of every point.
+        cols (numpy array): Column index of every point.
+        values (numpy array): Value of every point.
+        shape (tuple): (height, width) of the output grid.
+
+    Returns:
+        numpy array: float32 grid holding the maximum value per cell, 0 where no point landed.
+    """
+    # Flatten (row, col) into a single cell index so one ufunc call covers the whole grid
+    flat_index = rows * shape[1] + cols
+    return _max_grid(flat_index, values, shape[0] * shape[1]).reshape(shape)
+
+
+def _max_grid(flat_index, values, num_bins):
+    """Maximum value per flat cell index, 0 where no point landed."""
+    # Empty cells start at -inf so any real value wins, then become 0 like np.nan_to_num(nan=0.0)
+    grid = np.full(num_bins, -np.inf, dtype=np.float32)
+    np.maximum.at(grid, flat_index, values.astype(np.float32, copy=False))
+    grid[np.isneginf(grid)] = 0.0
+    return grid
+
+
+# Per-cell statistics available to the multi-channel rasterizer, see rasterize_stats
+LIDAR_PLANES = ("xy", "xz", "yz")
+LIDAR_STATS = ("max", "min", "mean", "count", "density")
+
+
+# Points whose bin index is computed at once, bounds the temporaries of _flat_bins
+BIN_CHUNK_POINTS = 1 << 16
+
+
+def _axis_bins(grid_length, out_length):
+    """
+    Direct-mode bin of every full-resolution cell along one axis, None if the axis is not downscaled.
+
+    Cell c joins the block of the last output pixel whose INTER_NEAREST sample
+    floor(d * size / out) is <= c, so each block contains the cell resize would sample.
+    Upscaled axes keep their full resolution and are replicated by the final resize.
+    """
+    if grid_length <= out_length:
+        return None
+    return ((np.arange(grid_length, dtype=np.int64) + 1) * out_length - 1) // grid_length
+
+
+def _flat_bins(rows, cols, grid_shape, output_size, mode):
+    """
+    Flat index of the bin every point is rasterized into before the final resize.
+
+    The index is written chunk by chunk into a single int64 array, with per-axis lookup tables for
+    the direct-mode bins, so beyond the index itself only BIN_CHUNK_POINTS-sized temporaries are
+    allocated per point, in either mode.
+
+    Returns:
+        tuple: (flat_index, bins_shape). bins_shape is the full-resolution grid_shape in "resize"
+        mode and at most the output size in "direct" mode; either way it is resized to output_size
+        with INTER_NEAREST when it differs.
+    """
+    if mode == "resize":
+        row_bins, col_bins, bins_shape = None, None, grid_shape
+    elif mode == "direct":
+        out_w, out_h = output_size
+        row_bins, col_bins = _axis_bins(grid_shape[0], out_h), _axis_bins(grid_shape[1], out_w)
+        bins_shape = (min(grid_shape[0], out_h), min(grid_shape[1], out_w))
+    else:
+        raise ValueError(f"Unknown rasterization mode: {mode}. Use 'resize' or 'direct'.")
+
+    flat_index = np.empty(len(rows), dtype=np.int64)
+    for start in range(0, len(rows), BIN_CHUNK_POINTS):
+        chunk = slice(start, start + BIN_CHUNK_POINTS)
+        chunk_rows = rows[chunk] if row_bins is None else row_bins[rows[chunk]]
+        chunk_cols = cols[chunk] if col_bins is None else col_bins[cols[chunk]]
+        np.multiply(chunk_rows, bins_shape[1], out=flat_index[chunk])
+        flat_index[chunk] += chunk_cols
+
+    return flat_index, bins_shape
+
+
+def _block_sizes(grid_length, out_length):
+    """Number of full-resolution cells in every direct-mode bin along one axis."""
+    bins = _axis_bins(grid_length, out_length)
+    if bins is None:
+        return np.ones(grid_length, dtype=np.int64)
+    return np.bincount(bins, minlength=out_length)
+
+
+def rasterize_max(rows, cols, values, grid_shape, output_size=(300, 100), mode="resize"):
+    """
+    Max-aggregates points given as full-resolution grid cells into an output_size image.
+
+    Args:
+        rows (numpy array): Full-resolution row index of every point.
+        cols (numpy array): Full-resolution column index of every point.
+        values (numpy array): Value of every point.
+        grid_shape (tuple): (height, width) of the full-resolution grid.
+        output_size (tuple): (width, height) of the returned image.
+        mode (str): "resize" builds the full-resolution grid and resizes it with INTER_NEAREST,
+            so every output pixel samples a single grid cell. "direct" bins the points straight
+            into the output grid, so every output pixel is the maximum over the block of grid
+            cells it covers: the grid no longer scales with the cloud extent, which saves memory
+            on strip- and field-sized clouds, while plot-sized grids are small in either mode.
+            Direct mode is not a drop-in replacement for resize: the values differ wherever a
+            block holds more than the sampled cell (>= the resized value, about half of the XY
+            pixels of a plot), so models trained on one mode need the same mode at inference.
+
+    Returns:
+        numpy array: float32 image of shape (height, width).
+    """
+    flat_index, bins_shape = _flat_bins(rows, cols, grid_shape, output_size, mode)
+    grid = _max_grid(flat_index, values, bins_shape[0] * bins_shape[1]).reshape(bins_shape)
+    if bins_shape != (output_size[1], output_size[0]):
+        grid = cv2.resize(grid, output_size, interpolation=cv2.INTER_NEAREST)
+    return grid
+
+
+def rasterize_stats(rows, cols, values, grid_shape, stats, output_size=(300, 100), mode="resize", cell_area=1.0):
+    """
+    Computes several per-cell statistics of the points in one sweep.
+
+    The flat cell index and the per-cell point count are computed once and shared by every
+    statistic (bincount for count/mean/density, ufunc.at for max/min), so asking for more
+    channels does not add passes over the cloud geometry.
+
+    Args:
+        rows, cols, values, grid_shape, output_size, mode: As in rasterize_max.
+        stats (list): Statistics from LIDAR_STATS: "max", "min", "mean" of the values,
+            "count" of points and "density" in points per unit of cell_area.
+        cell_area (float): Area of one full-resolution cell (resolution ** 2 cm^2).
+
+    Returns:
+        dict: stat -> float32 image of shape (height, width), 0 where no point landed.
+    """
+    unknown = [stat for stat in stats if stat not in LIDAR_STATS]
+    if unknown:
+        raise ValueError(f"Unknown LiDAR statistics: {unknown}. Use any of {LIDAR_STATS}.")
+
+    flat_index, bins_shape = _flat_bins(rows, cols, grid_shape, output_size, mode)
+    num_bins = bins_shape[0] * bins_shape[1]
+
+    values = values.astype(np.float32, copy=False)
+    counts = np.bincount(flat_index, minlength=num_bins)
+    empty = counts == 0
+
+    images = {}
+    for stat in stats:
+        if stat == "max":
+            grid = np.full(num_bins, -np.inf, dtype=np.float32)
+            np.maximum.at(grid, flat_index, values)
+        elif stat == "min":
+            grid = np.full(num_bins, np.inf, dtype=np.float32)
+            np.minimum.at(grid, flat_index, values)
+        elif stat == "mean":
+            grid = np.bincount(flat_index, weights=values, minlength=num_bins) / np.maximum(counts, 1)
+        elif stat == "count":
+            grid = counts
+        else:  # density
+            if mode == "direct":
+                out_w, out_h = output_size
+                block_area = np.outer(_block_sizes(grid_shape[0], out_h), _block_sizes(grid_shape[1], out_w)).ravel()
+            else:
+                block_area = 1
+            grid = counts / (block_area * cell_area)
+
+        grid = grid.astype(np.float32)
+        grid[empty] = 0.0
+        grid = grid.reshape(bins_shape)
+        if bins_shape != (output_size[1], output_size[0]):
+            grid = cv2.resize(grid, output_size, interpolation=cv2.INTER_NEAREST)
+        images[stat] = grid
+
+    return images
+
+
+def parse_channels(channels):
+    """
+    Validates a LiDAR channel spec such as ["xy:max", "xz:max", "yz:max", "xy:count"].
+
+    Returns:
+        list: (plane, stat) tuples in the requested channel order.
+    """
+    parsed = []
+    for channel in channels:
+        plane, _, stat = channel.partition(":")
+        if plane not in LIDAR_PLANES or stat not in LIDAR_STATS:
+            raise ValueError(
+                f"Invalid LiDAR channel '{channel}'. Use '<plane>:<stat>' with plane in {LIDAR_PLANES} "
+                f"and stat in {LIDAR_STATS}.")
+        parsed.append((plane, stat))
+    return parsed
+
+
+def check_downsampled_channels(voxel_size, channels=None, resolution=1):
+    """
+    Raises ValueError unless projections of a cloud reduced by voxel_downsample(voxel_size) are
+    identical to those of the full cloud: max channels only, at a resolution that is a multiple
+    of the voxel size. Min, mean, count and density need the full-density cloud.
+
+    Args:
+        voxel_size (float): Voxel edge in centimeters the cloud was reduced with.
+        channels (list): Channel spec to project, None for the classic max-height stack.
+        resolution (float): Projection grid cell size in centimeters.
+    """
+    stats = {stat for _, stat in parse_channels(channels)} if channels is not None else {"max"}
+    if stats != {"max"}:
+        raise ValueError(
+            f"LiDAR voxel-downsampled to {voxel_size} cm only preserves max channels, not "
+            f"{sorted(stats - {'max'})}; these need clouds uploaded at full density")
+    multiple = resolution / voxel_size
+    if multiple < 1 or not np.isclose(multiple, round(multiple)):
+        raise ValueError(
+            f"Projection resolution {resolution} cm is not a multiple of the {voxel_size} cm voxel size")
+
+
+def aligned_coordinates(lidar_raw, angle=None):
+    """
+    Moves a point cloud into the grid frame of projection3x, in float64 whatever its dtype
+    (see ALIGNMENT).
+
+    Args:
+        lidar_raw (numpy array): Point cloud of shape (N, >=3) with x, y, z in meters.
+        angle (float): Precomputed dominant X-Y angle, computed with principal_angle when None.
+
+    Returns:
+        tuple: (rotated_x, rotated_y, z, angle), coordinates in centimeters starting at 0.
+    """
+    # Separate the data into x, y, z, as float64 copies
+    x, y, z = (lidar_raw[:, axis].astype(np.float64) for axis in range(3))
+
+    # Scale coordinates to centimeters
+    x = x * 100
+    y = y * 100
+    z = z * 100
+
+    # Set minimum of each axis to 0 cm
+    x -= np.min(x)
+    y -= np.min(y)
+    z -= np.min(z)
+
+    # PCA for dominant direction in X-Y plane (optional for rotation)
+    points = np.vstack((x, y)).T
+    if angle is None:
+        angle = principal_angle(x, y)
+
+    # Rotate points to align with grid axes
+    rotation_matrix = np.array([
+        [np.cos(-angle), -np.sin(-angle)],
+        [np.sin(-angle), np.cos(-angle)]
+    ])
+    rotated_points = points @ rotation_matrix.T
+    rotated_x, rotated_y = rotated_points[:, 0], rotated_points[:, 1]
+
+    # Flip the x and y coordinates for X-Z and Y-Z projections if needed
+    rotated_x = np.max(rotated_x) - rotated_x  # Flip x-axis for X-Z plane
+    rotated_y = np.max(rotated_y) - rotated_y  # Flip y-axis for Y-Z plane
+
+    return rotated_x, rotated_y, z, angle
+
+
+def voxel_downsample(lidar_raw, voxel_size=1, angle=None):
+    """
+    Keeps only the highest points of every occupied voxel, in the grid frame of projection3x.
+
+    Voxels are cubes of voxel_size centimeters laid on the rotated and flipped grid, so every
+    projection cell is a union of whole voxels whenever the projection resolution is a multiple of
+    voxel_size. Max-height projections of the reduced cloud are then identical to the full cloud,
+    provided it is projected with the returned angle: the points defining the grid extents are
+    kept as well. Other statistics (min, mean, count, density) do change, see
+    check_downsampled_channels.
+
+    Args:
+        lidar_raw (numpy array): Point cloud of shape (N, >=3) with x, y, z in meters.
+        voxel_size (float): Voxel edge in centimeters.
+        angle (float): Precomputed dominant X-Y angle, computed with principal_angle when None.
+
+    Returns:
+        tuple: (reduced cloud, a subset of the rows of lidar_raw, angle to pass to projection3x).
+    """
+    rotated_x, rotated_y, z, angle = aligned_coordinates(lidar_raw, angle)
+
+    # Single int64 key per voxel, compacted to 0..n_voxels-1 before the max pass
+    voxel_x = (rotated_x / voxel_size).astype(np.int64)
+    voxel_y = (rotated_y / voxel_size).astype(np.int64)
+    voxel_z = (z / voxel_size).astype(np.int64)
+    key = (voxel_x * (voxel_y.max() + 1) + voxel_y) * (voxel_z.max() + 1) + voxel_z
+    _, voxel = np.unique(key, return_inverse=True)
+
+    voxel_max = np.full(voxel.max() + 1, -np.inf)
+    np.maximum.at(voxel_max, voxel, z)
+    keep = z >= voxel_max[voxel]  # Ties are all kept, they cost little and change nothing
+
+    # Points setting the world minima and the rotated extents fix the grid origin and size
+    keep[[np.argmin(lidar_raw[:, 0]), np.argmin(lidar_raw[:, 1]), np.argmin(z),
+          np.argmin(rotated_x), np.argmax(rotated_x), np.argmin(rotated_y), np.argmax(rotated_y)]] = True
+
+    return lidar_raw[keep], angle
+
+
+def projection3x(lidar_raw, resolution=1, output_size=(300, 100), mode="resize", channels=None, angle=None):
+    """
+    Projects a LiDAR point cloud onto the X-Y, X-Z and Y-Z planes using maximum height aggregation.
+
+    With a channel spec, any per-cell statistic of Z can be emitted instead of only the maximum,
+    e.g. channels=["xy:max", "xz:max", "yz:max", "xy:mean", "xy:density"].
+
+    The default output is bit-identical to the former per-point loop with a sklearn PCA, run on
+    the cloud converted to float64 (see ALIGNMENT). float32 clouds used to be processed in
+    float32, so their projections differ from that earlier output wherever a point lies close to
+    a cell boundary (a few pixels per cloud, by up to the full height range). Stores and caches of
+    the earlier output are rebuilt (PREPROCESSING_VERSION, ALIGNMENT in the cache key).
+
+    Args:
+        lidar_raw (numpy array): Point cloud of shape (N, >=3) with x, y, z in meters.
+        resolution (float): Grid cell size in centimeters for all three planes.
+        output_size (tuple): (width, height) the grids are resized to.
+        mode (str): "resize" (default) or "direct" rasterization, see rasterize_max.
+        channels (list): Optional '<plane>:<stat>' spec, see parse_channels and rasterize_stats.
+            None keeps the classic max-height XY, XZ, YZ stack.
+        angle (float): Precomputed dominant X-Y angle, e.g. from principal_angles over a batch.
+            Computed with principal_angle when None.
+
+    Returns:
+        numpy array: Stacked projections of shape (height, width, 3), or (height, width, len(channels)).
+    """
+    # Check if the lidar data has enough points (at least 2 samples and features)
+    if lidar_raw.shape[0] < 2 or lidar_raw.shape[1] < 2:
+        raise ValueError(
+            f"Insufficient lidar data: {lidar_raw.shape[0]} samples and {lidar_raw.shape[1]} features. PCA cannot be applied.")
+
+    rotated_x, rotated_y, z, _ = aligned_coordinates(lidar_raw, angle)
+
+    # Define resolution for each plane
+    xy_resolution = resolution  # 1 cm by default for X-Y plane
+    xz_resolution = resolution  # 1 cm by default for X-Z plane
+    yz_resolution = resolution  # 1 cm by default for Y-Z plane
+
+    # Define boundaries for each plane
+    x_min, x_max = np.min(rotated_x), np.max(rotated_x)
+    y_min, y_max = np.min(rotated_y), np.max(rotated_y)
+    z_min, z_max = np.min(z), np.max(z)
+
+    # Calculate grid sizes
+    grid_x_size_xy = int((x_max - x_min) / xy_resolution) + 1
+    grid_y_size_xy = int((y_max - y_min) / xy_resolution) + 1
+    grid_x_size_xz = int((x_max - x_min) / xz_resolution) + 1
+    grid_z_size_xz = int((z_max - z_min) / xz_resolution) + 1
+    grid_y_size_yz = int((y_max - y_min) / yz_resolution) + 1
+    grid_z_size_yz = int((z_max - z_min) / yz_resolution) + 1
+
+    def plane_cells():
+        """
+        Yields (plane, rows, cols, grid_shape) per plane, so only one plane's index arrays are
+        alive at a time (astype truncates like int() for these non-negative offsets).
+        """
+        yield ("xy",
+               ((rotated_y - y_min) / xy_resolution).astype(np.int64),
+               ((rotated_x - x_min) / xy_resolution).astype(np.int64),
+               (grid_y_size_xy, grid_x_size_xy))
+        yield ("xz",
+               ((z - z_min) / xz_resolution).astype(np.int64),
+               ((rotated_x - x_min) / xz_resolution).astype(np.int64),
+               (grid_z_size_xz, grid_x_size_xz))
+        yield ("yz",
+               ((z - z_min) / yz_resolution).astype(np.int64),
+               ((rotated_y - y_min) / yz_resolution).astype(np.int64),
+               (grid_z_size_yz, grid_y_size_yz))
+
+    # Project Z onto X-Y, X-Z and Y-Z planes using maximum aggregation
+    if channels is None:
+        return np.dstack([
+            rasterize_max(rows, cols, z, grid_shape, output_size, mode)
+            for _, rows, cols, grid_shape in plane_cells()
+        ])
+
+    # Multi-channel: one set of cell indices per plane serves every statistic requested for it
+    requested = parse_channels(channels)
+    images = {}
+    for plane, rows, cols, grid_shape in plane_cells():
+        stats = list(dict.fromkeys(stat for channel_plane, stat in requested if channel_plane == plane))
+        if stats:
+            plane_images = rasterize_stats(rows, cols, z, grid_shape, stats, output_size, mode,
+                                           cell_area=resolution ** 2)
+            images.update({(plane, stat): image for stat, image in plane_images.items()})
+
+    return np.dstack([images[channel] for channel in requested])
+
+
+def projection_pool(workers=None):
+    """
+    Creates a process pool for project_lidar_batch and starts all of its workers.
+
+    Workers are forked rather than spawned: the training scripts have no __main__ guard,
+    so a spawned (or forkserver) worker would re-run the whole script on import. Forking a
+    process with running threads (TensorFlow/CUDA, pymongo monitors, the GridFS fetch pool,
+    OpenCV) can leave a child blocked on a lock one of them held, so every worker is forked
+    here, before returning, and never later: create the pool right after importing this module,
+    before those start, and reuse it for every batch.
+
+    Args:
+        workers (int): Number of worker processes, defaults to all vCPUs.
+
+    Returns:
+        ProcessPoolExecutor: Pool that can be reused across many batches.
+    """
+    # Workers share the parent's shared-memory tracker, instead of each starting one that would
+    # report (and unlink) the batch blocks they attach to as leaked when the pool shuts down
+    resource_tracker.ensure_running()
+    executor = ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(),
+        mp_context=multiprocessing.get_context("fork")
+    )
+    # A fork pool launches all max_workers processes on the first submit
+    executor.submit(os.getpid).result()
+    return executor
+
+
+def _project_shared(shm_name, offset, shape, dtype, projection_kwargs):
+    """Worker side of project_lidar_batch: views one cloud in shared memory and projects it."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        # The temporary view is released before close(), projection3x never returns a view of it
+        return projection3x(np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset), **projection_kwargs)
+    finally:
+        shm.close()
+
+
+def project_lidar_batch(lidar_clouds, workers=None, executor=None, return_exceptions=False, angles=None,
+                        **projection_kwargs):
+    """
+    Projects many LiDAR point clouds in parallel with projection3x.
+
+    The point arrays are copied once into a single shared-memory block, so only offsets and
+    shapes are pickled to the workers; the (100, 300, 3) projections come back in order.
+
+    Args:
+        lidar_clouds (list): Point clouds of shape (N, >=3).
+        workers (int): Number of worker processes when no executor is given, defaults to all vCPUs.
+        executor (ProcessPoolExecutor): Optional pool from projection_pool to reuse across batches.
+            Without one a pool is forked for this call, only safe in a process without threads.
+        return_exceptions (bool): If True, a failed projection is returned as its exception
+            instead of being raised, so one bad cloud does not drop the whole batch.
+        angles (list): Optional per-cloud X-Y angle, e.g. the one stored with a cloud reduced by
+            voxel_downsample; None entries are computed by projection3x.
+        **projection_kwargs: Forwarded to projection3x (resolution, output_size, mode, channels).
+
+    Returns:
+        list: Projections in the same order as lidar_clouds.
+    """
+    if len(lidar_clouds) == 0:
+        return []
+
+    lidar_clouds = [np.ascontiguousarray(cloud) for cloud in lidar_clouds]
+
+    # Lay all clouds out back to back, each aligned to 64 bytes
+    offsets, total_bytes = [], 0
+    for cloud in lidar_clouds:
+        offsets.append(total_bytes)
+        total_bytes += -(-cloud.nbytes // 64) * 64
+
+    shm = shared_memory.SharedMemory(create=True, size=max(total_bytes, 1))
+    own_executor = executor is None
+    if own_executor:
+        executor = projection_pool(workers)
+
+    try:
+        for cloud, offset in zip(lidar_clouds, offsets):
+            np.ndarray(cloud.shape, dtype=cloud.dtype, buffer=shm.buf, offset=offset)[...] = cloud
+
+        if angles is None:
+            angles = [None] * len(lidar_clouds)
+
+        futures = [
+            executor.submit(_project_shared, shm.name, offset, cloud.shape, cloud.dtype.str,
+                            {**projection_kwargs, "angle": angle})
+            for cloud, offset, angle in zip(lidar_clouds, offsets, angles)
+        ]
+
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+        shm.close()
+        shm.unlink()
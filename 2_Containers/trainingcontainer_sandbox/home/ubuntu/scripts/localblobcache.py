@@ -0,0 +1,177 @@
+import os
+import time
+import threading
+
+import bson
+
+
+class LocalBlobCache:
+    """
+    Node-local on-disk LRU cache of encoded GridFS blobs keyed by file id.
+
+    Jobs of a sweep (batch sizes, learning rates, ...) read the same blobs from the MongoDB dbPath
+    on the shared file system; with the cache on a node-local directory (tmpfs such as /dev/shm,
+    or local NVMe) every job after the first one reads them from the node instead. GridFS files
+    are never modified, so an entry never goes stale. Every blob is one file <file_id>.blob
+    holding its GridFS metadata (BSON, for the codec) followed by the encoded bytes as stored in
+    GridFS, so compressed blobs stay compressed on the node.
+
+    Like ProjectionCache, reads refresh the file modification time and the least recently used
+    files are evicted once the directory grows beyond max_bytes. Writes go through a temporary
+    file and os.replace, so concurrent jobs and fetch threads sharing the directory never read a
+    partially written blob; a failed write (e.g. a full disk) only skips caching that blob.
+    """
+
+    STALE_TMP_SECONDS = 3600  # Temporary files of jobs killed while writing are removed after this
+
+    def __init__(self, cache_dir, max_bytes=50 * 1024 ** 3):
+        """
+        Args:
+            cache_dir (str): Node-local directory holding the cached blobs, created if missing.
+            max_bytes (int): Size budget of the directory before LRU eviction kicks in. Blobs in
+                a tmpfs directory use RAM, so keep it well below the free memory of the node.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits, self.misses = 0, 0
+        self.hit_bytes, self.stored_bytes = 0, 0
+        self._lock = threading.Lock()  # Counters and size, the cache is shared by fetch threads
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._remove_stale_tmp()
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _path(self, file_id):
+        return os.path.join(self.cache_dir, f"{file_id}.blob")
+
+    def _entries(self):
+        """(mtime, size, path) of every cached blob."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".blob"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # Evicted by another job in the meantime
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _remove_stale_tmp(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".tmp"):
+                try:
+                    if entry.stat().st_mtime < time.time() - self.STALE_TMP_SECONDS:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def get(self, file_id):
+        """
+        Returns (blob, metadata) cached for file_id, or None on a miss.
+
+        Returns:
+            tuple: bytearray with the encoded file content and its GridFS metadata dict (or None).
+        """
+        path = self._path(file_id)
+        try:
+            with open(path, "rb") as f:
+                header = f.read(4)
+                header += f.read(int.from_bytes(header, "little") - 4)
+                metadata = bson.decode(header)["metadata"]
+                blob = bytearray(os.fstat(f.fileno()).st_size - len(header))
+                f.readinto(blob)
+            os.utime(path)  # Mark as recently used for LRU eviction
+        except (OSError, ValueError, bson.errors.BSONError):  # Missing, evicted or unreadable entry
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+            self.hit_bytes += len(blob)
+        return blob, metadata
+
+    def get_many(self, file_ids, metadata=None):
+        """
+        Cached blobs of many ids.
+
+        Args:
+            file_ids (list): GridFS ids.
+            metadata (dict): Optional dict filled with file_id -> GridFS metadata of every hit.
+
+        Returns:
+            dict: file_id -> bytearray, for the hits only.
+        """
+        blobs = {}
+        for file_id in file_ids:
+            entry = self.get(file_id)
+            if entry is not None:
+                blobs[file_id] = entry[0]
+                if metadata is not None:
+                    metadata[file_id] = entry[1]
+        return blobs
+
+    def put(self, file_id, blob, metadata=None):
+        """
+        Stores an encoded blob and its GridFS metadata and evicts the least recently used entries
+        if over budget. Blobs larger than the whole budget are not cached.
+        """
+        header = bson.encode({"metadata": metadata})
+        size = len(header) + len(blob)
+        if size > self.max_bytes:
+            return
+
+        path = self._path(file_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(header)
+                f.write(blob)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self.stored_bytes += size
+            self._total_bytes += size
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def put_many(self, blobs, metadata=None):
+        """Stores every blob of a read_blobs result, skipping exceptions."""
+        metadata = metadata or {}
+        for file_id, blob in blobs.items():
+            if not isinstance(blob, Exception):
+                self.put(file_id, blob, metadata.get(file_id))
+
+    def evict(self):
+        """
+        Deletes the least recently used blobs until the cache fits in max_bytes.
+        """
+        entries = sorted(self._entries())
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+        with self._lock:
+            self._total_bytes = total_bytes
+
+    def print_stats(self):
+        """Prints hit/miss counters, the bytes served from and written to the node and the cache size."""
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0.0
+        print(f"Local blob cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+              f"{self.hit_bytes / 1024 ** 2:.1f} MiB served, {self.stored_bytes / 1024 ** 2:.1f} MiB written, "
+              f"{self._total_bytes / 1024 ** 2:.1f} MiB in {self.cache_dir}")
@@ -0,0 +1,112 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from lidarprojection import ALIGNMENT
+
+
+def params_hash(projection_kwargs):
+    """
+    Short stable hash of the projection parameters and of the cloud ALIGNMENT, so a change in
+    resolution, output size or alignment never serves a stale projection.
+    """
+    params = json.dumps({**projection_kwargs, "alignment": ALIGNMENT}, sort_keys=True, default=str)
+    return hashlib.sha1(params.encode("utf-8")).hexdigest()[:12]
+
+
+class ProjectionCache:
+    """
+    On-disk LRU cache of LiDAR projections keyed by lidar_id and the projection parameters.
+
+    Every projection is stored as one .npy file named <lidar_id>_<params_hash>.npy. Reads refresh
+    the file modification time and the least recently used files are evicted once the cache grows
+    beyond max_bytes. Writes go through a temporary file and os.replace, so concurrent jobs sharing
+    the directory never read a partially written projection.
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3, **projection_kwargs):
+        """
+        Args:
+            cache_dir (str): Directory holding the cached projections, created if missing.
+            max_bytes (int): Size budget of the directory before LRU eviction kicks in.
+            **projection_kwargs: Parameters passed to projection3x, part of the cache key.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.projection_kwargs = projection_kwargs
+        self.params_hash = params_hash(projection_kwargs)
+        self.hits, self.misses = 0, 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _path(self, lidar_id):
+        return os.path.join(self.cache_dir, f"{lidar_id}_{self.params_hash}.npy")
+
+    def _entries(self):
+        """(mtime, size, path) of every cached projection, for all parameter sets."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # Evicted by another job in the meantime
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def get(self, lidar_id):
+        """
+        Returns the cached projection for lidar_id, or None on a miss.
+        """
+        path = self._path(lidar_id)
+        try:
+            projection = np.load(path)
+            os.utime(path)  # Mark as recently used for LRU eviction
+        except (OSError, ValueError):  # Missing, evicted or unreadable entry
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return projection
+
+    def put(self, lidar_id, projection):
+        """
+        Stores a projection and evicts the least recently used entries if over budget.
+        """
+        path = self._path(lidar_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, projection)
+        os.replace(tmp_path, path)
+
+        self._total_bytes += os.path.getsize(path)
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used projections until the cache fits in max_bytes.
+        """
+        entries = sorted(self._entries())
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+        self._total_bytes = total_bytes
+
+    def print_stats(self):
+        """Prints hit/miss counters and the current cache size."""
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0.0
+        print(f"Projection cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+              f"{self._total_bytes / 1024 ** 2:.1f} MiB in {self.cache_dir}")
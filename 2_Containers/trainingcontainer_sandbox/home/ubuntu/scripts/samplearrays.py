@@ -0,0 +1,170 @@
+import resource
+
+import numpy as np
+
+from datasetstats import DatasetStats
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far (ru_maxrss is in KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Storage dtypes of the training inputs. The models rescale images (1/255) and LiDAR (1/150) with
+# Rescaling layers, which cast to float32 inside the graph, so the host arrays never hold scaled
+# float64 copies: images stay uint8, LiDAR projections and weather float16 (heights in cm and weather values are
+# far below the float16 limit of 65504), dates and labels float32. Inputs missing from a dtype map
+# keep the dtype they were loaded with.
+IMAGE_DTYPES = {'rgb': np.uint8, 'nir': np.uint8}
+COMPACT_DTYPES = {
+    **IMAGE_DTYPES,
+    'lidar': np.float16, 'weather': np.float16,
+    'seedingdate': np.float32, 'imagedate': np.float32,
+    'flowering': np.float32, 'maturity': np.float32, 'yield': np.float32,
+}
+
+# Storage modes compared by print_memory_report, as input name -> dtype with float64 as default:
+# every input as float64 is what host-side x / 255 and x / 150 produced
+DTYPE_MODES = {
+    'float64': {},
+    'uint8 images': IMAGE_DTYPES,
+    'compact': COMPACT_DTYPES,
+}
+
+
+def store_value(array, index, name, value):
+    """
+    Copies one sample of an input into array[index], casting it to the array dtype.
+
+    Raises:
+        OverflowError: If finite values become Inf in a float16 array.
+    """
+    with np.errstate(over='ignore'):  # float16 overflow is reported below
+        array[index] = value  # Cast in place, e.g. float images to uint8
+    if array.dtype == np.float16 and np.isinf(array[index]).any() and not np.isinf(value).any():
+        raise OverflowError(f"{name} values exceed the float16 range, disable the compact dtypes")
+
+
+class SampleArrays:
+    """
+    Training inputs written sample by sample into preallocated contiguous arrays.
+
+    Collecting samples in Python lists and calling np.array at the end briefly holds two full
+    copies of every input. Here each input gets one array of capacity samples, allocated when the
+    first sample arrives (its shape and, unless given in dtypes, its dtype are taken from that
+    sample), and every later sample is copied straight into its slot. With preallocate=False the
+    previous list-then-np.array behaviour is kept for comparison. The DatasetStats of the samples
+    (NaN/Inf counts, min/max, mean/variance, label histograms) are updated on every append.
+    """
+
+    def __init__(self, capacity, dtypes=None, preallocate=True):
+        """
+        Args:
+            capacity (int): Upper bound on the number of samples, e.g. the number of RGB/NIR pairs.
+            dtypes (dict): Optional input name -> dtype the samples are cast to, e.g. {'rgb': np.uint8}.
+            preallocate (bool): False collects lists and converts them with np.array instead.
+        """
+        self.capacity = capacity
+        self.dtypes = dtypes or {}
+        self.preallocate = preallocate
+        self.count = 0
+        self.stats = DatasetStats()
+        self._arrays = {}
+
+    def __len__(self):
+        return self.count
+
+    def append(self, sample):
+        """
+        Adds one sample, given as a dict of input name -> array or scalar.
+        """
+        if self.count >= self.capacity:
+            raise IndexError(f"SampleArrays is full ({self.capacity} samples)")
+
+        for name, value in sample.items():
+            if not self.preallocate:
+                self._arrays.setdefault(name, []).append(value)
+                continue
+
+            if name not in self._arrays:
+                value = np.asarray(value)
+                self._arrays[name] = np.empty((self.capacity,) + value.shape, dtype=self.dtypes.get(name, value.dtype))
+            store_value(self._arrays[name], self.count, name, value)
+
+        self.stats.update(sample)
+        self.count += 1
+
+    def trim(self):
+        """
+        Shrinks every preallocated input to the loaded samples, in place (realloc, no copy), so the
+        slots left empty by dropped samples are returned to the system.
+
+        Must be called before any array is taken with [] or take: views of the old buffers would be
+        left dangling.
+        """
+        if self.preallocate:
+            for array in self._arrays.values():
+                array.resize((self.count,) + array.shape[1:], refcheck=False)
+        self.capacity = self.count
+
+    def bytes_per_sample(self, dtypes=None):
+        """
+        Memory taken by one sample of every input.
+
+        Args:
+            dtypes (dict): Input name -> dtype to size the inputs with, float64 for names it lacks.
+                None gives the dtypes the inputs are actually stored in.
+
+        Returns:
+            dict: Input name -> bytes per sample.
+        """
+        sizes = {}
+        for name, array in self._arrays.items():
+            first = np.asarray(array[0])  # Both modes: the stored slot, or the first collected value
+            dtype = first.dtype if dtypes is None else np.dtype(dtypes.get(name, np.float64))
+            sizes[name] = first.size * dtype.itemsize
+        return sizes
+
+    def take(self, indices, names=None):
+        """
+        Gathers the samples at indices into new arrays.
+
+        Args:
+            indices (array-like): Sample indices, in the order of the returned batch.
+            names (list): Inputs to gather, all of them by default.
+
+        Returns:
+            dict: Input name -> array of shape (len(indices), ...).
+        """
+        return {name: self[name][np.asarray(indices, dtype=np.int64)] for name in (names or list(self._arrays))}
+
+    def __getitem__(self, name):
+        """
+        Returns the filled part of an input as an array of shape (len(self), ...).
+
+        In preallocated mode this is a view: slots left empty by dropped samples stay allocated.
+        """
+        if name not in self._arrays:  # No sample loaded
+            return np.empty((0,))
+        if not self.preallocate:
+            return np.array(self._arrays[name])
+        return self._arrays[name][:self.count]
+
+
+def print_memory_report(samples, modes=DTYPE_MODES):
+    """
+    Prints the bytes per sample of every storage mode, and the total for the loaded samples.
+
+    Args:
+        samples (SampleArrays): Loaded training inputs, at least one sample.
+        modes (dict): Mode name -> dtypes as accepted by SampleArrays.bytes_per_sample.
+    """
+    if not len(samples):
+        return
+
+    print(f"Memory per sample ({len(samples)} samples):")
+    for mode, dtypes in [('stored', None), *modes.items()]:
+        sizes = samples.bytes_per_sample(dtypes)
+        per_input = ", ".join(f"{name} {size / 1024:.1f} KiB" for name, size in sizes.items())
+        print(f"  {mode}: {sum(sizes.values()) / 1024 ** 2:.2f} MiB/sample, "
+              f"{sum(sizes.values()) * len(samples) / 1024 ** 3:.2f} GiB total ({per_input})")
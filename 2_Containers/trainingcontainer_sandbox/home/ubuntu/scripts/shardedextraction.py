@@ -0,0 +1,150 @@
+import os
+import glob
+import shutil
+import zlib
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+from featurestore import FeatureStore, merge_feature_stores
+from incrementalbuild import merge_checksums
+
+
+def extraction_shard(environ=None):
+    """
+    Shard of the documents this process extracts, from its environment.
+
+    SLURM array tasks (sbatch --array=0-<N-1>, see SubmitExtraction.sh) use SLURM_ARRAY_TASK_ID
+    and SLURM_ARRAY_TASK_COUNT; local processes set EXTRACT_SHARD and EXTRACT_SHARDS, which take
+    precedence. Every task must also get the same EXTRACT_BEFORE, a Unix time in seconds: only
+    documents inserted before it are extracted, so all tasks partition the same set of documents
+    even while the ingest keeps inserting.
+
+    Args:
+        environ (dict): Environment variables, os.environ by default.
+
+    Returns:
+        tuple: (shard, shards, before ObjectId), or None for a regular, unsharded job.
+    """
+    environ = os.environ if environ is None else environ
+    if "EXTRACT_SHARDS" in environ:
+        shard, shards = int(environ.get("EXTRACT_SHARD", 0)), int(environ["EXTRACT_SHARDS"])
+    elif "SLURM_ARRAY_TASK_COUNT" in environ:
+        shard = int(environ["SLURM_ARRAY_TASK_ID"]) - int(environ.get("SLURM_ARRAY_TASK_MIN", 0))
+        shards = int(environ["SLURM_ARRAY_TASK_COUNT"])
+    else:
+        return None
+
+    if not 0 <= shard < shards:
+        raise ValueError(f"Extraction shard {shard} out of range for {shards} shards")
+    if "EXTRACT_BEFORE" not in environ:
+        raise ValueError("Sharded extraction needs EXTRACT_BEFORE, the same Unix time for every task "
+                         "(e.g. EXTRACT_BEFORE=$(date +%s))")
+    before = ObjectId.from_datetime(datetime.fromtimestamp(int(environ["EXTRACT_BEFORE"]), timezone.utc))
+    return shard, shards, before
+
+
+def shard_of(document_id, shards):
+    """Shard of a document: CRC-32 of its _id modulo shards, the same in every process and run."""
+    return zlib.crc32(str(document_id).encode("utf-8")) % shards
+
+
+def shard_criteria(collection, criteria, shard, shards, before):
+    """
+    criteria restricted to the documents of one shard, inserted before the cutoff.
+
+    The matching _ids are listed with find(criteria, {"_id": 1}), covered by the eligibility index,
+    and filtered by shard_of, so the N shards are disjoint and together cover every matching
+    document, whatever the order the server returns them in.
+
+    Args:
+        collection (Collection): Collection to query.
+        criteria (dict): Query filter of the whole extraction.
+        shard (int): Shard of this task, 0 to shards - 1.
+        shards (int): Number of tasks.
+        before (ObjectId): Only documents with a smaller _id, see extraction_shard.
+
+    Returns:
+        dict: Filter selecting the documents of the shard by _id.
+    """
+    criteria = {"$and": [criteria, {"_id": {"$lt": before}}]}
+    ids = [document["_id"] for document in collection.find(criteria, {"_id": 1})
+           if shard_of(document["_id"], shards) == shard]
+    return {"_id": {"$in": ids}}
+
+
+def part_path(path, shard, shards):
+    """Directory of the part of the feature store at path written by one extraction task."""
+    return os.path.join(f"{path}.parts", f"part-{shard:05d}-of-{shards:05d}")
+
+
+def part_complete(path, fingerprint, base_watermark, before):
+    """True if the part at path was completed by a task of the same extraction, e.g. before a requeue."""
+    if not FeatureStore.exists(path):
+        return False
+    metadata = FeatureStore(path).metadata
+    return (metadata.get('fingerprint') == fingerprint and metadata.get('before') == str(before)
+            and metadata.get('base_watermark') == (str(base_watermark) if base_watermark else None))
+
+
+def merge_parts(path, fingerprint, watermark):
+    """
+    Merges the parts written by a sharded extraction into the feature store at path.
+
+    Parts are merged once all of them are complete and were extracted with the given fingerprint
+    from the store as it is now (the same watermark); the merge only renames their shard files, see
+    merge_feature_stores. The merged store's watermark is the extraction cutoff: every matching
+    document inserted before it is in one of the parts. Parts of another query, preprocessing or
+    store state are stale and removed. Parts still being written (no manifest yet) are left alone.
+
+    Args:
+        path (str): Feature store directory.
+        fingerprint (str): dataset_fingerprint of the current query and preprocessing.
+        watermark (ObjectId): Watermark of the store at path, None if there is none.
+
+    Returns:
+        FeatureStore: The merged store, or None if there was nothing to merge.
+
+    Raises:
+        RuntimeError: If some tasks of the extraction have not written their part.
+    """
+    part_paths = sorted(glob.glob(os.path.join(f"{path}.parts", "part-*")))
+    parts = [FeatureStore(part) for part in part_paths if FeatureStore.exists(part)]
+    if not parts:
+        return None
+
+    base = str(watermark) if watermark else None
+    current = [part for part in parts if part.metadata.get('fingerprint') == fingerprint
+               and part.metadata.get('base_watermark') == base]
+    for part in parts:
+        if part not in current:
+            print(f"Removing stale extraction part {part.path}")
+            shutil.rmtree(part.path)
+    if not current:
+        return None
+
+    runs = {(part.metadata['shards'], part.metadata['before']) for part in current}
+    if len(runs) > 1:
+        raise RuntimeError(f"Parts of several extractions in {path}.parts: {sorted(runs)}")
+    shards, before = runs.pop()
+    missing = sorted(set(range(shards)) - {part.metadata['shard'] for part in current})
+    if missing:
+        raise RuntimeError(f"Extraction parts {missing} of {shards} are missing in {path}.parts, "
+                           f"rerun those tasks with EXTRACT_BEFORE of the same run")
+
+    current.sort(key=lambda part: part.metadata['shard'])
+    metadata = {key: value for key, value in current[0].metadata.items()
+                if key not in ('shard', 'shards', 'before', 'base_watermark', 'watermark', 'documents')}
+    metadata['watermark'] = before
+    # The merged store holds the documents of the store as it is now and of every part
+    checksums = [part.metadata.get('documents') for part in current]
+    if FeatureStore.exists(path):
+        checksums.append(FeatureStore(path).metadata.get('documents'))
+    metadata['documents'] = merge_checksums(checksums)
+    store = merge_feature_stores([part.path for part in current], path, metadata)
+    try:
+        os.rmdir(f"{path}.parts")  # Unless another extraction is writing its parts
+    except OSError:
+        pass
+    print(f"Merged {shards} extraction parts into {path}: {len(store)} samples")
+    return store
@@ -0,0 +1,36 @@
+import numpy as np
+import tensorflow as tf
+
+from gridfsfetch import fetch_ordered
+
+
+def stream_dataset(items, load, output_signature, executor, max_in_flight=16):
+    """
+    tf.data source that loads samples lazily from an iterator, e.g. a MongoDB cursor.
+
+    Built on tf.data.Dataset.from_generator: every pass over the dataset calls items() for a fresh
+    iterator and runs load on the thread pool for the next max_in_flight items only, so memory
+    stays bounded by the items in flight plus the tf.data buffers, whatever the number of items.
+
+    Args:
+        items (callable): Returns the iterable of items of one pass, e.g. lambda: collection.find(criteria).
+        load (callable): Function of one item returning a list of samples, each matching
+            output_signature, e.g. one (inputs, target) pair per RGB/NIR pair of a document. If
+            it raises, the error is printed and the item is skipped.
+        output_signature: Nested tf.TensorSpec of one sample; samples are cast to its dtypes.
+        executor (ThreadPoolExecutor): Pool from gridfsfetch.fetch_pool running load.
+        max_in_flight (int): Maximum number of items loaded ahead of the consumer.
+
+    Returns:
+        tf.data.Dataset: Unbatched samples, in the order of items.
+    """
+    def generate():
+        for samples in fetch_ordered(load, items(), executor, max_in_flight):
+            if isinstance(samples, Exception):
+                print(f"Skipping streamed item: {samples}")
+                continue
+            for sample in samples:
+                yield tf.nest.map_structure(lambda value, spec: np.asarray(value, spec.dtype.as_numpy_dtype),
+                                            sample, output_signature)
+
+    return tf.data.Dataset.from_generator(generate, output_signature=output_signature)
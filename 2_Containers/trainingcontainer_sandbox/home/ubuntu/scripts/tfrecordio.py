@@ -0,0 +1,129 @@
+import os
+import glob
+import json
+import shutil
+
+import numpy as np
+import tensorflow as tf
+
+SPEC = "spec.json"
+
+
+def write_tfrecords(path, batches, shard_size=1024, compression=None):
+    """
+    Writes batches of model inputs and targets to sharded TFRecord files.
+
+    Every sample becomes one tf.train.Example holding each array as raw bytes; the per-sample shape
+    and dtype of every feature go to <path>/spec.json, so the reader decodes them with
+    tf.io.decode_raw and no per-value protobuf lists. Shards are named part-00000.tfrecord and
+    hold shard_size examples. The files are written under <path>.partial and renamed to path once
+    complete, like the feature store.
+
+    Args:
+        path (str): Output directory, which must not exist yet.
+        batches (iterable): Dicts of feature name -> array of shape (batch_size, ...), e.g. the
+            model inputs plus the 'yield' target.
+        shard_size (int): Examples per file.
+        compression (str): None, "GZIP" or "ZLIB".
+
+    Returns:
+        int: Number of examples written.
+    """
+    if os.path.exists(path):
+        raise FileExistsError(f"TFRecord directory {path} already exists")
+
+    partial_path = f"{path}.partial"
+    shutil.rmtree(partial_path, ignore_errors=True)  # Leftover of a job that died while exporting
+    os.makedirs(partial_path)
+
+    options = tf.io.TFRecordOptions(compression_type=compression or "")
+    features, count, writer = {}, 0, None
+    try:
+        for batch in batches:
+            if not features:
+                features = {name: {'shape': list(np.shape(array)[1:]), 'dtype': np.asarray(array).dtype.str}
+                            for name, array in batch.items()}
+
+            arrays = {name: np.ascontiguousarray(array, dtype=features[name]['dtype'])
+                      for name, array in batch.items()}
+            for row in range(len(next(iter(arrays.values())))):
+                if count % shard_size == 0:
+                    if writer is not None:
+                        writer.close()
+                    shard_path = os.path.join(partial_path, f"part-{count // shard_size:05d}.tfrecord")
+                    writer = tf.io.TFRecordWriter(shard_path, options)
+
+                example = tf.train.Example(features=tf.train.Features(feature={
+                    name: tf.train.Feature(bytes_list=tf.train.BytesList(value=[array[row].tobytes()]))
+                    for name, array in arrays.items()
+                }))
+                writer.write(example.SerializeToString())
+                count += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+    with open(os.path.join(partial_path, SPEC), "w") as f:
+        json.dump({'examples': count, 'shard_size': shard_size, 'compression': compression,
+                   'features': features}, f, indent=2)
+
+    os.rename(partial_path, path)
+    return count
+
+
+def tfrecord_dataset(path, target_names, batch_size, shuffle_buffer=0, cycle_length=4, seed=None):
+    """
+    tf.data pipeline over a directory written by write_tfrecords.
+
+    Shard files are read in parallel with interleave, examples are shuffled in a buffer of
+    shuffle_buffer examples, batched, decoded in parallel with map and prefetched, so reading and
+    decoding overlap with the training steps.
+
+    Args:
+        path (str): Directory written by write_tfrecords.
+        target_names (list): Features returned as targets, all the others are model inputs.
+        batch_size (int): Examples per batch.
+        shuffle_buffer (int): Shuffle buffer size in examples; 0 keeps the file order (for
+            validation, test and predict).
+        cycle_length (int): Number of shard files read concurrently.
+        seed (int): Seed of the file and example shuffling.
+
+    Returns:
+        tf.data.Dataset: (inputs, targets) batches, inputs as a dict of model input name -> tensor
+        and targets as one tensor, or a dict when there are several target_names.
+    """
+    with open(os.path.join(path, SPEC)) as f:
+        spec = json.load(f)
+
+    files = sorted(glob.glob(os.path.join(path, "part-*.tfrecord")))
+    shuffle = shuffle_buffer > 0
+
+    dataset = tf.data.Dataset.from_tensor_slices(files)
+    if shuffle:
+        dataset = dataset.shuffle(len(files), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.interleave(
+        lambda file: tf.data.TFRecordDataset(file, compression_type=spec['compression'] or ""),
+        cycle_length=cycle_length,
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=not shuffle,  # Keep the file order for evaluation
+    )
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    feature_spec = {name: tf.io.FixedLenFeature([], tf.string) for name in spec['features']}
+
+    def decode(serialized):
+        # Parsing whole batches is vectorized, unlike one parse_single_example per example
+        parsed = tf.io.parse_example(serialized, feature_spec)
+        arrays = {
+            name: tf.reshape(tf.io.decode_raw(parsed[name], tf.as_dtype(np.dtype(feature['dtype']))),
+                             [-1] + feature['shape'])
+            for name, feature in spec['features'].items()
+        }
+        targets = {name: arrays.pop(name) for name in target_names}
+        return arrays, targets[target_names[0]] if len(target_names) == 1 else targets
+
+    return (dataset
+            .batch(batch_size)
+            .map(decode, num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE))
@@ -1,4 +1,5 @@
 import os
+import sys
 os.environ["TF_FORCE_GPU_ALLOW_GROWTH"] = "true"
 
 import pymongo
@@ -13,9 +14,29 @@ import gc
 import psutil
 import random
 import threading
+import zlib
+import shutil
 
 import numpy as np
-from sklearn.decomposition import PCA
+from lidarprojection import ALIGNMENT, projection_pool, project_lidar_batch, check_downsampled_channels
+# Projection workers are forked now, before TensorFlow, CUDA, pymongo or any thread pool start
+# (see projection_pool), and reused for every LiDAR block of the run
+LIDAR_WORKERS = os.cpu_count()
+lidar_pool = projection_pool(LIDAR_WORKERS)
+from projectioncache import ProjectionCache
+from blobcache import BlobCache
+from localblobcache import LocalBlobCache
+from gridfsfetch import fetch_pool, fetch_ordered, read_arrays, batched, iter_batched, capture
+from imagepyramid import PYRAMID_METHOD, pyramid_ids
+from eligibility import eligibility_query
+from documentselection import loader_projection, selection_counts, document_batches
+from samplearrays import SampleArrays, IMAGE_DTYPES, COMPACT_DTYPES, peak_rss_bytes, print_memory_report
+from featurestore import FeatureStore, FeatureStoreWriter
+from channelstats import NORMALIZED_INPUTS, channel_stats, load_normalization, save_normalization
+from incrementalbuild import dataset_fingerprint, document_checksum, merge_checksums, store_watermark, after_watermark
+from shardedextraction import extraction_shard, shard_criteria, part_path, part_complete, merge_parts
+from tfrecordio import write_tfrecords, tfrecord_dataset
+from streamdataset import stream_dataset
 from sklearn.model_selection import train_test_split
 from tensorflow.keras import layers, regularizers, models, Model, Input
 import cv2
@@ -199,105 +220,148 @@ print("Ping to MongoDB server successful.")
 # %% Extract data from documents
 img_rows, img_cols = int(2048 / 4), int(2448 / 4)
 
-# Projection function
-def projection3x(lidar_raw):
-    # Check if the lidar data has enough points (at least 2 samples and features)
-    if lidar_raw.shape[0] < 2 or lidar_raw.shape[1] < 2:
-        raise ValueError(
-            f"Insufficient lidar data: {lidar_raw.shape[0]} samples and {lidar_raw.shape[1]} features. PCA cannot be applied.")
-
-    # Separate the data into x, y, z
-    x, y, z = lidar_raw[:, 0], lidar_raw[:, 1], lidar_raw[:, 2]
-
-    # Scale coordinates to centimeters
-    x = x * 100
-    y = y * 100
-    z = z * 100
-
-    # Set minimum of each axis to 0 cm
-    x -= np.min(x)
-    y -= np.min(y)
-    z -= np.min(z)
-
-    # PCA for dominant direction in X-Y plane (optional for rotation)
-    points = np.vstack((x, y)).T
-    pca = PCA(n_components=2)
-    pca.fit(points)
-    angle = np.arctan2(pca.components_[0, 1], pca.components_[0, 0])
-
-    # Rotate points to align with grid axes
-    rotation_matrix = np.array([
-        [np.cos(-angle), -np.sin(-angle)],
-        [np.sin(-angle), np.cos(-angle)]
-    ])
-    rotated_points = points @ rotation_matrix.T
-    rotated_x, rotated_y = rotated_points[:, 0], rotated_points[:, 1]
-
-    # Flip the x and y coordinates for X-Z and Y-Z projections if needed
-    rotated_x = np.max(rotated_x) - rotated_x  # Flip x-axis for X-Z plane
-    rotated_y = np.max(rotated_y) - rotated_y  # Flip y-axis for Y-Z plane
-
-    # Define resolution for each plane
-    xy_resolution = 1  # Adjusted to 1 cm for X-Y plane
-    xz_resolution = 1  # Adjusted to 1 cm for X-Z plane
-    yz_resolution = 1  # Adjusted to 1 cm for Y-Z plane
-
-    # Define boundaries for each plane
-    x_min, x_max = np.min(rotated_x), np.max(rotated_x)
-    y_min, y_max = np.min(rotated_y), np.max(rotated_y)
-    z_min, z_max = np.min(z), np.max(z)
-
-    # Calculate grid sizes
-    grid_x_size_xy = int((x_max - x_min) / xy_resolution) + 1
-    grid_y_size_xy = int((y_max - y_min) / xy_resolution) + 1
-    grid_x_size_xz = int((x_max - x_min) / xz_resolution) + 1
-    grid_z_size_xz = int((z_max - z_min) / xz_resolution) + 1
-    grid_y_size_yz = int((y_max - y_min) / yz_resolution) + 1
-    grid_z_size_yz = int((z_max - z_min) / yz_resolution) + 1
-
-    # Initialize grids with NaNs
-    grid_xy = np.full((grid_y_size_xy, grid_x_size_xy), np.nan, dtype=np.float32)
-    grid_xz = np.full((grid_z_size_xz, grid_x_size_xz), np.nan, dtype=np.float32)
-    grid_yz = np.full((grid_z_size_yz, grid_y_size_yz), np.nan, dtype=np.float32)
-
-    # Project Z onto X-Y plane using maximum aggregation
-    for i in range(len(rotated_x)):
-        grid_x = int((rotated_x[i] - x_min) / xy_resolution)
-        grid_y = int((rotated_y[i] - y_min) / xy_resolution)
-        if np.isnan(grid_xy[grid_y, grid_x]):
-            grid_xy[grid_y, grid_x] = z[i]
-        else:
-            grid_xy[grid_y, grid_x] = max(grid_xy[grid_y, grid_x], z[i])
-
-    # Project Z onto X-Z plane using maximum aggregation
-    for i in range(len(rotated_x)):
-        grid_x = int((rotated_x[i] - x_min) / xz_resolution)
-        grid_z = int((z[i] - z_min) / xz_resolution)
-        if np.isnan(grid_xz[grid_z, grid_x]):
-            grid_xz[grid_z, grid_x] = z[i]  # Use z[i] for the X-Z projection
-        else:
-            grid_xz[grid_z, grid_x] = max(grid_xz[grid_z, grid_x], z[i])
-
-    # Project Z onto Y-Z plane using maximum aggregation
-    for i in range(len(rotated_y)):
-        grid_y = int((rotated_y[i] - y_min) / yz_resolution)
-        grid_z = int((z[i] - z_min) / yz_resolution)
-        if np.isnan(grid_yz[grid_z, grid_y]):
-            grid_yz[grid_z, grid_y] = z[i]  # Use z[i] for the Y-Z projection
-        else:
-            grid_yz[grid_z, grid_y] = max(grid_yz[grid_z, grid_y], z[i])
-
-    # Replace NaNs with zero
-    grid_xy = np.nan_to_num(grid_xy, nan=0.0)
-    grid_xz = np.nan_to_num(grid_xz, nan=0.0)
-    grid_yz = np.nan_to_num(grid_yz, nan=0.0)
+# Parallel LiDAR projection: documents are projected in blocks across all vCPUs (LIDAR_WORKERS,
+# forked at the top of the script)
+LIDAR_BLOCK_SIZE = 64  # Documents per parallel projection batch, also the cursor batch size
+
+# Only the fields the loaders read are sent by the server
+DOCUMENT_PROJECTION = loader_projection(("yield",))
+
+# Concurrent GridFS reads: RGB, NIR and weather of upcoming samples are fetched on a thread pool
+FETCH_WORKERS = 32
+FETCH_IN_FLIGHT = 128  # Samples read ahead of the loop, bounds the memory held by pending reads
+FETCH_BATCH_SIZE = 8  # RGB/NIR pairs (or LiDAR clouds) per bulk read of fs.files and fs.chunks
+
+# Samples are written into arrays preallocated from the number of matched pairs, images as uint8;
+# False collects lists and converts them with np.array (briefly two copies of every input)
+PREALLOCATE_SAMPLES = True
+# Compact storage also keeps LiDAR and weather as float16 and dates/labels as float32, all scaling
+# is done by the model; False keeps them in the dtype they are loaded with
+COMPACT_STORAGE = True
+SAMPLE_DTYPES = COMPACT_DTYPES if COMPACT_STORAGE else IMAGE_DTYPES
+
+# The first job writes the preprocessed samples to a memory-mapped feature store; later jobs train
+# straight from its shards, without loading the dataset into RAM. None keeps the samples in memory.
+FEATURE_STORE_PATH = "/mnt/phenocart-work/prr000/FeatureStore/yield_2024"
+FEATURE_STORE_SHARD_SIZE = 1024  # Samples per .npy shard, about 1.3 GiB of images
+# Later jobs append the documents inserted since the store was built (_id above its watermark). The
+# store records a hash of the query and the preprocessing parameters below and is rebuilt when they
+# change; bump PREPROCESSING_VERSION after changing the preprocessing code itself. It also records a
+# checksum of the documents it holds, and is rebuilt when the documents matching the query at or
+# below the watermark differ from them: documents that became eligible later (a label or LiDAR
+# added, eligibility fields recomputed) or were inserted with an older _id are not missed. False
+# trains from the existing store as is.
+FEATURE_STORE_INCREMENTAL = True
+PREPROCESSING_VERSION = 3  # 2: float64 LiDAR alignment (ALIGNMENT), 3: INTER_AREA images (PYRAMID_METHOD)
+# Sharded extraction: N SLURM array tasks (SubmitExtraction.sh) or N local processes
+# (EXTRACT_SHARD=i EXTRACT_SHARDS=N EXTRACT_BEFORE=<unix time>) each load a hash partition of the
+# documents into their own part of the feature store, <FEATURE_STORE_PATH>.parts/, and exit without
+# training or stopping mongod. The next regular job merges the parts (a rename per shard) and trains.
+EXTRACTION_SHARD = extraction_shard()  # (shard, shards, before) from the environment, None otherwise
+BATCH_WORKERS = 4  # Threads gathering training batches ahead of the model
+
+# Optional export of the train/validation/test splits to sharded TFRecord files, trained from with
+# a tf.data pipeline (parallel interleave, shuffle buffer, prefetch) instead of the in-memory chunks.
+# The splits and their normalization statistics are saved with the export (NORMALIZATION_FILE) and
+# reused while the feature store keeps its version and size; otherwise the export is replaced.
+# None disables it.
+TFRECORD_PATH = None  # e.g. "/mnt/phenocart-work/prr000/TFRecords/yield_2024"
+TFRECORD_COMPRESSION = None  # or "GZIP" / "ZLIB", smaller files for more CPU per batch
+TFRECORD_SHUFFLE_BUFFER = 2048  # Examples, about 2.6 GiB of decoded images
+
+# LiDAR, weather and the dates are normalized per channel by Normalization layers holding the mean
+# and variance of the training split, the exported train split with TFRecords (chunked pass on
+# STATS_WORKERS threads, see channelstats.py). With a feature store the test split and the
+# statistics are saved in the store directory (the TFRecord directory when exporting) and reused by
+# later jobs until the store changes. Images keep their fixed 1/255 rescaling.
+NORMALIZATION_FILE = "normalization.json"
+STATS_WORKERS = 8
+
+# Exploratory runs: nothing is loaded or materialized, every epoch streams the samples from the
+# MongoDB cursor through tf.data, with documents split by a hash of their _id. Memory stays bounded
+# by the documents in flight and the shuffle buffer. Takes precedence over the store and TFRecords.
+STREAM_FROM_MONGODB = False
+STREAM_WORKERS = 8  # Threads loading documents (GridFS reads, image resizing, LiDAR projection)
+STREAM_IN_FLIGHT = 16  # Documents loaded ahead of training
+STREAM_SHUFFLE_BUFFER = 256  # Samples
+
+# Projections never change for a given lidar_id, so they are cached on disk across runs
+PROJECTION_CACHE_PATH = "/mnt/phenocart-work/prr000/ProjectionCache"
+PROJECTION_CACHE_BYTES = 10 * 1024 ** 3  # 10 GiB, roughly 28k projections
+BLOB_CACHE_BYTES = 2 * 1024 ** 3  # In-memory budget for decoded weather blobs shared across documents
+# Encoded GridFS blobs are also kept in a node-local directory (tmpfs or NVMe), so later jobs on the
+# node, e.g. the runs of a batch-size sweep, read them locally instead of from the dbPath on /fs.
+# None disables it.
+LOCAL_BLOB_CACHE_PATH = "/localscratch/prr000/BlobCache"  # Node-local /tmp, bound by SubmitJob.sh
+LOCAL_BLOB_CACHE_BYTES = 100 * 1024 ** 3  # 100 GiB, evicted least recently used first
+# LiDAR input channels as '<plane>:<stat>', e.g. add "xy:mean", "xy:density" or "xz:count"
+# (every channel is standardized with its own training-split mean and variance; streamed runs keep
+# the lidar branch's fixed 1/150 rescaling)
+LIDAR_CHANNELS = ["xy:max", "xz:max", "yz:max"]
+PROJECTION_KWARGS = {"resolution": 1, "output_size": (300, 100), "mode": "resize",  # "direct" skips full-res grids
+                     "channels": LIDAR_CHANNELS}
+
+# Shared by every GridFS read of the job, consulted before MongoDB
+local_blob_cache = LocalBlobCache(LOCAL_BLOB_CACHE_PATH, LOCAL_BLOB_CACHE_BYTES) if LOCAL_BLOB_CACHE_PATH else None
+
+
+def project_documents_lidar(documents, executor, fetch_executor, cache):
+    """
+    Fetches the LiDAR point cloud of each document and projects them in parallel.
 
-    # Optionally resize grids for display purposes
-    resized_grid_xy = cv2.resize(grid_xy, (300, 100), interpolation=cv2.INTER_NEAREST)
-    resized_grid_xz = cv2.resize(grid_xz, (300, 100), interpolation=cv2.INTER_NEAREST)
-    resized_grid_yz = cv2.resize(grid_yz, (300, 100), interpolation=cv2.INTER_NEAREST)
+    Args:
+        documents (list): MongoDB documents with a 'lidar_id'.
+        executor: Process pool created with projection_pool.
+        fetch_executor: Thread pool created with fetch_pool, for the concurrent GridFS reads.
+        cache (ProjectionCache): Projections already computed by earlier runs.
 
-    return np.dstack((resized_grid_xy, resized_grid_xz, resized_grid_yz))
+    Returns:
+        dict: lidar_id -> (100, 300, len(LIDAR_CHANNELS)) projection, or the exception raised while projecting it.
+    """
+    projections, pending_documents = {}, {}
+    for document in documents:
+        if document.get('lidar_id') in projections or document.get('lidar_id') in pending_documents:
+            continue
+
+        # Skip the GridFS read and the projection entirely on a cache hit
+        cached_projection = cache.get(document.get('lidar_id'))
+        if cached_projection is not None:
+            projections[document['lidar_id']] = cached_projection
+            continue
+
+        pending_documents[document.get('lidar_id')] = document
+
+    def read_lidar_batch(batch):
+        metadata = {}
+        clouds = capture(read_arrays, db, [document.get('lidar_id') for document in batch], metadata,
+                         cache=local_blob_cache)
+        if isinstance(clouds, Exception):  # A failed bulk read fails every cloud of the batch
+            return [(clouds, {})] * len(batch)
+        return [(clouds[document.get('lidar_id')], metadata.get(document.get('lidar_id')) or {}) for document in batch]
+
+    lidar_ids, lidar_clouds, lidar_angles = [], [], []
+    batches = fetch_ordered(read_lidar_batch, batched(pending_documents.values(), FETCH_BATCH_SIZE), fetch_executor)
+    for document, (lidar, lidar_metadata) in zip(pending_documents.values(), (read for batch in batches for read in batch)):
+        if lidar_metadata.get('voxel_size') is not None and not isinstance(lidar, Exception):
+            # Clouds voxel-downsampled at ingest only serve max channels at a multiple of the voxel
+            # size (an error is reported instead), and are projected with the angle of the full cloud
+            lidar = capture(check_downsampled_channels, lidar_metadata['voxel_size'],
+                            PROJECTION_KWARGS['channels'], PROJECTION_KWARGS['resolution']) or lidar
+        if isinstance(lidar, Exception):
+            print(f"Error reading lidar data for document {document.get('id', 'Unknown')}: {lidar}")
+            continue
+        lidar_ids.append(document['lidar_id'])
+        lidar_clouds.append(lidar)
+        lidar_angles.append(lidar_metadata.get('angle'))
+
+    new_projections = project_lidar_batch(lidar_clouds, executor=executor, return_exceptions=True,
+                                          angles=lidar_angles, **PROJECTION_KWARGS)
+    for lidar_id, projection in zip(lidar_ids, new_projections):
+        if not isinstance(projection, Exception):
+            cache.put(lidar_id, projection)
+        projections[lidar_id] = projection
+
+    return projections
 
 
 def image_processing(image_raw, target_size=(img_rows, img_cols), is_nir=False):
@@ -313,20 +377,53 @@ def image_processing(image_raw, target_size=(img_rows, img_cols), is_nir=False):
         Processed image resized to (img_rows, img_cols, channels),
         where channels = 3 for RGB, 1 for grayscale NIR.
     """
+    # Area averaging, like the stored pyramid levels: the 1/4 level and the full image give the same pixels
     # Convert to grayscale if NIR image
     if is_nir:
-        image_resized = cv2.resize(image_raw, (target_size[1], target_size[0]), interpolation=cv2.INTER_LINEAR)
+        image_resized = cv2.resize(image_raw, (target_size[1], target_size[0]), interpolation=cv2.INTER_AREA)
         if len(image_resized.shape) == 2:  # Ensure it remains grayscale (1 channel)
             image_resized = np.expand_dims(image_resized, axis=-1)  # Shape (H, W, 1)
     else:
         # Convert RGB image to 3 channels if necessary
-        image_resized = cv2.resize(image_raw, (target_size[1], target_size[0]), interpolation=cv2.INTER_LINEAR)
+        image_resized = cv2.resize(image_raw, (target_size[1], target_size[0]), interpolation=cv2.INTER_AREA)
         if len(image_resized.shape) == 2:  # Convert grayscale to RGB if needed
             image_resized = cv2.cvtColor(image_resized, cv2.COLOR_GRAY2RGB)
 
     return image_resized
 
 
+def fetch_batch_inputs(pairs, cache):
+    """
+    Reads and processes the GridFS inputs of a batch of RGB/NIR pairs, run on the fetch pool.
+
+    All images of the batch come from one read_arrays call and the weather blobs from one
+    BlobCache.get_many call, instead of one fs.get round trip per blob.
+
+    Args:
+        pairs (list): (document, rgb_id, nir_id) of every pair.
+        cache (BlobCache): Weather blobs shared across pairs and documents.
+
+    Returns:
+        list: Per pair, a dict of 'rgb', 'nir' and 'weather' inputs, each the array or the
+        exception raised while reading it.
+    """
+    images = capture(read_arrays, db, [image_id for _, rgb_id, nir_id in pairs for image_id in (rgb_id, nir_id)],
+                     cache=local_blob_cache)
+    weather = capture(cache.get_many, [document.get('weather_id') for document, _, _ in pairs])
+
+    def lookup(arrays, file_id):
+        array = arrays if isinstance(arrays, Exception) else arrays[file_id]  # A failed bulk read fails all
+        if isinstance(array, Exception):
+            raise array
+        return array
+
+    return [{
+        'rgb': capture(lambda: image_processing(lookup(images, rgb_id), is_nir=False)),
+        'nir': capture(lambda: image_processing(lookup(images, nir_id), is_nir=True)),
+        'weather': capture(lookup, weather, document.get('weather_id')),
+    } for document, rgb_id, nir_id in pairs]
+
+
 def get_julian_day(date_str):
     """
     Convert a date in YYMMDD format to Julian Day (DDD).
@@ -344,6 +441,144 @@ def get_julian_day(date_str):
     julian_day = date.timetuple().tm_yday  # Day of the year
     return julian_day
 
+
+def model_inputs(batch):
+    """
+    Maps a batch of samples, as returned by SampleArrays.take or FeatureStore.take, to the model inputs.
+
+    Returns:
+        dict: Model input name -> array, weather rearranged to (batch_size, height, width, channels).
+    """
+    return {
+        "rgb_image": batch['rgb'],
+        "nir_image": batch['nir'],
+        "lidar_data": batch['lidar'],
+        "seeding_date": batch['seedingdate'].reshape(-1, 1),
+        "image_date": batch['imagedate'].reshape(-1, 1),
+        "weather_data": batch['weather'].transpose(0, 2, 3, 1),
+    }
+
+
+class SampleBatches(tf.keras.utils.PyDataset):
+    """
+    Batches of model inputs and yield targets gathered from SampleArrays or a FeatureStore.
+
+    Only the indices of a split are kept, so shuffling and train/validation/test splits never copy
+    the dataset; each batch is read (from the memory-mapped shards for a store) when Keras asks
+    for it, on BATCH_WORKERS threads.
+    """
+
+    def __init__(self, samples, indices, batch_size, shuffle=False, **kwargs):
+        """
+        Args:
+            samples: SampleArrays or FeatureStore holding the samples.
+            indices (array-like): Samples of this split.
+            batch_size (int): Samples per batch.
+            shuffle (bool): Reshuffle the indices after every epoch.
+        """
+        super().__init__(workers=BATCH_WORKERS, **kwargs)
+        self.samples = samples
+        self.indices = np.asarray(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return -(-len(self.indices) // self.batch_size)
+
+    def __getitem__(self, index):
+        batch = self.samples.take(self.indices[index * self.batch_size:(index + 1) * self.batch_size])
+        return model_inputs(batch), batch['yield'].reshape(-1, 1)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
+
+def has_nonfinite(samples, name, block_size=1024):
+    """True if an input holds NaN or Inf, checked block by block so a feature store is never fully in RAM."""
+    return any(
+        not np.isfinite(samples.take(np.arange(start, min(start + block_size, len(samples))), [name])[name]).all()
+        for start in range(0, len(samples), block_size)
+    )
+
+
+# One streamed sample: the model inputs and the yield target
+STREAM_SIGNATURE = (
+    {
+        "rgb_image": tf.TensorSpec((img_rows, img_cols, 3), tf.uint8),
+        "nir_image": tf.TensorSpec((img_rows, img_cols, 1), tf.uint8),
+        "lidar_data": tf.TensorSpec((100, 300, len(LIDAR_CHANNELS)), tf.float32),
+        "seeding_date": tf.TensorSpec((1,), tf.float32),
+        "image_date": tf.TensorSpec((1,), tf.float32),
+        "weather_data": tf.TensorSpec((8, 8, 146), tf.float32),
+    },
+    tf.TensorSpec((1,), tf.float32),
+)
+
+
+def stream_split(document):
+    """'train', 'val' or 'test' from a stable hash of the document _id: 20% test, 16% validation."""
+    bucket = zlib.crc32(str(document['_id']).encode("utf-8")) % 25
+    return "test" if bucket < 5 else "val" if bucket < 9 else "train"
+
+
+def load_stream_document(document):
+    """
+    Loads the samples of one document for mongodb_dataset, run on the stream pool.
+
+    Returns:
+        list: (model inputs, yield target) per RGB/NIR pair. Pairs with an input that could not
+        be read are reported and skipped; a failed LiDAR projection or date raises.
+    """
+    lidar_id = document.get('lidar_id')
+    lidar_data = project_documents_lidar([document], lidar_pool, fetch_executor, projection_cache).get(lidar_id)
+    if lidar_data is None or isinstance(lidar_data, Exception):
+        raise ValueError(f"No LiDAR projection for document {document.get('id', 'Unknown')}: {lidar_data}")
+
+    seedingdate_data = get_julian_day(document['seedingdate'])
+    imagedate_data = get_julian_day(document['date'])
+    yield_data = document['yield'] / 1000
+
+    pairs = [(document, rgb_id, nir_id)
+             for rgb_id, nir_id in zip(pyramid_ids(document, 'rgbimage', (img_rows, img_cols)),
+                                       pyramid_ids(document, 'nirimage', (img_rows, img_cols)))]
+    samples = []
+    for (_, rgb_id, _), inputs in zip(pairs, fetch_batch_inputs(pairs, blob_cache)):
+        errors = [value for value in inputs.values() if isinstance(value, Exception)]
+        if errors:
+            print(f"Error reading the inputs of rgb_id {rgb_id}: {errors[0]}")
+            continue
+
+        batch = model_inputs({
+            'rgb': inputs['rgb'][None], 'nir': inputs['nir'][None], 'weather': inputs['weather'][None],
+            'lidar': lidar_data[None], 'seedingdate': np.array([seedingdate_data]),
+            'imagedate': np.array([imagedate_data]),
+        })
+        samples.append(({name: array[0] for name, array in batch.items()}, np.array([yield_data])))
+    return samples
+
+
+def mongodb_dataset(split, batch_size, shuffle_buffer=0):
+    """
+    Batches of the documents matching criteria that fall into split, streamed from the cursor.
+
+    Args:
+        split (str): 'train', 'val' or 'test', see stream_split.
+        batch_size (int): Samples per batch.
+        shuffle_buffer (int): Shuffle buffer size in samples; 0 keeps the cursor order.
+
+    Returns:
+        tf.data.Dataset: (inputs, target) batches for model.fit / model.predict.
+    """
+    def documents():
+        return (document for batch in document_batches(collection, criteria, DOCUMENT_PROJECTION, LIDAR_BLOCK_SIZE)
+                for document in batch if stream_split(document) == split)
+
+    dataset = stream_dataset(documents, load_stream_document, STREAM_SIGNATURE, stream_executor, STREAM_IN_FLIGHT)
+    if shuffle_buffer:
+        dataset = dataset.shuffle(shuffle_buffer)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
 def clear_gpu_memory():
     """Clear GPU memory by resetting the session and deleting unused variables."""
     tf.keras.backend.clear_session()  # Clear the TensorFlow backend
@@ -436,72 +671,131 @@ try:
     # Clear GPU memory after processing the chunk
     clear_gpu_memory()
 
-    criteria = {
-        "$and": [
-            {"year": 2024},
-            {"rgbimage_ids": {"$exists": True, "$not": {"$size": 0}}},  # Ensure rgbimage_ids exists & is not empty
-            {"nirimage_ids": {"$exists": True, "$not": {"$size": 0}}},  # Ensure nirimage_ids exists & is not empty
-            {"seedingdate": {"$exists": True}},
-            {"weather_id": {"$exists": True}},
-            {"lidar_id": {"$exists": True}},
-            {"yield": {"$exists": True, "$ne": float("NaN")}},
-            {
-                "$expr": {
-                    "$eq": [{"$size": "$rgbimage_ids"}, {"$size": "$nirimage_ids"}]
-                }
-            },  # Ensures rgbimage_ids and nirimage_ids have the same length
-            {
-                "$expr": {
-                    "$lt": [{"$size": "$rgbimage_ids"}, 10]
-                }
-            }  # Ensures rgbimage_ids has fewer than 10 elements
-        ]
-    }
-
-    documents = list(collection.find(criteria))
-
-    # Shuffle the documents
-    random.shuffle(documents)
-
-    # Count matching documents
-    document_count = collection.count_documents(criteria)
-    print(f"Number of matching documents: {document_count}")
-
-    # %%Get data from MongoDB
-    # Initialize empty lists for training data
-
-    x_rgbimage, x_nirimage, x_weather, x_lidar = [], [], [], []
-    x_imagedate, x_seedingdate = [], []
-    y_yield = []
-
-    for document in tqdm(documents, desc="Processing documents"):
-        rgbimage_ids = document.get('rgbimage_ids', [])
-        nirimage_ids = document.get('nirimage_ids', [])
+    # Paired RGB/NIR images (fewer than 10), LiDAR, weather, seeding date and yield, selected on the
+    # indexed eligibility fields of 3_MongoDB/AddEligibilityFields.py instead of $exists / $size / $expr
+    criteria = eligibility_query(year=2024, labels=("yield",), max_images=10)
+
+    # Documents to load: all of them, or only those newer than the watermark of the feature store
+    load_criteria, watermark, fingerprint = criteria, None, None
+    if FEATURE_STORE_PATH and FEATURE_STORE_INCREMENTAL and not STREAM_FROM_MONGODB:
+        fingerprint = dataset_fingerprint(
+            criteria=criteria, image_size=[img_rows, img_cols], projection=PROJECTION_KWARGS, alignment=ALIGNMENT,
+            pyramid=PYRAMID_METHOD,
+            dtypes={name: np.dtype(dtype).str for name, dtype in SAMPLE_DTYPES.items()},
+            version=PREPROCESSING_VERSION,
+        )
+        # Extraction tasks run concurrently and never delete the store, the merge job does
+        watermark = store_watermark(FEATURE_STORE_PATH, fingerprint, collection, criteria,
+                                    remove_stale=not EXTRACTION_SHARD)
+        if not EXTRACTION_SHARD and merge_parts(FEATURE_STORE_PATH, fingerprint, watermark):
+            watermark = store_watermark(FEATURE_STORE_PATH, fingerprint, collection, criteria)
+        load_criteria = after_watermark(criteria, watermark)
+
+    extraction_path = None
+    if EXTRACTION_SHARD:
+        if not (FEATURE_STORE_PATH and FEATURE_STORE_INCREMENTAL) or STREAM_FROM_MONGODB:
+            raise ValueError("Sharded extraction writes parts of an incremental feature store, set "
+                             "FEATURE_STORE_PATH and FEATURE_STORE_INCREMENTAL and not STREAM_FROM_MONGODB")
+        shard, shards, extract_before = EXTRACTION_SHARD
+        extraction_path = part_path(FEATURE_STORE_PATH, shard, shards)
+        base_watermark = watermark
+        if not part_complete(extraction_path, fingerprint, base_watermark, extract_before):
+            shutil.rmtree(extraction_path, ignore_errors=True)  # Left by another extraction
+            load_criteria = shard_criteria(collection, load_criteria, shard, shards, extract_before)
+            print(f"Extracting shard {shard} of {shards}: {len(load_criteria['_id']['$in'])} documents "
+                  f"inserted before {extract_before.generation_time}")
+
+    if STREAM_FROM_MONGODB:
+        # Nothing is loaded up front: mongodb_dataset reads the cursor while training
+        fetch_executor = fetch_pool(FETCH_WORKERS)
+        stream_executor = fetch_pool(STREAM_WORKERS)
+        projection_cache = ProjectionCache(PROJECTION_CACHE_PATH, PROJECTION_CACHE_BYTES, **PROJECTION_KWARGS)
+        blob_cache = BlobCache(db, BLOB_CACHE_BYTES, local_blob_cache)
+        print(f"Streaming the samples of {collection.count_documents(criteria)} documents during training")
+    elif extraction_path and FeatureStore.exists(extraction_path):
+        # Completed by this task before it was requeued
+        print(f"Extraction part {extraction_path} is already complete")
+    elif not extraction_path and FEATURE_STORE_PATH and FeatureStore.exists(FEATURE_STORE_PATH) and (
+            not FEATURE_STORE_INCREMENTAL or not collection.count_documents(load_criteria, limit=1)):
+        # Built by an earlier job and up to date: no loading, batches are read from the shards
+        samples = FeatureStore(FEATURE_STORE_PATH)
+        print(f"Training from the feature store {FEATURE_STORE_PATH}: {len(samples)} samples")
+    else:
+        # Counted on the index; the documents themselves are streamed from the cursor while loading
+        # (no shuffle needed, the splits permute the sample indices)
+        document_count, pair_count = selection_counts(collection, load_criteria)
+        print(f"Number of matching documents: {document_count}" + (f" inserted after {watermark}" if watermark else ""))
+
+        # %%Get data from MongoDB
+        # Training data is written into SampleArrays, sized once the matched pairs are known
+
+        fetch_executor = fetch_pool(FETCH_WORKERS)
+        projection_cache = ProjectionCache(PROJECTION_CACHE_PATH, PROJECTION_CACHE_BYTES, **PROJECTION_KWARGS)
+        blob_cache = BlobCache(db, BLOB_CACHE_BYTES, local_blob_cache)
+
+        # One task per RGB/NIR pair of every document batch of the cursor, whose GridFS reads run
+        # ahead of this loop on the fetch pool in bulk reads of FETCH_BATCH_SIZE pairs, while the
+        # next document batches are still arriving
+        document_blocks = document_batches(collection, load_criteria, DOCUMENT_PROJECTION, LIDAR_BLOCK_SIZE)
+        sample_tasks = (
+            (block, document, rgb_id, nir_id)
+            for block in document_blocks
+            for document in block
+            for rgb_id, nir_id in zip(pyramid_ids(document, 'rgbimage', (img_rows, img_cols)),
+                                      pyramid_ids(document, 'nirimage', (img_rows, img_cols)))
+        )
+        if extraction_path:
+            # This task's part, merged into the store by the next regular job
+            samples = FeatureStoreWriter(extraction_path, FEATURE_STORE_SHARD_SIZE, SAMPLE_DTYPES)
+        elif FEATURE_STORE_PATH:
+            # Appends to a store with the same fingerprint, builds a new one otherwise
+            samples = FeatureStoreWriter(FEATURE_STORE_PATH, FEATURE_STORE_SHARD_SIZE, SAMPLE_DTYPES,
+                                         append=watermark is not None)
+        else:
+            samples = SampleArrays(pair_count, SAMPLE_DTYPES, preallocate=PREALLOCATE_SAMPLES)
+        print(f"{pair_count} RGB/NIR pairs to load, peak RSS before loading: {peak_rss_bytes() / 1024 ** 3:.2f} GiB")
+
+        # Every fetched batch keeps its tasks, the task generator can only be consumed once
+        batch_inputs = fetch_ordered(
+            lambda batch: list(zip(batch, fetch_batch_inputs([task[1:] for task in batch], blob_cache))),
+            iter_batched(sample_tasks, FETCH_BATCH_SIZE), fetch_executor, FETCH_IN_FLIGHT // FETCH_BATCH_SIZE)
+        task_inputs = (task_input for batch in batch_inputs for task_input in batch)
+        lidar_block, fetch_errors, dropped_samples = None, 0, 0
+        loaded_ids = []  # Every document of the cursor, for the checksum of the feature store
+        samples_before = len(samples)  # Samples already in the store when appending
+        load_start = time.perf_counter()
+
+        for (block, document, rgb_id, nir_id), inputs in tqdm(task_inputs, total=pair_count, desc="Processing samples"):
+            # Project the LiDAR of every cursor batch of documents in parallel
+            if block is not lidar_block:
+                lidar_block = block
+                watermark = max([document['_id'] for document in block] + ([watermark] if watermark else []))
+                loaded_ids += [document['_id'] for document in block]
+                lidar_projections = project_documents_lidar(block, lidar_pool, fetch_executor, projection_cache)
+
+            fetch_errors += sum(isinstance(value, Exception) for value in inputs.values())
 
-        for rgb_id, nir_id in zip(rgbimage_ids, nirimage_ids):
             rgb_data, nir_data, weather_data, lidar_data = None, None, None, None
             imagedate_data, seedingdate_data = None, None
             yield_data = None
             append_data = True  # Flag to track if there was an error for the document
 
             try:
-                # Fetch the RGB image
+                # RGB image, read and processed on the fetch pool
                 try:
-                    gridout_rgb = fs.get(rgb_id)
-                    rgb_image_raw = np.load(BytesIO(gridout_rgb.read()))
-                    resized_rgb_image = image_processing(rgb_image_raw, is_nir=False)  # Process the RGB image
-                    rgb_data = resized_rgb_image  # Store the processed RGB image
+                    rgb_data = inputs['rgb']
+                    if isinstance(rgb_data, Exception):
+                        raise rgb_data
 
                 except Exception as e:
                     print(f"Error reading RGB image with rgb_id {rgb_id}: {e}")
                     append_data = False  # Mark as False if reading fails
 
-                # Fetch the NIR image
+                # NIR image, read and processed on the fetch pool
                 try:
-                    gridout_nir = fs.get(nir_id)
-                    nir_image_raw = np.load(BytesIO(gridout_nir.read()))
-                    resized_nir_image = image_processing(nir_image_raw, is_nir=True)  # Process the NIR image
-                    nir_data = resized_nir_image  # Store the processed NIR image
+                    nir_data = inputs['nir']
+                    if isinstance(nir_data, Exception):
+                        raise nir_data
 
                 except Exception as e:
                     print(f"Error reading NIR image with nir_id {nir_id}: {e}")
@@ -509,17 +803,18 @@ try:
 
                 # Weather data
                 try:
-                    gridout_weather = fs.get(document['weather_id'])
-                    weather_data = np.load(BytesIO(gridout_weather.read()))
+                    weather_data = inputs['weather']  # Fetched once per run through the blob cache
+                    if isinstance(weather_data, Exception):
+                        raise weather_data
                 except Exception as e:
                     print(f"Error reading weather data for document {document.get('id', 'Unknown')}: {e}")
                     append_data = False  # Mark as False if reading weather data fails
 
                 # Lidar data
                 try:
-                    gridout_lidar = fs.get(document['lidar_id'])
-                    lidar_data_raw = np.load(BytesIO(gridout_lidar.read()))
-                    lidar_data = projection3x(lidar_data_raw)
+                    lidar_data = lidar_projections[document['lidar_id']]
+                    if isinstance(lidar_data, Exception):
+                        raise lidar_data
                 except Exception as e:
                     print(f"Error reading lidar data for document {document.get('id', 'Unknown')}: {e}")
                     append_data = False  # Mark as False if reading lidar data fails
@@ -536,66 +831,96 @@ try:
                     print(f"Error reading date and label data for document {document.get('id', 'Unknown')}: {e}")
                     append_data = False  # Mark as False if reading date or labels fails
 
-                # If all required data is available, append the data to the lists
+                # If all required data is available, write the sample into the training arrays
                 if append_data:
-                    x_rgbimage.append(rgb_data)
-                    x_nirimage.append(nir_data)
-                    x_weather.append(weather_data)
-                    x_lidar.append(lidar_data)
-                    x_imagedate.append(imagedate_data)
-                    x_seedingdate.append(seedingdate_data)
-                    y_yield.append(yield_data)
+                    samples.append({
+                        'rgb': rgb_data, 'nir': nir_data, 'weather': weather_data, 'lidar': lidar_data,
+                        'imagedate': imagedate_data, 'seedingdate': seedingdate_data, 'yield': yield_data,
+                    })
 
             except Exception as e:
                 print(f"Error: {e}")
-                append_data = False
-                continue  # Skip the entire document if there's an error
+                append_data = False  # Skip the sample if there's an error
+
+            if not append_data:
+                dropped_samples += 1  # Each failed read was reported above
+
+        fetch_executor.shutdown()
+        load_time = time.perf_counter() - load_start
+        print(f"Loaded {len(samples) - samples_before} samples from {document_count} documents in {load_time:.1f} s "
+              f"({document_count / load_time:.1f} documents/sec), {dropped_samples} samples dropped, "
+              f"{fetch_errors} failed fetches")
+        projection_cache.print_stats()
+        blob_cache.print_stats()
+
+        if FEATURE_STORE_PATH:
+            # Documents already in the store when appending to it, and those loaded now
+            documents = document_checksum(loaded_ids)
+            if samples.append_mode:
+                documents = merge_checksums([FeatureStore(FEATURE_STORE_PATH).metadata.get('documents'), documents])
+            store_metadata = {'criteria': criteria, 'image_size': [img_rows, img_cols],
+                              'projection': PROJECTION_KWARGS, 'fingerprint': fingerprint,
+                              'watermark': str(watermark) if watermark else None, 'documents': documents}
+            if extraction_path:
+                store_metadata.update({'shard': shard, 'shards': shards, 'before': str(extract_before),
+                                       'base_watermark': str(base_watermark) if base_watermark else None})
+            samples = samples.close(store_metadata)
+            print(f"Feature store written to {extraction_path or FEATURE_STORE_PATH}: {len(samples)} samples")
+
+    if not STREAM_FROM_MONGODB:
+        lidar_pool.shutdown()  # Everything is projected; streaming keeps projecting while training
 
     # %%DL
-    # Convert inputs to NumPy arrays
-    x_rgbimage = np.array(x_rgbimage)
-    x_nirimage = np.array(x_nirimage)
-    x_seedingdate = np.array(x_seedingdate).reshape(-1, 1)
-    x_imagedate = np.array(x_imagedate).reshape(-1, 1)
-    x_weather = np.array(x_weather).transpose(0, 2, 3, 1) # Rearrange dimensions to (batch_size, height, width, channels)
-    x_lidar = np.array(x_lidar)
-
-    # Convert outputs to NumPy arrays
-    y_yield = np.array(y_yield).reshape(-1, 1)
-
-    # distribution:
-    # print_distribution(y_flowering, "Flowering Days")
-    # print_distribution(y_maturity, "Maturity Days")
-
-    # Save histograms as SVG files
-    # plot_histogram_and_save(y_flowering, "Flowering Days", filename=f"{OUTPUT_PATH}flowering_histogram.svg")
-    # plot_histogram_and_save(y_maturity, "Maturity Days", filename=f"{OUTPUT_PATH}maturity_histogram.svg")
-
-    print(f"x_train_rgbimage: {type(x_rgbimage)}, shape: {x_rgbimage.shape}")
-    print(f"x_train_nirimage: {type(x_nirimage)}, shape: {x_nirimage.shape}")
-    print(f"x_train_seedingdate: {type(x_seedingdate)}, shape: {x_seedingdate.shape}")
-    print(f"x_train_imagedate: {type(x_imagedate)}, shape: {x_imagedate.shape}")
-    print(f"x_train_lidar: {type(x_lidar)}, shape: {x_lidar.shape}")
-    print(f"x_train_weather: {type(x_weather)}, shape: {x_weather.shape}")
-    print(f"y_train_yield: {type(y_yield)}, shape: {y_yield.shape}")
-
-    print("Checking for NaNs or infinities in the data...")
-    print("RGB Images:", np.isnan(x_rgbimage).any() or np.isinf(x_rgbimage).any())
-    print("NIR Images:", np.isnan(x_nirimage).any() or np.isinf(x_nirimage).any())
-    print("Seeding Date:", np.isnan(x_seedingdate).any() or np.isinf(x_seedingdate).any())
-    print("Image Date:", np.isnan(x_imagedate).any() or np.isinf(x_imagedate).any())
-    print("LiDAR Data:", np.isnan(x_lidar).any() or np.isinf(x_lidar).any())
-    print("Weather Data:", np.isnan(x_weather).any() or np.isinf(x_weather).any())
-    print("yield:", np.isnan(y_yield).any() or np.isinf(y_yield).any())
+    if not STREAM_FROM_MONGODB and not EXTRACTION_SHARD:
+        # Inputs stay in samples and are gathered batch by batch by SampleBatches
+        print(f"Peak RSS after loading: {peak_rss_bytes() / 1024 ** 3:.2f} GiB")
+        print_memory_report(samples)
+
+        # distribution, from the label histogram accumulated while loading:
+        # samples.stats.print_distribution('yield', "Yield")
+
+        # Save histograms as SVG files
+        # plot_histogram_and_save(y_flowering, "Flowering Days", filename=f"{OUTPUT_PATH}flowering_histogram.svg")
+        # plot_histogram_and_save(y_maturity, "Maturity Days", filename=f"{OUTPUT_PATH}maturity_histogram.svg")
+
+        first_inputs, first_target = SampleBatches(samples, [0], batch_size=1)[0]
+        for name, array in first_inputs.items():
+            print(f"{name}: {array.dtype}, shape: {(len(samples),) + array.shape[1:]}")
+        print(f"yield: {first_target.dtype}, shape: {(len(samples),) + first_target.shape[1:]}")
+
+        print("Checking for NaNs or infinities in the data...")
+        if samples.stats is not None:
+            # Accumulated while loading, or read from the feature store manifest: no pass over the data
+            samples.stats.print_report()
+        else:  # Feature store written before stats were kept, checked block by block
+            print("RGB Images:", has_nonfinite(samples, 'rgb'))
+            print("NIR Images:", has_nonfinite(samples, 'nir'))
+            print("Seeding Date:", has_nonfinite(samples, 'seedingdate'))
+            print("Image Date:", has_nonfinite(samples, 'imagedate'))
+            print("LiDAR Data:", has_nonfinite(samples, 'lidar'))
+            print("Weather Data:", has_nonfinite(samples, 'weather'))
+            print("yield:", has_nonfinite(samples, 'yield'))
 
 # %% STOP MongoDB
 finally:
-    print("Stopping MongoDB before exiting...")
+    # Streaming reads MongoDB while training, it is stopped after training; extraction tasks share
+    # mongod with the other tasks, the merge job stops it
+    if not STREAM_FROM_MONGODB and not EXTRACTION_SHARD:
+        print("Stopping MongoDB before exiting...")
+        stop_mongod()
+
+if EXTRACTION_SHARD:
+    if local_blob_cache:
+        local_blob_cache.print_stats()
+    stop_monitoring = True
+    monitor_thread.join()
+    terminate_monitoring(process)
+    sys.exit(0)
+
+if not STREAM_FROM_MONGODB:
+    # To stop monitoring later, call:
     stop_mongod()
-
-# To stop monitoring later, call:
-stop_mongod()
-monitor_thread.join()  # Wait for the thread to exit
+    monitor_thread.join()  # Wait for the thread to exit
 # %%
 # -----------------------------
 # 1. NORMALIZATION HELPERS
@@ -666,15 +991,21 @@ def build_image_branch(
         name_prefix="image_branch",
         kernel_regularizer=None,
         scale_factor=1.0 / 255.0,  # <--- specify default
+        normalization=None,
 ):
     """
     Builds a CNN branch for image-like input.
-    The first layer rescales so you don't have to do x/255 externally.
+    The first layer rescales so you don't have to do x/255 externally, or, given the
+    ChannelStats of the training split as normalization, standardizes every channel.
     """
     inputs = Input(shape=input_shape, name=name_prefix + "_input")
 
-    # Rescale so you do NOT have to do image/255 outside the model
-    x = layers.Rescaling(scale_factor)(inputs)
+    if normalization is not None:
+        # (x - mean) / std per channel, with the statistics stored in the model
+        x = layers.Normalization(axis=-1, mean=normalization.mean, variance=normalization.variance)(inputs)
+    else:
+        # Rescale so you do NOT have to do image/255 outside the model
+        x = layers.Rescaling(scale_factor)(inputs)
 
     # Initial Conv -> BN -> ReLU
     x = conv_bn_relu(x, initial_filters, kernel_size=3,
@@ -699,15 +1030,19 @@ def build_dense_branch(
         name_prefix="dense_branch",
         kernel_regularizer=None,
         scalar_scale=None,  # <--- new option for dividing scalars
+        normalization=None,
 ):
     """
     Builds an MLP branch for scalar input.
-    If scalar_scale is not None, apply x/scalar_scale inside the model.
+    If normalization (ChannelStats) is given, standardize with it inside the model,
+    else if scalar_scale is not None, apply x/scalar_scale inside the model.
     """
     inputs = Input(shape=(input_dim,), name=f"{name_prefix}_input")
 
+    if normalization is not None:
+        x = layers.Normalization(axis=-1, mean=normalization.mean, variance=normalization.variance)(inputs)
     # If you want x / 365 for days, do it here:
-    if scalar_scale is not None:
+    elif scalar_scale is not None:
         x = layers.Lambda(lambda z: z / scalar_scale)(inputs)
     else:
         x = inputs
@@ -726,17 +1061,21 @@ def build_weather_branch(
         num_blocks=2,
         name_prefix="weather_branch",
         kernel_regularizer=None,
-        scale_factor=None
+        scale_factor=None,
+        normalization=None,
 ):
     """
     Builds a CNN branch for weather data.
-    If scale_factor is provided, you can do a Rescaling inside.
+    If normalization (ChannelStats of the 146 channels) is given, standardize every channel
+    inside the model; else if scale_factor is provided, you can do a Rescaling inside.
     """
     inputs = Input(shape=input_shape, name=name_prefix + "_input")
     x = inputs
 
+    if normalization is not None:
+        x = layers.Normalization(axis=-1, mean=normalization.mean, variance=normalization.variance)(x)
     # If you want to do some scale like x/100 or x/1000 for weather, do it:
-    if scale_factor is not None:
+    elif scale_factor is not None:
         x = layers.Rescaling(scale_factor)(x)
 
     x = conv_bn_relu(x, initial_filters, kernel_size=3,
@@ -754,6 +1093,52 @@ def build_weather_branch(
     return Model(inputs, x, name=name_prefix)
 
 
+# -----------------------------
+# SPLIT AND NORMALIZATION STATISTICS
+# -----------------------------
+# Use an independent random seed for shuffling
+shuffle_seed = np.random.randint(0, 10000)
+np.random.seed(shuffle_seed)
+
+normalization = {}  # Input name -> ChannelStats of the training split; empty: fixed scales
+if not STREAM_FROM_MONGODB:  # Streamed documents are split by stream_split
+    # The splits and statistics are saved next to what they describe, the TFRecord export or else the
+    # feature store, for this version and size of the store. Samples loaded into memory have no
+    # stable order across jobs and get a new split every time.
+    normalization_key = None
+    if isinstance(samples, FeatureStore):
+        normalization_key = {'fingerprint': samples.metadata.get('fingerprint'),
+                             'watermark': samples.metadata.get('watermark'), 'samples': len(samples)}
+    normalization_path = (os.path.join(TFRECORD_PATH, NORMALIZATION_FILE) if TFRECORD_PATH
+                          else os.path.join(samples.path, NORMALIZATION_FILE) if normalization_key else None)
+    saved = load_normalization(normalization_path, normalization_key) if normalization_key else None
+
+    if saved:
+        splits, normalization = saved
+        test_indices = splits['test']
+        train_indices = np.random.permutation(np.setdiff1d(np.arange(len(samples)), test_indices))
+        print(f"Reusing the split and normalization statistics of {normalization_path}")
+    else:
+        # Shuffle data before splitting (only the sample indices, the inputs stay where they are)
+        shuffle_indices = np.random.permutation(len(samples))
+
+        # Split a test dataset (20% of total data)
+        train_indices, test_indices = train_test_split(shuffle_indices, test_size=0.2, random_state=None)
+        splits = {'test': test_indices}
+        stats_indices = train_indices  # Everything but the test split (validation chunks are drawn from it)
+        if TFRECORD_PATH:
+            # The export fixes its validation split too, drawn once with the test split; the model is
+            # fitted on the exported train split only, so the statistics are too
+            splits['train'], splits['val'] = train_test_split(train_indices, test_size=0.2, random_state=None)
+            stats_indices = splits['train']
+
+        # Per-channel statistics of the samples the model is fitted on
+        stats_start = time.perf_counter()
+        normalization = channel_stats(samples, stats_indices, NORMALIZED_INPUTS, workers=STATS_WORKERS)
+        print(f"Normalization statistics of {len(stats_indices)} samples in {time.perf_counter() - stats_start:.1f} s")
+        if normalization_path and not TFRECORD_PATH:  # The export saves them once its files are complete
+            save_normalization(normalization_path, normalization_key, splits, normalization)
+
 # -----------------------------
 # 3. BUILD / COMPILE MODEL
 # -----------------------------
@@ -780,12 +1165,13 @@ with strategy.scope():
         scale_factor=1.0 / 255.0
     )
     lidar_branch = build_image_branch(
-        input_shape=(100, 300, 3),
+        input_shape=(100, 300, len(LIDAR_CHANNELS)),
         initial_filters=32,
         num_blocks=4,
         name_prefix="lidar",
         kernel_regularizer=reg,
-        scale_factor=1.0 / 150.0  # e.g., if LiDAR range ~150
+        scale_factor=1.0 / 150.0,  # e.g., if LiDAR range ~150
+        normalization=normalization.get('lidar')
     )
 
     # Scalar branches
@@ -794,14 +1180,16 @@ with strategy.scope():
         units_list=[64, 128, 256],
         name_prefix="seeding",
         kernel_regularizer=reg,
-        scalar_scale=365.0
+        scalar_scale=365.0,
+        normalization=normalization.get('seedingdate')
     )
     image_date_branch = build_dense_branch(
         input_dim=1,
         units_list=[64, 128, 256],
         name_prefix="image_date_branch",
         kernel_regularizer=reg,
-        scalar_scale=365.0
+        scalar_scale=365.0,
+        normalization=normalization.get('imagedate')
     )
 
     # Weather branch
@@ -811,13 +1199,14 @@ with strategy.scope():
         num_blocks=4,
         name_prefix="weather",
         kernel_regularizer=reg,
-        scale_factor=1.0/100.0
+        scale_factor=1.0/100.0,
+        normalization=normalization.get('weather')
     )
 
     # Inputs
     rgb_input = tf.keras.Input(shape=(512, 612, 3), name="rgb_image")
     nir_input = tf.keras.Input(shape=(512, 612, 1), name="nir_image")
-    lidar_input = tf.keras.Input(shape=(100, 300, 3), name="lidar_data")
+    lidar_input = tf.keras.Input(shape=(100, 300, len(LIDAR_CHANNELS)), name="lidar_data")
     seeding_input = tf.keras.Input(shape=(1,), name="seeding_date")
     image_date_input = tf.keras.Input(shape=(1,), name="image_date")
     weather_input = tf.keras.Input(shape=(8, 8, 146), name="weather_data")
@@ -890,127 +1279,106 @@ best_rmse_yield = np.inf
 # Results storage
 results = []
 
-# Use an independent random seed for shuffling
-shuffle_seed = np.random.randint(0, 10000)
-np.random.seed(shuffle_seed)
-
-# Shuffle data before splitting
-shuffle_indices = np.random.permutation(len(x_rgbimage))
-x_rgbimage = x_rgbimage[shuffle_indices]
-x_nirimage = x_nirimage[shuffle_indices]
-x_seedingdate = x_seedingdate[shuffle_indices]
-x_imagedate = x_imagedate[shuffle_indices]
-x_lidar = x_lidar[shuffle_indices]
-x_weather = x_weather[shuffle_indices]
-y_yield = y_yield[shuffle_indices]
-
-# Split a test dataset (20% of total data)
-(
-    x_train_rgbimage, x_test_rgbimage,
-    x_train_nirimage, x_test_nirimage,
-    x_train_seedingdate, x_test_seedingdate,
-    x_train_imagedate, x_test_imagedate,
-    x_train_lidar, x_test_lidar,
-    x_train_weather, x_test_weather,
-    y_train_yield, y_test_yield
-) = train_test_split(
-    x_rgbimage, x_nirimage, x_seedingdate, x_imagedate, x_lidar, x_weather,
-    y_yield, test_size=0.2, random_state=None
-)
+if TFRECORD_PATH and not STREAM_FROM_MONGODB and not saved:
+    # A new split replaces the whole export: splits left by an older one would put its test samples
+    # in the training files. The split file goes first and is written back last, so a job dying
+    # mid-export leaves no file and the next job exports again.
+    if os.path.exists(normalization_path):
+        os.remove(normalization_path)
+    for split in ("train", "val", "test"):
+        split_path = os.path.join(TFRECORD_PATH, split)
+        shutil.rmtree(split_path, ignore_errors=True)
+
+        split_batches = SampleBatches(samples, np.sort(splits[split]), batch_size=256)  # Sorted: sequential reads
+        examples = write_tfrecords(
+            split_path,
+            ({**inputs, "yield": target} for inputs, target in (split_batches[i] for i in range(len(split_batches)))),
+            compression=TFRECORD_COMPRESSION
+        )
+        print(f"Exported {examples} {split} examples to {split_path}")
+    save_normalization(normalization_path, normalization_key, splits, normalization)
 
 # Run the training process N times
 for repetition in range(1, 3):
     print(f"Repetition: {repetition}")
 
-    # Define the desired chunk size
-    desired_chunk_size = 1000
-
-    # Calculate the number of chunks needed
-    total_train_samples = len(x_train_rgbimage)
-    num_chunks = max(1, total_train_samples // desired_chunk_size)
-
-    # Generate split indices
-    split_indices = [i * desired_chunk_size for i in range(1, num_chunks)]
-    split_indices.append(total_train_samples)
-
-    print(f"Total samples: {total_train_samples}")
-    print(f"Chunk size: {desired_chunk_size}")
-    print(f"Number of chunks: {num_chunks}")
-    print(f"Split indices: {split_indices}")
-
-    # Iterate over training chunks
-    for i, (start, end) in enumerate(zip([0] + split_indices[:-1], split_indices)):
-        print(f"Processing training chunk {i + 1}...")
-
-        # Extract the current chunk
-        x_chunk_rgbimage = x_train_rgbimage[start:end]
-        x_chunk_nirimage = x_train_nirimage[start:end]
-        x_chunk_seedingdate = x_train_seedingdate[start:end]
-        x_chunk_imagedate = x_train_imagedate[start:end]
-        x_chunk_lidar = x_train_lidar[start:end]
-        x_chunk_weather = x_train_weather[start:end]
-        y_chunk_yield = y_train_yield[start:end]
-
-        # Split chunk into training/validation
-        (
-            x_chunk_rgbimage_train, x_chunk_rgbimage_val,
-            x_chunk_nirimage_train, x_chunk_nirimage_val,
-            x_chunk_seedingdate_train, x_chunk_seedingdate_val,
-            x_chunk_imagedate_train, x_chunk_imagedate_val,
-            x_chunk_lidar_train, x_chunk_lidar_val,
-            x_chunk_weather_train, x_chunk_weather_val,
-            y_chunk_yield_train, y_chunk_yield_val
-        ) = train_test_split(
-            x_chunk_rgbimage, x_chunk_nirimage,
-            x_chunk_seedingdate, x_chunk_imagedate,
-            x_chunk_lidar, x_chunk_weather,
-            y_chunk_yield,
-            test_size=0.2,
-            random_state=None
+    if STREAM_FROM_MONGODB:
+        # Every epoch streams the training documents from the cursor
+        history = model.fit(
+            mongodb_dataset("train", batch_size=1, shuffle_buffer=STREAM_SHUFFLE_BUFFER),
+            validation_data=mongodb_dataset("val", batch_size=1),
+            epochs=100,
+            callbacks=[early_stopping],
+            verbose=1
         )
+        clear_gpu_memory()
 
-        # Train the model on the current chunk
+    elif TFRECORD_PATH:
+        # Stream the exported splits through tf.data, the examples are shuffled in the buffer
         history = model.fit(
-            {
-                "rgb_image": x_chunk_rgbimage_train,
-                "nir_image": x_chunk_nirimage_train,
-                "lidar_data": x_chunk_lidar_train,
-                "seeding_date": x_chunk_seedingdate_train,
-                "image_date": x_chunk_imagedate_train,
-                "weather_data": x_chunk_weather_train,
-            },
-            y_chunk_yield_train,
-            validation_data=(
-                {
-                    "rgb_image": x_chunk_rgbimage_val,
-                    "nir_image": x_chunk_nirimage_val,
-                    "lidar_data": x_chunk_lidar_val,
-                    "seeding_date": x_chunk_seedingdate_val,
-                    "image_date": x_chunk_imagedate_val,
-                    "weather_data": x_chunk_weather_val,
-                },
-                y_chunk_yield_val,
-            ),
+            tfrecord_dataset(os.path.join(TFRECORD_PATH, "train"), ["yield"], batch_size=1,
+                             shuffle_buffer=TFRECORD_SHUFFLE_BUFFER),
+            validation_data=tfrecord_dataset(os.path.join(TFRECORD_PATH, "val"), ["yield"], batch_size=1),
             epochs=100,
-            batch_size=1,
             callbacks=[early_stopping],
             verbose=1
         )
-
-        # Clear GPU memory if you wish (custom function)
         clear_gpu_memory()
 
+    else:
+        # Define the desired chunk size
+        desired_chunk_size = 1000
+
+        # Calculate the number of chunks needed
+        total_train_samples = len(train_indices)
+        num_chunks = max(1, total_train_samples // desired_chunk_size)
+
+        # Generate split indices
+        split_indices = [i * desired_chunk_size for i in range(1, num_chunks)]
+        split_indices.append(total_train_samples)
+
+        print(f"Total samples: {total_train_samples}")
+        print(f"Chunk size: {desired_chunk_size}")
+        print(f"Number of chunks: {num_chunks}")
+        print(f"Split indices: {split_indices}")
+
+        # Iterate over training chunks
+        for i, (start, end) in enumerate(zip([0] + split_indices[:-1], split_indices)):
+            print(f"Processing training chunk {i + 1}...")
+
+            # Extract the current chunk and split it into training/validation
+            chunk_train_indices, chunk_val_indices = train_test_split(
+                train_indices[start:end],
+                test_size=0.2,
+                random_state=None
+            )
+
+            # Train the model on the current chunk
+            history = model.fit(
+                SampleBatches(samples, chunk_train_indices, batch_size=1, shuffle=True),
+                validation_data=SampleBatches(samples, chunk_val_indices, batch_size=1),
+                epochs=100,
+                callbacks=[early_stopping],
+                verbose=1
+            )
+
+            # Clear GPU memory if you wish (custom function)
+            clear_gpu_memory()
+
     # Validation predictions and metrics calculation
-    y_pred = model.predict(
-        {
-            "rgb_image": x_test_rgbimage,
-            "nir_image": x_test_nirimage,
-            "lidar_data": x_test_lidar,
-            "seeding_date": x_test_seedingdate,
-            "image_date": x_test_imagedate,
-            "weather_data": x_test_weather,
-        }
-    )
+    if STREAM_FROM_MONGODB:
+        # Predict batch by batch, so predictions and targets come from the same pass over the cursor
+        test_batches = [(model.predict_on_batch(inputs), target.numpy())
+                        for inputs, target in mongodb_dataset("test", batch_size=32)]
+        y_pred = np.concatenate([prediction for prediction, _ in test_batches])
+        y_test_yield = np.concatenate([target for _, target in test_batches])
+    elif TFRECORD_PATH:
+        test_dataset = tfrecord_dataset(os.path.join(TFRECORD_PATH, "test"), ["yield"], batch_size=32)
+        y_pred = model.predict(test_dataset)
+        y_test_yield = np.concatenate([target.numpy() for _, target in test_dataset])  # Same order, no shuffling
+    else:
+        y_pred = model.predict(SampleBatches(samples, test_indices, batch_size=32))
+        y_test_yield = samples.take(test_indices, ['yield'])['yield']
 
     # Flatten the predictions & true values
     y_pred_yield = y_pred.flatten()
@@ -1051,6 +1419,16 @@ for repetition in range(1, 3):
     results_file_path = f'{OUTPUT_PATH}/Y_Results.xlsx'
     results_df.to_excel(results_file_path, index=False)
     print(f"Results saved to {results_file_path}")
+
+if STREAM_FROM_MONGODB:
+    stream_executor.shutdown()
+    fetch_executor.shutdown()
+    lidar_pool.shutdown()
+    projection_cache.print_stats()
+    blob_cache.print_stats()
+    print("Stopping MongoDB after streaming...")
+    stop_mongod()
+    monitor_thread.join()  # Wait for the thread to exit
 '''
 # Define the email command dynamically using the results_file_path variable
 email_command = (
@@ -1067,5 +1445,8 @@ except subprocess.CalledProcessError as e:
     print(f"Failed to send email: {e}")
 '''
 
+if local_blob_cache:
+    local_blob_cache.print_stats()
+
 # Later, when you want to stop monitoring:
 terminate_monitoring(process)
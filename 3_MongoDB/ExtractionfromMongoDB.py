@@ -17,8 +17,14 @@ import signal
 import os
 import psutil
 import subprocess
+import sys
 from tqdm import tqdm
 
+sys.path.append("/home/prr000/Documents/Projects/Training/2_Containers/trainingcontainer_sandbox/home/ubuntu/scripts")
+from gridfsfetch import read_blobs
+from blobcodec import decode_blob
+from eligibility import eligibility_query, ELIGIBILITY_FIELDS
+
 # Path to the MongoDB config and log files
 ACCESSJSON = '/gpfs/fs7/aafc/phenocart/PhenomicsProjects/UFPSGPSCProject/5_Data/MongoDB/config.json'
 DB = "NewPhenocartDB"
@@ -95,12 +101,13 @@ def monitor_mongod():
     print("Monitoring thread stopped.")
 
 
-def save_image(file_id, file_prefix, folder_name):
+def save_image(file_id, blob, file_prefix, folder_name, metadata=None):
     file_id = str(file_id)
 
     try:
-        gridout = fs.get(document["rgbimage_ids"][0])  # Retrieve from GridFS
-        img_array = np.load(BytesIO(gridout.read()))  # Read binary content
+        if isinstance(blob, Exception):  # Missing or incomplete in GridFS
+            raise blob
+        img_array = decode_blob(blob, metadata)  # Decode with the codec recorded at ingest
 
         # If dtype is float, normalize to uint8
         if img_array.dtype == np.float32 or img_array.dtype == np.float64:
@@ -131,9 +138,14 @@ def save_image(file_id, file_prefix, folder_name):
         return None
 
 # Function to save .npy files
-def save_npy(file_id, file_prefix, folder_name):
-    file_data = fs.get(ObjectId(file_id)).read()
-    np_array = np.frombuffer(file_data, dtype=np.float32)  # Adjust dtype as needed
+def save_npy(file_id, blob, file_prefix, folder_name, metadata=None):
+    if isinstance(blob, Exception):  # Missing or incomplete in GridFS
+        raise blob
+    if metadata and "codec" in metadata:
+        np_array = decode_blob(blob, metadata)
+    else:  # Uploaded before blob codecs: raw array bytes without a header
+        file_data = bytes(blob)
+        np_array = np.frombuffer(file_data, dtype=np.float32)  # Adjust dtype as needed
     filename = f"{file_prefix}.npy"
     np.save(os.path.join(folder_name, filename), np_array)
     return filename
@@ -163,24 +175,8 @@ try:
     db.command('ping')  # Sending a ping command to the database
     print("Ping to MongoDB server successful.")
 
-    criteria = {
-        "$and": [
-            {"year": 2024},
-            {"location": "Ottawa"},
-            {"rgbimage_ids": {"$exists": True, "$not": {"$size": 0}}},
-            {"nirimage_ids": {"$exists": True, "$not": {"$size": 0}}},
-            {"seedingdate": {"$exists": True}},
-            {"weather_id": {"$exists": True}},
-            {"lidar_id": {"$exists": True}},
-            {"flowering": {"$exists": True, "$ne": float("NaN")}},
-            {"maturity": {"$exists": True, "$ne": float("NaN")}},
-            {
-                "$expr": {
-                    "$eq": [{"$size": "$rgbimage_ids"}, {"$size": "$nirimage_ids"}]
-                }
-            }
-        ]
-    }
+    # Selected on the indexed eligibility fields of AddEligibilityFields.py
+    criteria = eligibility_query(year=2024, location="Ottawa", labels=("flowering", "maturity"))
 
     documents = list(collection.find(criteria).limit(3))
     print(f"Number of Documents: {len(documents)}")
@@ -197,20 +193,36 @@ try:
         # Update document by replacing OIDs with filenames
         updated_document = document.copy()
 
+        # All blobs of the document in one fs.files query and one fs.chunks cursor, with their
+        # GridFS metadata holding the codec each one was encoded with
+        file_metadata = {}
+        blobs = read_blobs(db, [document["lidar_id"], document["weather_id"],
+                                *document["nirimage_ids"], *document["rgbimage_ids"]], file_metadata)
+
         # Replace Lidar and Weather IDs
-        updated_document["lidar_id"] = save_npy(document["lidar_id"], "lidar", folder_name)
-        updated_document["weather_id"] = save_npy(document["weather_id"], "weather", folder_name)
+        updated_document["lidar_id"] = save_npy(document["lidar_id"], blobs[document["lidar_id"]], "lidar", folder_name,
+                                                file_metadata.get(document["lidar_id"]))
+        updated_document["weather_id"] = save_npy(document["weather_id"], blobs[document["weather_id"]], "weather",
+                                                  folder_name, file_metadata.get(document["weather_id"]))
 
         # Replace NIR Image IDs
         updated_document["nirimage_ids"] = [
-            save_image(img, "nir", folder_name) for img in document["nirimage_ids"]
+            save_image(img, blobs[img], "nir", folder_name, file_metadata.get(img)) for img in document["nirimage_ids"]
         ]
 
         # Replace RGB Image IDs
         updated_document["rgbimage_ids"] = [
-            save_image(img, "rgb", folder_name) for img in document["rgbimage_ids"]
+            save_image(img, blobs[img], "rgb", folder_name, file_metadata.get(img)) for img in document["rgbimage_ids"]
         ]
 
+        # Image pyramid levels are rebuilt from the full-resolution images by InsertData2MongoDB.py
+        updated_document.pop("nirimage_pyramid", None)
+        updated_document.pop("rgbimage_pyramid", None)
+
+        # Eligibility fields are recomputed by InsertData2MongoDB.py as well
+        for field in ELIGIBILITY_FIELDS:
+            updated_document.pop(field, None)
+
         # Remove MongoDB _id field
         del updated_document["_id"]
 
@@ -17,8 +17,15 @@ import signal
 import os
 import psutil
 import subprocess
+import sys
 from tqdm import tqdm
 
+sys.path.append("/home/prr000/Documents/Projects/Training/2_Containers/trainingcontainer_sandbox/home/ubuntu/scripts")
+from lidarprojection import voxel_downsample, check_downsampled_channels
+from imagepyramid import PYRAMID_FACTORS, build_pyramid, add_pyramid_level
+from blobcodec import encode_array, image_codec, available_codecs
+from eligibility import eligibility_fields, ELIGIBILITY_INDEX, ELIGIBILITY_INDEX_NAME
+
 # Path to the MongoDB config and log files
 ACCESSJSON = '/home/prr000/Documents/Projects/Training/1_Scripts/prr000/config.json'
 DB = "Data4AWS"
@@ -27,6 +34,31 @@ MONGO_CONFIG = "/home/prr000/Documents/Projects/Training/1_Scripts/prr000/mongod
 MONGO_LOG = os.path.expanduser("~/mongod.log")
 # Path where extracted folders are stored
 BASE_FOLDER = "/fs/phenocart-work/prr000/Extracted_Data"
+# Voxel edge in cm for downsampling LiDAR at ingest, None uploads the full-density cloud.
+# Max-height projections stay identical when the projection resolution is a multiple of it;
+# min/mean/count/density channels need the full cloud, which is then lost for good. The upload
+# refuses to downsample unless LIDAR_CHANNELS, the channels every training script will project
+# (their LIDAR_CHANNELS and resolution), are max channels only.
+LIDAR_VOXEL_SIZE = None
+LIDAR_CHANNELS = ["xy:max", "xz:max", "yz:max"]
+LIDAR_RESOLUTION = 1
+if LIDAR_VOXEL_SIZE is not None:
+    check_downsampled_channels(LIDAR_VOXEL_SIZE, LIDAR_CHANNELS, LIDAR_RESOLUTION)
+# Downscaled levels stored next to every RGB/NIR image, so the loaders read the smallest level
+# covering their input size instead of the full-resolution image; () stores full resolution only
+IMAGE_PYRAMID_FACTORS = PYRAMID_FACTORS
+# Blob codecs recorded in the GridFS metadata of every file (see blobcodec.py): lossless PNG for
+# uint8 images (other images fall back to raw np.save bytes); "raw" keeps the uncompressed np.save
+# bytes of LiDAR and weather arrays. "zstd" / "lz4" compress them, but only set them once the
+# training containers are built with the zstandard / lz4 of their requirements.txt: loaders without
+# the library cannot decode the blobs and drop the documents. Ingest stops here if a codec's
+# library is missing on this machine.
+IMAGE_CODEC = "png"
+ARRAY_CODEC = "raw"
+for codec in (IMAGE_CODEC, ARRAY_CODEC):
+    if codec not in available_codecs():
+        raise ImportError(f"Blob codec {codec!r} is not available here (available: {available_codecs()}), "
+                          f"install its package or choose another codec")
 
 stop_monitoring = False  # Flag to stop the monitoring thread
 
@@ -130,25 +162,56 @@ try:
 
     print("Connected to MongoDB")
 
+    # Index of the eligibility fields, a no-op when it exists
+    collection.create_index(ELIGIBILITY_INDEX, name=ELIGIBILITY_INDEX_NAME)
+
     # %% Defs
     # Function to upload images to GridFS and return ObjectId
-    def upload_image(file_path):
-        """ Upload an image as a NumPy array in GridFS """
+    def upload_image(file_path, pyramid=None, factors=IMAGE_PYRAMID_FACTORS):
+        """
+        Upload an image as a NumPy array in GridFS, and its downscaled levels as separate files.
+        The level ids are added to pyramid (factor -> {'factor', 'shape', 'ids'}) when given.
+        """
         with Image.open(file_path) as img:
             img_array = np.array(img)  # Convert to NumPy array
 
-        img_bytes = BytesIO()
-        np.save(img_bytes, img_array)
-        img_bytes.seek(0)
+        img_bytes, codec_metadata = encode_array(img_array, image_codec(img_array, IMAGE_CODEC))
+        file_id = fs.put(img_bytes, filename=os.path.basename(file_path), metadata=codec_metadata)
 
-        file_id = fs.put(img_bytes, filename=os.path.basename(file_path))
+        if pyramid is not None:
+            for factor, level in build_pyramid(img_array, factors).items():
+                level_bytes, codec_metadata = encode_array(level, image_codec(level, IMAGE_CODEC))
+                level_id = fs.put(level_bytes, filename=f"{os.path.basename(file_path)}@{factor}",
+                                  metadata={"source_id": file_id, "factor": factor, **codec_metadata})
+                add_pyramid_level(pyramid, factor, level, level_id)
         return file_id
 
 
     # Function to upload NumPy files to GridFS and return ObjectId
     def upload_npy(file_path):
         np_data = np.load(file_path)  # Load .npy file
-        file_id = fs.put(np_data.tobytes(), filename=os.path.basename(file_path))
+        # Encoded with its header, so the loaders decode dtype and shape like every other blob
+        np_bytes, codec_metadata = encode_array(np_data, ARRAY_CODEC)
+        file_id = fs.put(np_bytes, filename=os.path.basename(file_path), metadata=codec_metadata)
+        return file_id
+
+
+    # Function to upload a LiDAR point cloud, optionally voxel-downsampled, and return ObjectId
+    def upload_lidar(file_path, voxel_size=LIDAR_VOXEL_SIZE):
+        """ Upload a LiDAR point cloud as a NumPy array in GridFS """
+        lidar_raw = np.load(file_path)
+        metadata = {"points": int(lidar_raw.shape[0])}
+
+        if voxel_size is not None:
+            check_downsampled_channels(voxel_size, LIDAR_CHANNELS, LIDAR_RESOLUTION)
+            # The loaders project the reduced cloud with the angle of the full cloud
+            lidar_raw, angle = voxel_downsample(lidar_raw, voxel_size)
+            metadata.update({"voxel_size": voxel_size, "angle": float(angle)})
+
+        lidar_bytes, codec_metadata = encode_array(lidar_raw, ARRAY_CODEC)
+        metadata.update(codec_metadata)
+
+        file_id = fs.put(lidar_bytes, filename=os.path.basename(file_path), metadata=metadata)
         return file_id
 
 
@@ -172,21 +235,29 @@ try:
         print(f"Processing {folder}...")
 
         # Upload Lidar & Weather Data
-        metadata["lidar_id"] = upload_npy(os.path.join(folder_path, "lidar.npy"))
+        metadata["lidar_id"] = upload_lidar(os.path.join(folder_path, "lidar.npy"))
         metadata["weather_id"] = upload_npy(os.path.join(folder_path, "weather.npy"))
 
         # Upload NIR images
+        nir_pyramid, rgb_pyramid = {}, {}
         metadata["nirimage_ids"] = [
-            upload_image(os.path.join(folder_path, img)) for img in sorted(os.listdir(folder_path))
+            upload_image(os.path.join(folder_path, img), nir_pyramid) for img in sorted(os.listdir(folder_path))
             if img.startswith("nir_") and img.endswith(".tif")
         ]
 
         # Upload RGB images
         metadata["rgbimage_ids"] = [
-            upload_image(os.path.join(folder_path, img)) for img in sorted(os.listdir(folder_path))
+            upload_image(os.path.join(folder_path, img), rgb_pyramid) for img in sorted(os.listdir(folder_path))
             if img.startswith("rgb_") and img.endswith(".tif")
         ]
 
+        # Downscaled levels, each a list of ids parallel to the full-resolution ids
+        metadata["nirimage_pyramid"] = list(nir_pyramid.values())
+        metadata["rgbimage_pyramid"] = list(rgb_pyramid.values())
+
+        # Precomputed fields the training queries select on (see eligibility.py)
+        metadata.update(eligibility_fields(metadata))
+
         # Insert document into MongoDB
         inserted_id = collection.insert_one(metadata).inserted_id
         print(f"Inserted document with ID: {inserted_id}")
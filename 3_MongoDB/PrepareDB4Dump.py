@@ -9,6 +9,10 @@ import time
 import signal
 from bson import ObjectId
 from pymongo.errors import BulkWriteError
+import sys
+
+sys.path.append("/home/prr000/Documents/Projects/Training/2_Containers/trainingcontainer_sandbox/home/ubuntu/scripts")
+from eligibility import eligibility_fields, ELIGIBILITY_INDEX, ELIGIBILITY_INDEX_NAME
 
 # %% Start MongoDB Process
 process = subprocess.Popen(
@@ -72,6 +76,11 @@ if not documents:
     print("No matching documents found. Exiting.")
     exit()
 
+# Precomputed fields the training queries select on (see eligibility.py)
+for doc in documents:
+    doc.update(eligibility_fields(doc))
+target_collection.create_index(ELIGIBILITY_INDEX, name=ELIGIBILITY_INDEX_NAME)
+
 # Insert Filtered Documents into Target Collection
 try:
     target_collection.insert_many(documents, ordered=False)
@@ -89,6 +98,8 @@ for doc in documents:
         file_ids_to_copy.update(doc["rgbimage_ids"])
     if "nirimage_ids" in doc and isinstance(doc["nirimage_ids"], list):
         file_ids_to_copy.update(doc["nirimage_ids"])
+    for level in doc.get("rgbimage_pyramid", []) + doc.get("nirimage_pyramid", []):  # Downscaled image levels
+        file_ids_to_copy.update(level["ids"])
     if "lidar_id" in doc:
         file_ids_to_copy.add(doc["lidar_id"])
     if "weather_id" in doc:
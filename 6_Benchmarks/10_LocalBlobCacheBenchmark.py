@@ -0,0 +1,86 @@
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+import numpy as np
+import pymongo
+from gridfs import GridFS
+
+import benchmarkutils  # noqa: F401, puts the container scripts on sys.path
+from blobcodec import encode_array
+from gridfsfetch import read_arrays, batched
+from localblobcache import LocalBlobCache
+
+# Needs a running mongod; the benchmark database is created and dropped. Point BENCHMARK_CACHE_DIR
+# at the node-local directory to measure (/dev/shm, local NVMe, ...).
+MONGO_URI = os.environ.get("BENCHMARK_MONGO_URI", "mongodb://localhost:27017/")
+CACHE_DIR = os.environ.get("BENCHMARK_CACHE_DIR", tempfile.gettempdir())
+DB = "LocalBlobCacheBenchmark"
+NUM_BLOBS = 400
+IMAGE_SHAPE = (512, 612, 3)  # RGB blobs as stored by InsertData2MongoDB
+BATCH_SIZE = 8
+CONCURRENT_JOBS = 4
+
+
+def read_all(db, file_ids, cache):
+    """Reads every blob in bulk reads of BATCH_SIZE like the loaders, returns the elapsed seconds."""
+    start = time.perf_counter()
+    for batch in batched(file_ids, BATCH_SIZE):
+        arrays = read_arrays(db, batch, cache=cache)
+        assert not any(isinstance(array, Exception) for array in arrays.values())
+    return time.perf_counter() - start
+
+
+def job(cache_dir, max_bytes, file_ids, expected_sums):
+    """One of several jobs of a node sharing the cache directory; every array must decode intact."""
+    client = pymongo.MongoClient(MONGO_URI)
+    cache = LocalBlobCache(cache_dir, max_bytes)
+    for batch in batched(file_ids, BATCH_SIZE):
+        for file_id, array in read_arrays(client[DB], batch, cache=cache).items():
+            assert int(array.sum()) == expected_sums[file_id], "Corrupted blob read from the cache"
+    client.close()
+
+
+client = pymongo.MongoClient(MONGO_URI)
+client.drop_database(DB)
+db = client[DB]
+fs = GridFS(db)
+rng = np.random.default_rng(0)
+
+print(f"Writing {NUM_BLOBS} blobs to {MONGO_URI}{DB}...")
+file_ids, expected_sums = [], {}
+for _ in range(NUM_BLOBS):
+    image = rng.integers(0, 255, IMAGE_SHAPE, dtype=np.uint8)
+    blob, metadata = encode_array(image)
+    file_id = fs.put(blob, metadata=metadata)
+    file_ids.append(file_id)
+    expected_sums[file_id] = int(image.sum())
+
+cache_dir = tempfile.mkdtemp(dir=CACHE_DIR)
+try:
+    total_mb = NUM_BLOBS * np.prod(IMAGE_SHAPE) / 1e6
+    cache = LocalBlobCache(cache_dir, 100 * 1024 ** 3)
+    print("| Read | Time (s) | MB/s |")
+    print("|------|---------|------|")
+    for name, run_cache in [("MongoDB only", None), ("cold cache", cache), ("warm cache", cache)]:
+        elapsed = read_all(db, file_ids, run_cache)
+        print(f"| {name} | {elapsed:.2f} | {total_mb / elapsed:.0f} |")
+    cache.print_stats()
+
+    # Concurrent jobs on a cache that only holds half the blobs: writes, reads and evictions overlap
+    shutil.rmtree(cache_dir)
+    max_bytes = NUM_BLOBS * np.prod(IMAGE_SHAPE) // 2
+    jobs = [multiprocessing.Process(target=job, args=(cache_dir, max_bytes, file_ids[::1 - 2 * (index % 2)],
+                                                      expected_sums)) for index in range(CONCURRENT_JOBS)]
+    for process in jobs:
+        process.start()
+    for process in jobs:
+        process.join()
+        assert process.exitcode == 0, "Concurrent job failed"
+    print(f"{CONCURRENT_JOBS} concurrent jobs read every blob intact through a shared, evicting cache")
+
+finally:
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    client.drop_database(DB)
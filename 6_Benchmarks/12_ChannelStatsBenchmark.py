@@ -0,0 +1,86 @@
+import time
+import shutil
+import tempfile
+import resource
+
+import numpy as np
+
+import benchmarkutils  # noqa: F401, puts the container scripts on sys.path
+from featurestore import FeatureStore, FeatureStoreWriter
+from samplearrays import COMPACT_DTYPES
+from channelstats import NORMALIZED_INPUTS, channel_stats, save_normalization, load_normalization
+
+# Feature store shaped like yestimation.py writes it (no images, they keep a fixed 1/255 scale):
+# 3-channel LiDAR projections, the 146-day weather grid and the dates, compact dtypes
+NUM_SAMPLES = 2000
+LIDAR_SHAPE = (100, 300, 3)
+WEATHER_SHAPE = (146, 8, 8)
+SHARD_SIZE = 256
+
+
+def synthetic_sample(rng):
+    return {
+        'lidar': (rng.uniform(0, 120, LIDAR_SHAPE) * [1, 0.5, 2]).astype(np.float32),
+        'weather': rng.normal(15, 8, WEATHER_SHAPE) + np.linspace(-10, 30, WEATHER_SHAPE[0])[:, None, None],
+        'seedingdate': float(rng.integers(120, 160)),
+        'imagedate': float(rng.integers(180, 240)),
+    }
+
+
+def full_array_stats(samples, indices):
+    """The host-side alternative: materialize the training split in float64 and reduce it at once."""
+    batch = samples.take(np.sort(indices), list(NORMALIZED_INPUTS))
+    stats = {}
+    for name, channel_axis in NORMALIZED_INPUTS.items():
+        array = batch[name].astype(np.float64)
+        if channel_axis is not None:
+            array = np.moveaxis(array, channel_axis % (array.ndim - 1) + 1, -1)
+        array = array.reshape(-1, 1 if channel_axis is None else array.shape[-1])
+        stats[name] = (array.mean(axis=0), array.var(axis=0))
+    return stats
+
+
+def peak_rss_gib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2
+
+
+rng = np.random.default_rng(0)
+sample_pool = [synthetic_sample(rng) for _ in range(32)]  # Reused, generating samples is not measured
+
+store_dir = tempfile.mkdtemp()
+store_path = f"{store_dir}/store"
+try:
+    writer = FeatureStoreWriter(store_path, SHARD_SIZE, COMPACT_DTYPES)
+    for index in range(NUM_SAMPLES):
+        writer.append(sample_pool[index % len(sample_pool)])
+    samples = writer.close({'fingerprint': 'benchmark'})
+    train_indices = rng.permutation(len(samples))[:int(0.8 * len(samples))]
+
+    print(f"{NUM_SAMPLES} samples, statistics of {len(train_indices)} training samples")
+    print("| Statistics | Time (s) | Peak RSS (GiB) |")
+    print("|------------|---------|----------------|")
+    results = {}
+    for name, workers in [("channel_stats, 1 thread", 1), ("channel_stats, 8 threads", 8)]:
+        start = time.perf_counter()
+        results[name] = channel_stats(samples, train_indices, NORMALIZED_INPUTS, workers=workers)
+        print(f"| {name} | {time.perf_counter() - start:.2f} | {peak_rss_gib():.2f} |")
+
+    start = time.perf_counter()
+    reference = full_array_stats(samples, train_indices)  # Last, its peak RSS would hide the others'
+    print(f"| Full float64 arrays | {time.perf_counter() - start:.2f} | {peak_rss_gib():.2f} |")
+
+    key = {'fingerprint': 'benchmark', 'watermark': None, 'samples': len(samples)}
+    save_normalization(f"{store_path}/normalization.json", key, {'train': train_indices},
+                       results["channel_stats, 8 threads"])
+    start = time.perf_counter()
+    _, saved = load_normalization(f"{store_path}/normalization.json", key)
+    print(f"| Saved with the store (later runs) | {time.perf_counter() - start:.2f} | - |")
+
+    # Same answers as the full-array reduction (float16/float32 inputs, so to ~1e-4 relative)
+    for stats in (*results.values(), saved):
+        for name, (mean, variance) in reference.items():
+            assert np.allclose(stats[name].mean, mean, rtol=1e-4, atol=1e-3), name
+            assert np.allclose(stats[name].variance, variance, rtol=1e-3), name
+
+finally:
+    shutil.rmtree(store_dir, ignore_errors=True)
@@ -0,0 +1,120 @@
+import numpy as np
+from sklearn.decomposition import PCA
+import cv2
+
+from benchmarkutils import synthetic_cloud, time_call
+from lidarprojection import projection3x
+
+# Point counts to benchmark; the per-point loop is only timed up to REFERENCE_MAX_POINTS
+POINT_COUNTS = [10_000, 100_000, 1_000_000, 5_000_000]
+REFERENCE_MAX_POINTS = 5_000_000
+REPEATS = 3
+# Random float32 clouds (random heading and extent) checked bit for bit against the loop
+NUM_FLOAT32_CLOUDS, FLOAT32_POINTS = 20, 50_000
+
+
+def projection3x_loop(lidar_raw):
+    """
+    Previous per-point implementation of projection3x, kept as the reference. Like projection3x,
+    it works on the float64 cloud (see ALIGNMENT in lidarprojection.py).
+    """
+    lidar_raw = lidar_raw.astype(np.float64)
+    x, y, z = lidar_raw[:, 0], lidar_raw[:, 1], lidar_raw[:, 2]
+    x = x * 100
+    y = y * 100
+    z = z * 100
+    x -= np.min(x)
+    y -= np.min(y)
+    z -= np.min(z)
+
+    points = np.vstack((x, y)).T
+    pca = PCA(n_components=2)
+    pca.fit(points)
+    angle = np.arctan2(pca.components_[0, 1], pca.components_[0, 0])
+    rotation_matrix = np.array([
+        [np.cos(-angle), -np.sin(-angle)],
+        [np.sin(-angle), np.cos(-angle)]
+    ])
+    rotated_points = points @ rotation_matrix.T
+    rotated_x, rotated_y = rotated_points[:, 0], rotated_points[:, 1]
+    rotated_x = np.max(rotated_x) - rotated_x
+    rotated_y = np.max(rotated_y) - rotated_y
+
+    x_min, x_max = np.min(rotated_x), np.max(rotated_x)
+    y_min, y_max = np.min(rotated_y), np.max(rotated_y)
+    z_min, z_max = np.min(z), np.max(z)
+    grid_xy = np.full((int(y_max - y_min) + 1, int(x_max - x_min) + 1), np.nan, dtype=np.float32)
+    grid_xz = np.full((int(z_max - z_min) + 1, int(x_max - x_min) + 1), np.nan, dtype=np.float32)
+    grid_yz = np.full((int(z_max - z_min) + 1, int(y_max - y_min) + 1), np.nan, dtype=np.float32)
+
+    for i in range(len(rotated_x)):
+        grid_x = int(rotated_x[i] - x_min)
+        grid_y = int(rotated_y[i] - y_min)
+        if np.isnan(grid_xy[grid_y, grid_x]):
+            grid_xy[grid_y, grid_x] = z[i]
+        else:
+            grid_xy[grid_y, grid_x] = max(grid_xy[grid_y, grid_x], z[i])
+    for i in range(len(rotated_x)):
+        grid_x = int(rotated_x[i] - x_min)
+        grid_z = int(z[i] - z_min)
+        if np.isnan(grid_xz[grid_z, grid_x]):
+            grid_xz[grid_z, grid_x] = z[i]
+        else:
+            grid_xz[grid_z, grid_x] = max(grid_xz[grid_z, grid_x], z[i])
+    for i in range(len(rotated_y)):
+        grid_y = int(rotated_y[i] - y_min)
+        grid_z = int(z[i] - z_min)
+        if np.isnan(grid_yz[grid_z, grid_y]):
+            grid_yz[grid_z, grid_y] = z[i]
+        else:
+            grid_yz[grid_z, grid_y] = max(grid_yz[grid_z, grid_y], z[i])
+
+    grid_xy = np.nan_to_num(grid_xy, nan=0.0)
+    grid_xz = np.nan_to_num(grid_xz, nan=0.0)
+    grid_yz = np.nan_to_num(grid_yz, nan=0.0)
+
+    return np.dstack((
+        cv2.resize(grid_xy, (300, 100), interpolation=cv2.INTER_NEAREST),
+        cv2.resize(grid_xz, (300, 100), interpolation=cv2.INTER_NEAREST),
+        cv2.resize(grid_yz, (300, 100), interpolation=cv2.INTER_NEAREST),
+    ))
+
+
+print("| Points | Loop (s) | Vectorized (s) | Speed-up | Bit-identical |")
+print("|-------|---------|---------------|---------|--------------|")
+for num_points in POINT_COUNTS:
+    lidar_raw = synthetic_cloud(num_points)
+    vectorized_time, vectorized = time_call(projection3x, lidar_raw, repeats=REPEATS)
+
+    if num_points <= REFERENCE_MAX_POINTS:
+        loop_time, loop = time_call(projection3x_loop, lidar_raw, repeats=1)
+        identical = np.array_equal(loop, vectorized) and loop.dtype == vectorized.dtype
+        print(f"| {num_points:,} | {loop_time:.2f} | {vectorized_time:.3f} | {loop_time / vectorized_time:.0f}x | {identical} |")
+    else:
+        print(f"| {num_points:,} | - | {vectorized_time:.3f} | - | - |")
+
+# float32 clouds, as stored by ingest: both paths align them in float64, so they must agree exactly
+rng = np.random.default_rng(0)
+identical = 0
+for seed in range(NUM_FLOAT32_CLOUDS):
+    cloud = synthetic_cloud(FLOAT32_POINTS, seed=seed, length_m=rng.uniform(1.5, 8.0), width_m=rng.uniform(0.5, 3.0))
+    heading = rng.uniform(-np.pi, np.pi)
+    rotation = np.array([[np.cos(heading), -np.sin(heading)], [np.sin(heading), np.cos(heading)]])
+    cloud[:, :2] = (cloud[:, :2] - cloud[:, :2].mean(axis=0)) @ rotation.T
+    cloud = cloud.astype(np.float32)
+    identical += np.array_equal(projection3x_loop(cloud), projection3x(cloud))
+print(f"\nfloat32 clouds bit-identical to the loop: {identical} of {NUM_FLOAT32_CLOUDS}")
+
+# Multi-channel rasterization: extra statistics share the per-plane cell indices
+CHANNEL_SPECS = [
+    ["xy:max", "xz:max", "yz:max"],
+    ["xy:max", "xz:max", "yz:max", "xy:mean", "xy:min", "xy:density"],
+    [f"{plane}:{stat}" for plane in ["xy", "xz", "yz"] for stat in ["max", "min", "mean", "count", "density"]],
+]
+lidar_raw = synthetic_cloud(1_000_000)
+classic_time, _ = time_call(projection3x, lidar_raw, repeats=REPEATS)
+print("\n| Channels (1M points) | Time (s) | vs. classic 3-channel |")
+print("|---------------------|---------|----------------------|")
+for channels in CHANNEL_SPECS:
+    channel_time, _ = time_call(projection3x, lidar_raw, channels=channels, repeats=REPEATS)
+    print(f"| {len(channels)} | {channel_time:.3f} | {channel_time / classic_time:.2f}x |")
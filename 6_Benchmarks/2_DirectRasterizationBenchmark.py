@@ -0,0 +1,42 @@
+import numpy as np
+
+from benchmarkutils import synthetic_cloud, time_call, peak_traced_bytes
+from lidarprojection import projection3x, rasterize_max
+
+# (label, points, length m, width m): a single plot up to a whole field strip
+CLOUDS = [
+    ("plot 5 x 1.5 m", 200_000, 5.0, 1.5),
+    ("strip 50 x 3 m", 1_000_000, 50.0, 3.0),
+    ("field 100 x 20 m", 2_000_000, 100.0, 20.0),
+]
+REPEATS = 3
+
+print("| Cloud | Mode | projection3x peak (MiB) | XY raster peak (MiB) | Time (s) |")
+print("|------|------|------------------------|---------------------|---------|")
+comparisons = []
+for label, num_points, length_m, width_m in CLOUDS:
+    lidar_raw = synthetic_cloud(num_points, length_m=length_m, width_m=width_m)
+
+    # 1 cm cells of the unrotated cloud, to isolate the memory that scales with the extent
+    cols = ((lidar_raw[:, 0] - lidar_raw[:, 0].min()) * 100).astype(np.int64)
+    rows = ((lidar_raw[:, 1] - lidar_raw[:, 1].min()) * 100).astype(np.int64)
+    grid_shape = (rows.max() + 1, cols.max() + 1)
+
+    projections = {}
+    for mode in ["resize", "direct"]:
+        peak, projections[mode] = peak_traced_bytes(projection3x, lidar_raw, mode=mode)
+        raster_peak, _ = peak_traced_bytes(rasterize_max, rows, cols, lidar_raw[:, 2], grid_shape, mode=mode)
+        elapsed, _ = time_call(projection3x, lidar_raw, mode=mode, repeats=REPEATS)
+        print(f"| {label} | {mode} | {peak / 1024 ** 2:.1f} | {raster_peak / 1024 ** 2:.1f} | {elapsed:.3f} |")
+
+    comparisons.append((label, projections["resize"], projections["direct"]))
+
+# Direct mode takes the maximum over each block instead of sampling one cell, so it can only
+# be greater or equal and fills pixels that INTER_NEAREST happened to sample from an empty cell
+print("\n| Cloud | Plane | Identical pixels (%) | Direct >= resize (%) | Filled resize (%) | Filled direct (%) | Mean abs diff (cm) |")
+print("|------|------|---------------------|---------------------|------------------|------------------|-------------------|")
+for label, resized, direct in comparisons:
+    for channel, plane in enumerate(["XY", "XZ", "YZ"]):
+        r, d = resized[..., channel], direct[..., channel]
+        print(f"| {label} | {plane} | {100 * np.mean(r == d):.1f} | {100 * np.mean(d >= r):.1f} | "
+              f"{100 * np.mean(r > 0):.1f} | {100 * np.mean(d > 0):.1f} | {np.mean(np.abs(d - r)):.2f} |")
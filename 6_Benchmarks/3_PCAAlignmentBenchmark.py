@@ -0,0 +1,77 @@
+import time
+
+import numpy as np
+from sklearn.decomposition import PCA
+
+from benchmarkutils import synthetic_cloud, time_call
+from lidarprojection import principal_angle, principal_angles, projection3x, aligned_coordinates
+
+# (number of clouds, points per cloud): full-density plots, then many small/downsampled clouds
+CONFIGS = [(200, 50_000), (2_000, 500)]
+REPEATS = 3
+
+
+def sklearn_angle(x, y, dtype=None):
+    """Previous alignment in projection3x; sklearn fits in the dtype of the points (float32 stays float32)."""
+    pca = PCA(n_components=2)
+    pca.fit(np.vstack((x, y)).T.astype(dtype or np.result_type(x, y)))
+    return np.arctan2(pca.components_[0, 1], pca.components_[0, 0])
+
+
+def projection3x_angle(cloud):
+    """Angle projection3x aligns the cloud with."""
+    return aligned_coordinates(cloud)[3]
+
+
+def plot_cloud(seed, num_points):
+    """Synthetic plot rotated to a random heading, so every sign-flip case is covered."""
+    rng = np.random.default_rng(seed)
+    cloud = synthetic_cloud(num_points, seed=seed, length_m=rng.uniform(1.5, 8.0), width_m=rng.uniform(0.5, 3.0))
+    heading = rng.uniform(-np.pi, np.pi)
+    rotation = np.array([[np.cos(heading), -np.sin(heading)], [np.sin(heading), np.cos(heading)]])
+    cloud[:, :2] = (cloud[:, :2] - cloud[:, :2].mean(axis=0)) @ rotation.T
+    return cloud
+
+
+print("| Clouds x points | Method | Time (s) | Max abs angle diff vs sklearn (rad) |")
+print("|----------------|-------|---------|------------------------------------|")
+for num_clouds, points_per_cloud in CONFIGS:
+    clouds = [plot_cloud(seed, points_per_cloud) for seed in range(num_clouds)]
+    # Same preprocessing as projection3x before the PCA
+    xy = [(cloud[:, 0] * 100 - np.min(cloud[:, 0] * 100), cloud[:, 1] * 100 - np.min(cloud[:, 1] * 100))
+          for cloud in clouds]
+    label = f"{num_clouds:,} x {points_per_cloud:,}"
+
+    start = time.perf_counter()
+    reference = np.array([sklearn_angle(x, y) for x, y in xy])
+    print(f"| {label} | sklearn PCA per cloud | {time.perf_counter() - start:.3f} | - |")
+
+    closed_form_time, closed_form = time_call(lambda: np.array([principal_angle(x, y) for x, y in xy]),
+                                              repeats=REPEATS)
+    print(f"| {label} | principal_angle per cloud | {closed_form_time:.3f} | "
+          f"{np.max(np.abs(closed_form - reference)):.2e} |")
+
+    batched_time, batched = time_call(principal_angles, [np.column_stack(pair) for pair in xy], repeats=REPEATS)
+    print(f"| {label} | principal_angles batched | {batched_time:.3f} | {np.max(np.abs(batched - reference)):.2e} |")
+
+# float32 clouds: projection3x aligns them in float64 (ALIGNMENT), so the closed-form angle must
+# match sklearn on the float64 points, and the rasterized projections must be identical. The
+# previous float32 fit is shown for comparison. Compare the pixels, not just the angles.
+NUM_FLOAT32_CLOUDS, FLOAT32_POINTS = 50, 50_000
+print("\n| float32 clouds | Reference | Max abs angle diff (rad) | Identical pixels (%) | Clouds with differing pixels |")
+print("|---------------|----------|-------------------------|---------------------|-----------------------------|")
+clouds = [plot_cloud(seed, FLOAT32_POINTS).astype(np.float32) for seed in range(NUM_FLOAT32_CLOUDS)]
+for reference_label, dtype in [("sklearn PCA in float64 (canonical, ALIGNMENT)", np.float64),
+                               ("sklearn PCA in float32 (before ALIGNMENT)", np.float32)]:
+    angle_diffs, identical, differing = [], [], 0
+    for cloud in clouds:
+        points = cloud.astype(dtype)  # Preprocessing of the reference before the PCA, in its dtype
+        x, y = points[:, 0] * 100, points[:, 1] * 100
+        x, y = x - np.min(x), y - np.min(y)
+        reference_angle = sklearn_angle(x, y)
+        angle_diffs.append(abs(projection3x_angle(cloud) - reference_angle))
+        same = projection3x(cloud, angle=reference_angle) == projection3x(cloud)
+        identical.append(np.mean(same))
+        differing += not same.all()
+    print(f"| {NUM_FLOAT32_CLOUDS} x {FLOAT32_POINTS:,} | {reference_label} | {max(angle_diffs):.2e} | "
+          f"{100 * np.mean(identical):.4f} | {differing} |")
@@ -0,0 +1,52 @@
+import io
+
+import numpy as np
+
+from benchmarkutils import surface_cloud, synthetic_cloud, time_call
+from lidarprojection import projection3x, voxel_downsample
+
+# (label, generator, points): dense canopy-surface scans and the volume-filling synthetic cloud
+CLOUDS = [
+    ("surface", surface_cloud, 1_000_000),
+    ("surface", surface_cloud, 5_000_000),
+    ("volume", synthetic_cloud, 1_000_000),
+]
+VOXEL_SIZES = [0.5, 1]  # cm, divisors of the 1 cm projection resolution
+MAX_CHANNELS = ["xy:max", "xz:max", "yz:max"]
+REPEATS = 3
+
+
+def npy_bytes(array):
+    """Size of the array as stored in GridFS with np.save."""
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.tell()
+
+
+print("| Cloud | Points | Voxel (cm) | Kept | Blob (MiB) | Downsample (s) | Projection (s) | Identical resize / direct |")
+print("|------|-------|-----------|-----|-----------|---------------|---------------|--------------------------|")
+for label, generator, num_points in CLOUDS:
+    lidar_raw = generator(num_points)
+    full_time, full = time_call(projection3x, lidar_raw, channels=MAX_CHANNELS, repeats=REPEATS)
+    full_direct = projection3x(lidar_raw, channels=MAX_CHANNELS, mode="direct")
+    print(f"| {label} | {num_points:,} | - | 100% | {npy_bytes(lidar_raw) / 1024 ** 2:.1f} | - | {full_time:.3f} | - |")
+
+    for voxel_size in VOXEL_SIZES:
+        downsample_time, (reduced, angle) = time_call(voxel_downsample, lidar_raw, voxel_size, repeats=REPEATS)
+        reduced_time, projection = time_call(projection3x, reduced, channels=MAX_CHANNELS, angle=angle,
+                                             repeats=REPEATS)
+        direct = projection3x(reduced, channels=MAX_CHANNELS, mode="direct", angle=angle)
+        identical = f"{np.array_equal(full, projection)} / {np.array_equal(full_direct, direct)}"
+        print(f"| {label} | {num_points:,} | {voxel_size} | {100 * len(reduced) / num_points:.0f}% | "
+              f"{npy_bytes(reduced) / 1024 ** 2:.1f} | {downsample_time:.3f} | {reduced_time:.3f} | {identical} |")
+
+# Statistics other than the maximum are not preserved, and without the stored angle neither is the alignment
+lidar_raw = surface_cloud(1_000_000)
+reduced, angle = voxel_downsample(lidar_raw, 1)
+for description, kwargs in [
+    ("xy:mean with stored angle", {"channels": ["xy:mean"], "angle": angle}),
+    ("xy:max without stored angle", {"channels": ["xy:max"]}),
+]:
+    full = projection3x(lidar_raw, **{**kwargs, "angle": None})
+    agreement = np.mean(full == projection3x(reduced, **kwargs))
+    print(f"\n{description}: {100 * agreement:.1f}% of pixels identical")
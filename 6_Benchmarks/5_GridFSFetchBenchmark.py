@@ -0,0 +1,122 @@
+import asyncio
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+import pymongo
+from gridfs import GridFS
+from pymongo import AsyncMongoClient
+
+import benchmarkutils  # noqa: F401, puts the container scripts on sys.path
+from gridfsfetch import fetch_pool, fetch_ordered, read_array, read_arrays, batched
+from asyncloader import stream_samples
+
+# Needs a running mongod; the benchmark database is created and dropped
+MONGO_URI = os.environ.get("BENCHMARK_MONGO_URI", "mongodb://localhost:27017/")
+DB = "GridFSFetchBenchmark"
+NUM_DOCUMENTS = 200
+PAIRS_PER_DOCUMENT = 4
+IMAGE_SHAPE = (512, 612, 3)  # RGB/NIR blobs as stored by InsertData2MongoDB
+WEATHER_SHAPE = (146, 8, 8)
+LIDAR_POINTS = 200_000
+WORKER_COUNTS = [1, 4, 16, 32, 64]
+BULK_WORKERS = 32
+BULK_BATCH_SIZES = [1, 8, 32]  # Blobs per read_arrays call
+ASYNC_CONCURRENCY = [16, 64, 256]  # Bulk reads in flight in stream_samples
+
+
+def put_array(fs, array):
+    buffer = BytesIO()
+    np.save(buffer, array)
+    buffer.seek(0)
+    return fs.put(buffer)
+
+
+def document_file_ids(document):
+    """Every GridFS read the loader issues for a document, one weather and LiDAR read per pair."""
+    file_ids = []
+    for rgb_id, nir_id in zip(document["rgbimage_ids"], document["nirimage_ids"]):
+        file_ids += [rgb_id, nir_id, document["weather_id"], document["lidar_id"]]
+    return file_ids
+
+
+async def stream_all(concurrency):
+    """Consumes stream_samples over the benchmark collection, returns (samples, failed inputs)."""
+    async_client = AsyncMongoClient(MONGO_URI)
+    try:
+        async_db = async_client[DB]
+        samples, errors = 0, 0
+        async for sample in stream_samples(async_db, async_db["documents"], {}, concurrency=concurrency):
+            samples += 1
+            errors += sum(isinstance(sample[key], Exception) for key in ("rgb", "nir", "weather", "lidar"))
+        return samples, errors
+    finally:
+        await async_client.close()
+
+
+client = pymongo.MongoClient(MONGO_URI)
+client.drop_database(DB)
+db = client[DB]
+fs = GridFS(db)
+rng = np.random.default_rng(0)
+
+print(f"Writing {NUM_DOCUMENTS} documents to {MONGO_URI}{DB}...")
+image = rng.integers(0, 255, IMAGE_SHAPE, dtype=np.uint8)
+weather_ids = [put_array(fs, rng.normal(size=WEATHER_SHAPE)) for _ in range(10)]
+documents = []
+for index in range(NUM_DOCUMENTS):
+    documents.append({
+        "rgbimage_ids": [put_array(fs, image) for _ in range(PAIRS_PER_DOCUMENT)],
+        "nirimage_ids": [put_array(fs, image[..., 0]) for _ in range(PAIRS_PER_DOCUMENT)],
+        "weather_id": weather_ids[index % len(weather_ids)],
+        "lidar_id": put_array(fs, rng.normal(size=(LIDAR_POINTS, 3))),
+    })
+db["documents"].insert_many([dict(document) for document in documents])
+
+try:
+    file_ids = [file_id for document in documents for file_id in document_file_ids(document)]
+
+    start = time.perf_counter()
+    for file_id in file_ids:
+        read_array(fs, file_id)
+    sequential_time = time.perf_counter() - start
+
+    print("\n| Fetch | Workers | Time (s) | Documents/sec | Speed-up |")
+    print("|------|--------|---------|--------------|---------|")
+    print(f"| sequential fs.get | 1 | {sequential_time:.2f} | {NUM_DOCUMENTS / sequential_time:.1f} | 1.0x |")
+    for workers in WORKER_COUNTS:
+        executor = fetch_pool(workers)
+        start = time.perf_counter()
+        results = fetch_ordered(lambda file_id: read_array(fs, file_id), file_ids, executor, max_in_flight=4 * workers)
+        errors = sum(isinstance(result, Exception) for result in results)
+        elapsed = time.perf_counter() - start
+        executor.shutdown()
+        assert errors == 0, f"{errors} failed fetches"
+        print(f"| fetch_ordered | {workers} | {elapsed:.2f} | {NUM_DOCUMENTS / elapsed:.1f} | "
+              f"{sequential_time / elapsed:.1f}x |")
+
+    # Bulk fs.files / fs.chunks reads, batches spread over the fetch pool
+    for batch_size in BULK_BATCH_SIZES:
+        executor = fetch_pool(BULK_WORKERS)
+        start = time.perf_counter()
+        batches = fetch_ordered(lambda batch: read_arrays(db, batch), batched(file_ids, batch_size), executor,
+                                max_in_flight=4 * BULK_WORKERS)
+        errors = sum(isinstance(result, Exception) for batch in batches for result in batch.values())
+        elapsed = time.perf_counter() - start
+        executor.shutdown()
+        assert errors == 0, f"{errors} failed fetches"
+        print(f"| read_arrays x{batch_size} | {BULK_WORKERS} | {elapsed:.2f} | {NUM_DOCUMENTS / elapsed:.1f} | "
+              f"{sequential_time / elapsed:.1f}x |")
+
+    # asyncio loader: weather and LiDAR are read once per document instead of once per pair
+    for concurrency in ASYNC_CONCURRENCY:
+        start = time.perf_counter()
+        samples, errors = asyncio.run(stream_all(concurrency))
+        elapsed = time.perf_counter() - start
+        assert errors == 0 and samples == NUM_DOCUMENTS * PAIRS_PER_DOCUMENT, f"{errors} failed fetches"
+        print(f"| stream_samples (asyncio) | {concurrency} reads | {elapsed:.2f} | {NUM_DOCUMENTS / elapsed:.1f} | "
+              f"{sequential_time / elapsed:.1f}x |")
+
+finally:
+    client.drop_database(DB)
@@ -0,0 +1,54 @@
+import subprocess
+import sys
+
+import numpy as np
+
+import benchmarkutils  # noqa: F401, puts the container scripts on sys.path
+from samplearrays import SampleArrays, IMAGE_DTYPES, COMPACT_DTYPES, peak_rss_bytes
+
+# Per-sample inputs as produced by the loaders: resized RGB/NIR, LiDAR projection, weather
+NUM_SAMPLES = 200
+INPUT_SHAPES = {
+    "rgb": ((512, 612, 3), np.uint8),
+    "nir": ((512, 612, 1), np.uint8),
+    "lidar": ((100, 300, 3), np.float32),
+    "weather": ((146, 8, 8), np.float64),
+}
+MODES = {
+    "lists + np.array": dict(preallocate=False, rescale=False),
+    "lists + np.array / 255, / 150 (host-side scaling)": dict(preallocate=False, rescale=True),
+    "preallocated uint8 images": dict(preallocate=True, rescale=False),
+    "preallocated compact (uint8 images, float16 LiDAR/weather)": dict(preallocate=True, rescale=False, compact=True),
+}
+
+
+def load(preallocate, rescale, compact=False):
+    """Fills the inputs like the loader loop and returns the final arrays."""
+    rng = np.random.default_rng(0)
+    templates = {name: rng.integers(0, 255, shape).astype(dtype) for name, (shape, dtype) in INPUT_SHAPES.items()}
+
+    samples = SampleArrays(NUM_SAMPLES, COMPACT_DTYPES if compact else IMAGE_DTYPES, preallocate=preallocate)
+    for _ in range(NUM_SAMPLES):
+        samples.append({name: template.copy() for name, template in templates.items()})  # Fresh arrays per sample
+
+    arrays = {name: samples[name] for name in INPUT_SHAPES}
+    if rescale:
+        arrays["rgb"] = arrays["rgb"] / 255
+        arrays["nir"] = arrays["nir"] / 255
+        arrays["lidar"] = arrays["lidar"] / 150
+    return arrays
+
+
+if len(sys.argv) > 1:  # Child process: one mode, so ru_maxrss only covers that mode
+    baseline = peak_rss_bytes()
+    arrays = load(**MODES[sys.argv[1]])
+    print(peak_rss_bytes() - baseline, sum(array.nbytes for array in arrays.values()))
+    sys.exit()
+
+print(f"| Mode ({NUM_SAMPLES} samples) | Bytes per sample (KiB) | Final arrays (MiB) | Peak RSS growth (MiB) | Peak / final |")
+print("|------|----------------------|-------------------|----------------------|-------------|")
+for mode in MODES:
+    output = subprocess.run([sys.executable, __file__, mode], capture_output=True, text=True, check=True).stdout
+    peak, final = (int(value) for value in output.split())
+    print(f"| {mode} | {final / NUM_SAMPLES / 1024:.0f} | {final / 1024 ** 2:.0f} | {peak / 1024 ** 2:.0f} | "
+          f"{peak / final:.2f} |")
@@ -0,0 +1,53 @@
+import numpy as np
+
+from benchmarkutils import surface_cloud, time_call  # Also puts the container scripts on sys.path
+from blobcodec import available_codecs, encode_array, decode_blob, png_supported, npy_bytes
+from imagepyramid import downscale
+
+# Blobs as stored at ingest: a camera image and a pyramid level, a LiDAR cloud and a weather grid.
+# Compression ratios depend on the content: smooth fields with sensor noise stand in for real data,
+# run the benchmark on exported blobs for exact numbers.
+IMAGE_SHAPE = (2048, 2448, 3)
+NUM_POINTS = 1_000_000
+WEATHER_SHAPE = (146, 8, 8)
+
+
+def synthetic_image(shape, seed=0, noise=4.0):
+    """Smooth uint8 image with Gaussian sensor noise, like a canopy photo."""
+    rng = np.random.default_rng(seed)
+    rows, cols = np.meshgrid(np.linspace(0, 8, shape[0]), np.linspace(0, 8, shape[1]), indexing="ij")
+    base = 110 + 60 * np.sin(rows) * np.cos(1.3 * cols)
+    channels = [base + 20 * channel + rng.normal(0, noise, shape[:2]) for channel in range(shape[2])]
+    return np.clip(np.stack(channels, axis=-1), 0, 255).astype(np.uint8)
+
+
+def synthetic_weather(shape, seed=0):
+    """Daily weather variables on a small grid: slow trends over days plus noise, float64 like upload_npy."""
+    rng = np.random.default_rng(seed)
+    days = np.arange(shape[0])[:, None, None]
+    return 15 + 10 * np.sin(days / 30) + rng.normal(0, 2, shape)
+
+
+image = synthetic_image(IMAGE_SHAPE)
+blobs = {
+    f"RGB image {IMAGE_SHAPE}": image,
+    "RGB pyramid level 1/4": downscale(image, 4),
+    f"LiDAR cloud ({NUM_POINTS} points)": surface_cloud(NUM_POINTS),
+    f"weather {WEATHER_SHAPE}": synthetic_weather(WEATHER_SHAPE),
+}
+
+codecs = available_codecs()
+print(f"Codecs available: {', '.join(codecs)} (install zstandard / lz4 for the others)")
+print("| Blob | Codec | Size (MiB) | Size vs raw | Encode (MB/s) | Decode (MB/s) | Lossless |")
+print("|------|-------|-----------|-------------|---------------|---------------|----------|")
+for name, array in blobs.items():
+    raw_size = len(npy_bytes(array))
+    for codec in codecs:
+        if codec == "png" and not png_supported(array):
+            continue
+        encode_time, (blob, metadata) = time_call(encode_array, array, codec)
+        decode_time, decoded = time_call(decode_blob, blob, metadata)
+        # Throughput in MB of decoded array per second, what the loaders see
+        print(f"| {name} | {codec} | {len(blob) / 1024 ** 2:.2f} | {len(blob) / raw_size:.2f} | "
+              f"{array.nbytes / 1e6 / encode_time:.0f} | {array.nbytes / 1e6 / decode_time:.0f} | "
+              f"{np.array_equal(decoded, array)} |")
@@ -0,0 +1,91 @@
+import os
+import time
+
+import numpy as np
+import pymongo
+from bson import ObjectId
+
+import benchmarkutils  # noqa: F401, puts the container scripts on sys.path
+from eligibility import update_eligibility, eligibility_query, explain_summary
+
+# Needs a running mongod; the benchmark database is created and dropped
+MONGO_URI = os.environ.get("BENCHMARK_MONGO_URI", "mongodb://localhost:27017/")
+DB = "EligibilityQueryBenchmark"
+NUM_DOCUMENTS = 200_000
+YEARS = [2022, 2023, 2024]
+LOCATIONS = ["Ottawa", "Saskatoon", "Lethbridge"]
+MISSING_RATE = 0.1  # Chance of every input or label being missing (or NaN for labels)
+
+# Former criteria of yestimation.py
+LEGACY_CRITERIA = {
+    "$and": [
+        {"year": 2024},
+        {"rgbimage_ids": {"$exists": True, "$not": {"$size": 0}}},
+        {"nirimage_ids": {"$exists": True, "$not": {"$size": 0}}},
+        {"seedingdate": {"$exists": True}},
+        {"weather_id": {"$exists": True}},
+        {"lidar_id": {"$exists": True}},
+        {"yield": {"$exists": True, "$ne": float("NaN")}},
+        {"$expr": {"$eq": [{"$size": "$rgbimage_ids"}, {"$size": "$nirimage_ids"}]}},
+        {"$expr": {"$lt": [{"$size": "$rgbimage_ids"}, 10]}},
+    ]
+}
+CRITERIA = eligibility_query(year=2024, labels=("yield",), max_images=10)
+
+
+def synthetic_document(rng):
+    """Plot document like InsertData2MongoDB writes, with randomly missing inputs and labels."""
+    pairs = int(rng.integers(0, 12))
+    document = {
+        "year": int(rng.choice(YEARS)),
+        "location": str(rng.choice(LOCATIONS)),
+        "plot": int(rng.integers(0, 5000)),
+        "rgbimage_ids": [ObjectId() for _ in range(pairs)],
+        "nirimage_ids": [ObjectId() for _ in range(pairs - (rng.random() < MISSING_RATE))],
+    }
+    for field in ("seedingdate", "weather_id", "lidar_id"):
+        if rng.random() >= MISSING_RATE:
+            document[field] = ObjectId() if field.endswith("_id") else float(rng.integers(120, 160))
+    for label in ("yield", "flowering", "maturity"):
+        if rng.random() >= MISSING_RATE:
+            document[label] = float("NaN") if rng.random() < MISSING_RATE else float(rng.normal(3000, 500))
+    return document
+
+
+def run(collection, query):
+    """Selected ids, count time and the explain() summary of selecting ids."""
+    start = time.perf_counter()
+    count = collection.count_documents(query)
+    count_time = time.perf_counter() - start
+    ids = {document["_id"] for document in collection.find(query, {"_id": 1})}
+    assert count == len(ids)
+    return ids, count_time, explain_summary(collection.find(query, {"_id": 1}).explain())
+
+
+client = pymongo.MongoClient(MONGO_URI)
+client.drop_database(DB)
+collection = client[DB]["documents"]
+rng = np.random.default_rng(0)
+
+print(f"Writing {NUM_DOCUMENTS} documents to {MONGO_URI}{DB}...")
+collection.insert_many([synthetic_document(rng) for _ in range(NUM_DOCUMENTS)])
+
+try:
+    legacy_ids, legacy_count_time, legacy = run(collection, LEGACY_CRITERIA)
+
+    start = time.perf_counter()
+    update_eligibility(collection)
+    print(f"Eligibility fields and index added in {time.perf_counter() - start:.1f} s")
+    ids, count_time, indexed = run(collection, CRITERIA)
+    assert ids == legacy_ids, "Eligibility query selects different documents"
+    assert indexed["docs_examined"] == 0, "Selecting ids is not covered by the eligibility index"
+
+    print("\n| Query | Plan | Keys examined | Documents examined | Returned | Find ids (ms) | Count (ms) |")
+    print("|------|------|--------------|-------------------|----------|--------------|-----------|")
+    for name, summary, elapsed in [("$exists / $size / $expr", legacy, legacy_count_time),
+                                   ("eligibility fields", indexed, count_time)]:
+        print(f"| {name} | {' <- '.join(summary['stages'])} | {summary['keys_examined']} | "
+              f"{summary['docs_examined']} | {summary['returned']} | {summary['time_ms']} | {1000 * elapsed:.0f} |")
+
+finally:
+    client.drop_database(DB)
@@ -0,0 +1,111 @@
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+import cv2
+import numpy as np
+import pymongo
+from gridfs import GridFS
+
+from benchmarkutils import surface_cloud  # Also puts the container scripts on sys.path
+from blobcodec import encode_array
+from eligibility import eligibility_fields, eligibility_query
+from documentselection import document_batches
+from featurestore import FeatureStore, FeatureStoreWriter
+from gridfsfetch import read_arrays
+from incrementalbuild import document_checksum, store_watermark
+from lidarprojection import projection3x
+from shardedextraction import extraction_shard, shard_criteria, part_path, merge_parts
+
+# Needs a running mongod; the benchmark database is created and dropped. Every process of a run
+# extracts its shard against the same mongod, like the array tasks of SubmitExtraction.sh on a node.
+MONGO_URI = os.environ.get("BENCHMARK_MONGO_URI", "mongodb://localhost:27017/")
+DB = "ShardedExtractionBenchmark"
+NUM_DOCUMENTS = 400
+IMAGE_SHAPE = (512, 612, 3)
+LIDAR_POINTS = 200_000
+TARGET_SIZE = (128, 153)
+PROCESS_COUNTS = [1, 2, 4, 8]
+CRITERIA = eligibility_query(labels=("yield",))
+
+
+def put_array(fs, array, codec="raw"):
+    blob, metadata = encode_array(array, codec)
+    return fs.put(blob, metadata=metadata)
+
+
+def extract(environ, path):
+    """One extraction task: fetch, resize and project the documents of its shard into its part."""
+    shard, shards, before = extraction_shard(environ)
+    client = pymongo.MongoClient(MONGO_URI)
+    db = client[DB]
+    criteria = shard_criteria(db["documents"], CRITERIA, shard, shards, before)
+    samples = FeatureStoreWriter(part_path(path, shard, shards), shard_size=64)
+    loaded_ids = []
+    for block in document_batches(db["documents"], criteria, batch_size=16):
+        loaded_ids += [document['_id'] for document in block]
+        arrays = read_arrays(db, [document[field] for document in block for field in ("rgb_id", "lidar_id")])
+        for document in block:
+            samples.append({
+                'plot': document['plot'],
+                'rgb': cv2.resize(arrays[document['rgb_id']], TARGET_SIZE[::-1], interpolation=cv2.INTER_AREA),
+                'lidar': projection3x(arrays[document['lidar_id']]),
+            })
+    samples.close({'fingerprint': "benchmark", 'shard': shard, 'shards': shards, 'before': str(before),
+                   'base_watermark': None, 'watermark': None, 'documents': document_checksum(loaded_ids)})
+    client.close()
+
+
+client = pymongo.MongoClient(MONGO_URI)
+client.drop_database(DB)
+db = client[DB]
+fs = GridFS(db)
+rng = np.random.default_rng(0)
+
+print(f"Writing {NUM_DOCUMENTS} documents to {MONGO_URI}{DB}...")
+image = rng.integers(0, 255, IMAGE_SHAPE, dtype=np.uint8)
+documents = []
+for plot in range(NUM_DOCUMENTS):
+    document = {
+        "plot": plot, "rgb_id": put_array(fs, image), "lidar_id": put_array(fs, surface_cloud(LIDAR_POINTS, seed=plot)),
+        "rgbimage_ids": [plot], "nirimage_ids": [plot], "seedingdate": 0,
+        "weather_id": 0, "yield": float(rng.normal(3000, 500)),
+    }
+    documents.append({**document, **eligibility_fields(document)})
+db["documents"].insert_many(documents)
+extract_before = str(int(time.time()) + 1)  # Every document was inserted before the cutoff
+time.sleep(1)
+
+work_dir = tempfile.mkdtemp()
+try:
+    print("| Processes | Extraction (s) | Merge (ms) | Documents/sec | Samples | Shard sizes |")
+    print("|-----------|---------------|-----------|---------------|---------|-------------|")
+    for processes in PROCESS_COUNTS:
+        path = os.path.join(work_dir, f"store-{processes}")
+        tasks = [multiprocessing.Process(target=extract, args=(
+                     {"EXTRACT_SHARD": str(shard), "EXTRACT_SHARDS": str(processes), "EXTRACT_BEFORE": extract_before},
+                     path)) for shard in range(processes)]
+        start = time.perf_counter()
+        for task in tasks:
+            task.start()
+        for task in tasks:
+            task.join()
+            assert task.exitcode == 0, "Extraction task failed"
+        extraction_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = merge_parts(path, "benchmark", None)
+        merge_time = time.perf_counter() - start
+        plots = store.take(np.arange(len(store)), ['plot'])['plot']
+        assert sorted(plots.tolist()) == list(range(NUM_DOCUMENTS)), "Shards do not partition the documents"
+        assert FeatureStore(path).metadata['watermark'] is not None
+        # The checksum of the merged parts matches every document the query selects
+        assert store_watermark(path, "benchmark", db["documents"], CRITERIA, remove_stale=False) is not None
+        print(f"| {processes} | {extraction_time:.1f} | {1000 * merge_time:.1f} | "
+              f"{NUM_DOCUMENTS / extraction_time:.0f} | {len(store)} | {store.shard_counts} |")
+
+finally:
+    shutil.rmtree(work_dir)
+    client.drop_database(DB)
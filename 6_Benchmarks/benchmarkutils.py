@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# Shared helpers live next to the container scripts
+SCRIPTS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..", "2_Containers", "trainingcontainer_sandbox", "home", "ubuntu", "scripts"
+)
+sys.path.append(os.path.abspath(SCRIPTS_PATH))
+
+
+def synthetic_cloud(num_points, seed=0, dtype=np.float64, length_m=5.0, width_m=1.5):
+    """
+    Generates a plot-like LiDAR point cloud: a rotated strip (5 m x 1.5 m by default) with canopy up to 1.2 m.
+
+    Args:
+        num_points (int): Number of points to generate.
+        seed (int): Random seed for reproducibility.
+        dtype: Floating point dtype of the returned array.
+        length_m (float): Length of the strip in meters.
+        width_m (float): Width of the strip in meters.
+
+    Returns:
+        numpy array: Point cloud of shape (num_points, 3) with x, y, z in meters.
+    """
+    rng = np.random.default_rng(seed)
+    length = rng.uniform(0, length_m, num_points)
+    width = rng.uniform(0, width_m, num_points)
+    height = np.abs(rng.normal(0.6, 0.3, num_points)).clip(0, 1.2)
+
+    # Rotate the strip so the PCA alignment has work to do
+    angle = np.deg2rad(25)
+    x = 350000.0 + length * np.cos(angle) - width * np.sin(angle)  # UTM-like offsets
+    y = 5000000.0 + length * np.sin(angle) + width * np.cos(angle)
+    z = 80.0 + height
+
+    return np.column_stack((x, y, z)).astype(dtype)
+
+
+def surface_cloud(num_points, seed=0, dtype=np.float64, length_m=5.0, width_m=1.5, noise_m=0.02):
+    """
+    Generates a dense scan of a canopy surface: like synthetic_cloud, but points lie on a smooth
+    height field with noise_m of scatter, as a LiDAR sees the top of the canopy. Unlike a volume of
+    random points, repeated hits land in the same voxels, which is what voxel downsampling exploits.
+    """
+    rng = np.random.default_rng(seed)
+    length = rng.uniform(0, length_m, num_points)
+    width = rng.uniform(0, width_m, num_points)
+    height = 0.6 + 0.3 * np.sin(3 * length) * np.cos(4 * width) + rng.normal(0, noise_m, num_points)
+
+    angle = np.deg2rad(25)
+    x = 350000.0 + length * np.cos(angle) - width * np.sin(angle)
+    y = 5000000.0 + length * np.sin(angle) + width * np.cos(angle)
+    z = 80.0 + height
+
+    return np.column_stack((x, y, z)).astype(dtype)
+
+
+def time_call(func, *args, repeats=3, **kwargs):
+    """
+    Times a function call and returns the best wall-clock time in seconds with the last result.
+    """
+    best, result = np.inf, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_traced_bytes(func, *args, **kwargs):
+    """
+    Runs a function under tracemalloc and returns (peak bytes allocated during the call, result).
+
+    NumPy reports its buffers to tracemalloc, so this covers the intermediate grids.
+    """
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
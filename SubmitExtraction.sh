@@ -0,0 +1,19 @@
+#!/bin/bash -l
+# Sharded feature-store extraction, one array task per shard, all on the node running mongod
+# (it only listens on localhost). EXTRACT_BEFORE is fixed at submission, so every task, requeued
+# ones included, partitions the same documents:
+#   sbatch -p <partition> --nodelist=<node> --array=0-3 --export=ALL,EXTRACT_BEFORE=$(date +%s) SubmitExtraction.sh
+# Once every task is done, SubmitJob.sh on the same node merges the parts and trains.
+: "${EXTRACT_BEFORE:?Submit with --export=ALL,EXTRACT_BEFORE=\$(date +%s)}"
+
+cd /fs/phenocart-app/prr000/Projects/Training/2_Containers
+apptainer exec \
+   --nv \
+   --fakeroot \
+   --bind /fs:/mnt \
+   --bind /tmp:/localscratch \
+   --contain \
+   --no-home \
+   --env EXTRACT_BEFORE=${EXTRACT_BEFORE},SLURM_ARRAY_TASK_ID=${SLURM_ARRAY_TASK_ID},SLURM_ARRAY_TASK_MIN=${SLURM_ARRAY_TASK_MIN},SLURM_ARRAY_TASK_COUNT=${SLURM_ARRAY_TASK_COUNT} \
+   trainingcontainer_sandbox/ \
+   bash -c ". /home/venv/bin/activate && python /home/ubuntu/scripts/yestimation.py"
@@ -5,6 +5,7 @@ apptainer exec \
    --nv \
    --fakeroot \
    --bind /fs:/mnt \
+   --bind /tmp:/localscratch \
    --contain \
    --no-home \
    trainingcontainer_sandbox/ \